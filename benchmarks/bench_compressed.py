@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compares reading compressed files with common.np_float_array_from_file (decompressing as the file is read) with
+first decompressing them to disk and then reading the decompressed file.
+"""
+
+from __future__ import print_function
+
+import argparse
+import bz2
+import gzip
+import lzma
+import os
+import shutil
+import sys
+import tempfile
+import time
+from che696_examples.common import (np_float_array_from_file, warning, zstandard, COMPRESSION_OPENERS,
+                                    GZIP, BZ2, XZ, ZSTD, GOOD_RET, INPUT_ERROR)
+from bench_np_float_array import make_mixed_file
+
+__author__ = 'hmayes'
+
+# Defaults
+DEF_NUM_ROWS = 1000000
+DEF_NUM_COLS = 5
+COMPRESSORS = {GZIP: (gzip.open, '.gz'), BZ2: (bz2.open, '.bz2'), XZ: (lzma.open, '.xz')}
+if zstandard is not None:
+    COMPRESSORS[ZSTD] = (zstandard.open, '.zst')
+
+
+def compress_file(f_name, compression):
+    """
+    @return: the name of the compressed copy of the file
+    """
+    opener, ext = COMPRESSORS[compression]
+    with open(f_name, 'rb') as f_in:
+        with opener(f_name + ext, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+    return f_name + ext
+
+
+def time_decompress_then_read(comp_name, f_name, compression, numeric, repeats=1):
+    """
+    @return: the best wall time (s) to decompress the file to disk and then read the decompressed file
+    """
+    best = None
+    for _ in range(repeats):
+        start = time.time()
+        with COMPRESSION_OPENERS[compression](comp_name, 'rb') as f_in:
+            with open(f_name, 'wb') as f_out:
+                shutil.copyfileobj(f_in, f_out)
+        np_float_array_from_file(f_name, delimiter=',', header=True, gather_hist=not numeric)
+        elapsed = time.time() - start
+        os.remove(f_name)
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def time_read(f_name, numeric, repeats=1):
+    """
+    @return: the best wall time (s) to read the file with np_float_array_from_file
+    """
+    best = None
+    for _ in range(repeats):
+        start = time.time()
+        np_float_array_from_file(f_name, delimiter=',', header=True, gather_hist=not numeric)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def parse_cmdline(argv):
+    """
+    Returns the parsed argument list and return code.
+    `argv` is a list of arguments, or `None` for ``sys.argv[1:]``.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(description='Times reading compressed files directly and after first '
+                                                 'decompressing them to disk.')
+    parser.add_argument("-r", "--rows", help="Number of rows. Default is {}.".format(DEF_NUM_ROWS),
+                        type=int, default=DEF_NUM_ROWS)
+    parser.add_argument("-c", "--cols", help="Number of float columns. Default is {}.".format(DEF_NUM_COLS),
+                        type=int, default=DEF_NUM_COLS)
+    parser.add_argument("-n", "--repeats", help="Number of timings per file (best is reported). Default is 1.",
+                        type=int, default=1)
+    parser.add_argument("--mixed", help="Include a non-numeric column (read with the csv reader).",
+                        action='store_true')
+    args = None
+    try:
+        args = parser.parse_args(argv)
+    except SystemExit as e:
+        if hasattr(e, 'code') and e.code == 0:
+            return args, GOOD_RET
+        warning(e)
+        parser.print_help()
+        return args, INPUT_ERROR
+    return args, GOOD_RET
+
+
+def main(argv=None):
+    args, ret = parse_cmdline(argv)
+    if ret != GOOD_RET or args is None:
+        return ret
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        f_name = os.path.join(tmp_dir, "data.csv")
+        make_mixed_file(f_name, args.rows, args.cols, numeric=not args.mixed)
+        print("{:>6s} {:>10s} {:>26s} {:>16s}".format("format", "MB", "decompress, then read (s)",
+                                                      "direct read (s)"))
+        print("{:>6s} {:10.1f} {:>26s} {:16.3f}".format("none", os.path.getsize(f_name) / 1.e6, "",
+                                                        time_read(f_name, not args.mixed, args.repeats)))
+        for compression in sorted(COMPRESSORS):
+            comp_name = compress_file(f_name, compression)
+            decompress_time = time_decompress_then_read(comp_name, os.path.join(tmp_dir, "decompressed.csv"),
+                                                        compression, not args.mixed, args.repeats)
+            print("{:>6s} {:10.1f} {:26.3f} {:16.3f}".format(compression, os.path.getsize(comp_name) / 1.e6,
+                                                             decompress_time,
+                                                             time_read(comp_name, not args.mixed, args.repeats)))
+            os.remove(comp_name)
+    finally:
+        shutil.rmtree(tmp_dir)
+    return GOOD_RET
+
+
+if __name__ == '__main__':
+    status = main()
+    sys.exit(status)
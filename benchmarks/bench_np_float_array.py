@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Times common.np_float_array_from_file on files with one non-numeric column (the path that used to grow the array
+one np.vstack at a time) to check that the read time scales linearly with the number of rows. With --numeric, the
+label column is left out, so that the files are read from a memory map.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+from che696_examples.common import np_float_array_from_file, warning, GOOD_RET, INPUT_ERROR
+
+__author__ = 'hmayes'
+
+# Defaults
+DEF_ROW_COUNTS = [10000, 100000, 1000000]
+DEF_NUM_COLS = 5
+
+
+def make_mixed_file(f_name, num_rows, num_cols, seed=0, numeric=False):
+    """
+    Writes a csv with a header, num_cols float columns, and one column of (non-numeric) labels
+    @param f_name: file name to write
+    @param num_rows: number of data rows
+    @param num_cols: number of float columns
+    @param seed: for the random number generator
+    @param numeric: if True, the column of labels is left out
+    """
+    rng = np.random.RandomState(seed)
+    labels = np.array(['"({}, {})"'.format(i, i + 1) for i in range(8)])
+    row_labels = labels[rng.randint(len(labels), size=num_rows)]
+    data = rng.normal(size=(num_rows, num_cols))
+    with open(f_name, 'w') as f:
+        f.write(",".join(['"col_{}"'.format(i) for i in range(num_cols)] + ([] if numeric else ['"label"'])) + "\n")
+        chunk = 100000
+        for start in range(0, num_rows, chunk):
+            rows = [",".join(['{:.8f}'.format(val) for val in data_row] + ([] if numeric else [label]))
+                    for data_row, label in zip(data[start:start + chunk], row_labels[start:start + chunk])]
+            f.write("\n".join(rows) + "\n")
+
+
+def time_read(f_name, repeats=1):
+    """
+    @return: the best wall time (s) of reading the given file with np_float_array_from_file
+    """
+    best = None
+    for _ in range(repeats):
+        start = time.time()
+        np_float_array_from_file(f_name, delimiter=',', header=True, gather_hist=True)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def parse_cmdline(argv):
+    """
+    Returns the parsed argument list and return code.
+    `argv` is a list of arguments, or `None` for ``sys.argv[1:]``.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(description='Times reading mixed numeric/non-numeric files of increasing '
+                                                 'length and reports the time per row.')
+    parser.add_argument("-r", "--rows", help="Comma-separated list of row counts. Default is {}."
+                                             "".format(",".join(map(str, DEF_ROW_COUNTS))),
+                        default=",".join(map(str, DEF_ROW_COUNTS)))
+    parser.add_argument("-c", "--cols", help="Number of float columns. Default is {}.".format(DEF_NUM_COLS),
+                        type=int, default=DEF_NUM_COLS)
+    parser.add_argument("-n", "--repeats", help="Number of timings per file (best is reported). Default is 1.",
+                        type=int, default=1)
+    parser.add_argument("--numeric", help="Time files without the non-numeric column (read from a memory map).",
+                        action='store_true')
+    args = None
+    try:
+        args = parser.parse_args(argv)
+        args.rows = [int(x) for x in args.rows.split(",")]
+    except (SystemExit, ValueError) as e:
+        if hasattr(e, 'code') and e.code == 0:
+            return args, GOOD_RET
+        warning(e)
+        parser.print_help()
+        return args, INPUT_ERROR
+    return args, GOOD_RET
+
+
+def main(argv=None):
+    args, ret = parse_cmdline(argv)
+    if ret != GOOD_RET or args is None:
+        return ret
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        print("{:>10s} {:>10s} {:>12s} {:>14s}".format("rows", "MB", "time (s)", "us per row"))
+        base_per_row = None
+        for num_rows in args.rows:
+            f_name = os.path.join(tmp_dir, "mixed_{}.csv".format(num_rows))
+            make_mixed_file(f_name, num_rows, args.cols, numeric=args.numeric)
+            elapsed = time_read(f_name, args.repeats)
+            per_row = elapsed / num_rows * 1.e6
+            if base_per_row is None:
+                base_per_row = per_row
+            print("{:10d} {:10.1f} {:12.3f} {:14.3f}".format(num_rows, os.path.getsize(f_name) / 1.e6, elapsed,
+                                                             per_row))
+            os.remove(f_name)
+        print("Time per row for the largest file is {:.2f}x that of the smallest (1.0 is linear scaling)"
+              "".format(per_row / base_per_row))
+    finally:
+        shutil.rmtree(tmp_dir)
+    return GOOD_RET
+
+
+if __name__ == '__main__':
+    status = main()
+    sys.exit(status)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compares col_stats.calc_percentiles (one partition for all percentiles) with one np.percentile call per
+percentile, as col_stats previously did, on wide arrays. Note that the in-place timing repeats on data already
+partitioned by the previous repeat.
+"""
+
+from __future__ import print_function
+
+import argparse
+import sys
+import time
+import numpy as np
+from che696_examples.common import warning, GOOD_RET, INPUT_ERROR
+from che696_examples.col_stats import calc_percentiles, PERCENTILES
+
+__author__ = 'hmayes'
+
+# Defaults
+DEF_SHAPES = "10000x100,10000x1000,100000x1000"
+
+
+def best_time(func, repeats):
+    """
+    @return: the best wall time (s) of the given function
+    """
+    best = None
+    for _ in range(repeats):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def parse_cmdline(argv):
+    """
+    Returns the parsed argument list and return code.
+    `argv` is a list of arguments, or `None` for ``sys.argv[1:]``.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(description='Times calculating the col_stats percentiles of random arrays.')
+    parser.add_argument("-s", "--shapes", help="Comma-separated list of array shapes (rows x columns). "
+                                               "Default is {}.".format(DEF_SHAPES),
+                        default=DEF_SHAPES)
+    parser.add_argument("-n", "--repeats", help="Number of timings per shape (best is reported). Default is 3.",
+                        type=int, default=3)
+    args = None
+    try:
+        args = parser.parse_args(argv)
+        args.shapes = [tuple(int(x) for x in shape.split("x")) for shape in args.shapes.split(",")]
+    except (SystemExit, ValueError) as e:
+        if hasattr(e, 'code') and e.code == 0:
+            return args, GOOD_RET
+        warning(e)
+        parser.print_help()
+        return args, INPUT_ERROR
+    return args, GOOD_RET
+
+
+def main(argv=None):
+    args, ret = parse_cmdline(argv)
+    if ret != GOOD_RET or args is None:
+        return ret
+
+    rng = np.random.RandomState(0)
+    print("{:>16s} {:>14s} {:>14s} {:>14s} {:>8s}".format("shape", "np.percentile", "calc (copy)", "calc (in place)",
+                                                          "speedup"))
+    for shape in args.shapes:
+        data = rng.normal(size=shape)
+        five_calls = best_time(lambda: [np.percentile(data, pct, axis=0) for pct in PERCENTILES], args.repeats)
+        one_pass = best_time(lambda: calc_percentiles(data, PERCENTILES), args.repeats)
+        scratch = data.copy()
+        in_place = best_time(lambda: calc_percentiles(scratch, PERCENTILES, overwrite_input=True), args.repeats)
+        print("{:>16s} {:14.4f} {:14.4f} {:14.4f} {:8.2f}".format("{}x{}".format(*shape), five_calls, one_pass,
+                                                                  in_place, five_calls / one_pass))
+    return GOOD_RET
+
+
+if __name__ == '__main__':
+    status = main()
+    sys.exit(status)
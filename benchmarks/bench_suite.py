@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite for the che696_examples readers and col_stats: generates numeric, headered, and mixed-type (with
+label columns) csv files, tall (10 columns) and wide (1000 columns), of given numbers of cells, and times
+common.np_float_array_from_file, col_stats.process_file, and col_stats.create_hists on them. Each case is run in a
+new process, so that the peak resident memory (RSS) reported is that of the case alone. Results (wall time,
+throughput in MB/s of the file read, and peak RSS) can be saved as a JSON baseline, and compared with a baseline
+saved earlier (e.g. on another commit).
+"""
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from che696_examples.common import (np_float_array_from_file, warning, rss_mb, reset_peak_rss, GOOD_RET,
+                                    INPUT_ERROR, IO_ERROR, INVALID_DATA)
+from che696_examples.col_stats import process_file, create_hists
+
+__author__ = 'hmayes'
+
+# Defaults
+DEF_CELL_COUNTS = [10000, 100000, 1000000]
+DEF_REPEATS = 3
+# relative slowdown (in MB/s) from the baseline reported as a regression
+DEF_TOLERANCE = 0.1
+BASELINE_VERSION = 1
+
+# Kinds of files: (whether there is a header row, number of label columns)
+KINDS = {'numeric': (False, 0), 'headered': (True, 0), 'mixed': (True, 2)}
+# Shapes of files: number of columns (of floats)
+SHAPES = {'tall': 10, 'wide': 1000}
+TARGETS = ['read', 'process_file', 'create_hists']
+RESIDUES = ['ALA', 'ARG', 'ASP', 'GLU', 'GLY', 'HIS', 'LYS', 'SER']
+
+
+def make_csv(f_name, num_rows, num_cols, header=False, num_label_cols=0, seed=0):
+    """
+    Writes a csv of random floats, optionally with a header row and columns of labels (residue names, and pairs of
+    numbers, as in the col_stats test data), which are placed after the first float column
+    @param f_name: file name to write
+    @param num_rows: number of data rows
+    @param num_cols: number of float columns
+    @param header: boolean to write a header row
+    @param num_label_cols: number of label columns (0 to 2)
+    @param seed: for the random number generator
+    """
+    rng = np.random.RandomState(seed)
+    label_sets = [np.array(RESIDUES), np.array(['"({}, {})"'.format(i, i + 1) for i in range(20)])][:num_label_cols]
+    row_fmt = ",".join(['%.8f'] + ['%s'] * num_label_cols + ['%.8f'] * (num_cols - 1)) + "\n"
+    with open(f_name, 'w') as f:
+        if header:
+            col_names = ['"col_{}"'.format(col) for col in range(num_cols)]
+            f.write(",".join(col_names[:1] + ['"label_{}"'.format(col) for col in range(num_label_cols)] +
+                             col_names[1:]) + "\n")
+        chunk_rows = max(1, 1000000 // num_cols)
+        for start in range(0, num_rows, chunk_rows):
+            block_rows = min(chunk_rows, num_rows - start)
+            data = rng.normal(size=(block_rows, num_cols))
+            labels = [label_set[rng.randint(len(label_set), size=block_rows)] for label_set in label_sets]
+            f.write("".join(row_fmt % tuple([data_row[0]] + [label[row] for label in labels] + data_row[1:].tolist())
+                            for row, data_row in enumerate(data)))
+
+
+def case_file(data_dir, kind, shape, num_cells):
+    """
+    @return: the name of the file for the case, written (with make_csv) if not already in data_dir
+    """
+    num_cols = SHAPES[shape]
+    f_name = os.path.join(data_dir, "{}_{}_{}.csv".format(kind, shape, num_cells))
+    if not os.path.isfile(f_name):
+        header, num_label_cols = KINDS[kind]
+        make_csv(f_name, max(2, num_cells // num_cols), num_cols, header=header, num_label_cols=num_label_cols)
+    return f_name
+
+
+def run_case(target, f_name, header, out_dir, repeats, make_png=False):
+    """
+    Times one target on one file; meant to be run in a new process (see time_case)
+    @return: dict of the best wall time (s), the RSS (MB) of the process before the timings (after importing the
+        modules and, for create_hists, reading the file; None if not found), and its peak RSS
+    """
+    hist_data = None
+    header_row = None
+    best = None
+    std_out, std_err = sys.stdout, sys.stderr
+    try:
+        # the outputs list the files written, and warn about the labels (read as nan)
+        with open(os.devnull, 'w') as sys.stdout:
+            sys.stderr = sys.stdout
+            if target == 'create_hists':
+                # the counts to write are gathered before timing
+                header_row, hist_data = np_float_array_from_file(f_name, delimiter=',', header=header,
+                                                                 gather_hist=True)[1:]
+            reset_peak_rss()
+            start_rss = rss_mb(peak=False)
+            for _ in range(repeats):
+                start = time.time()
+                if target == 'read':
+                    np_float_array_from_file(f_name, delimiter=',', header=header, gather_hist=True)
+                elif target == 'process_file':
+                    process_file(f_name, out_dir, None, ',', None, header=header, make_hist=True, make_png=make_png,
+                                 quiet=True)
+                else:
+                    create_hists(f_name, header_row, hist_data, out_dir, make_png=make_png)
+                elapsed = time.time() - start
+                if best is None or elapsed < best:
+                    best = elapsed
+    finally:
+        sys.stdout, sys.stderr = std_out, std_err
+    return {'time_s': best, 'start_rss_mb': start_rss, 'peak_rss_mb': rss_mb()}
+
+
+def time_case(target, f_name, header, out_dir, repeats, make_png=False):
+    """
+    @return: the result of run_case, run in a new (spawned, not forked) process
+    """
+    pool = multiprocessing.get_context('spawn').Pool(1)
+    try:
+        return pool.apply(run_case, (target, f_name, header, out_dir, repeats, make_png))
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def git_commit():
+    """
+    @return: the abbreviated hash of the checked-out commit of the repository of this script, or None
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.STDOUT,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_rows(results, baseline, tolerance=DEF_TOLERANCE):
+    """
+    @param results: list of result dicts (with 'name' and 'mb_per_s')
+    @param baseline: dict loaded from a baseline file
+    @param tolerance: relative slowdown reported as a regression
+    @return: list of rows (name, baseline MB/s, MB/s, ratio, flag) for the cases in both, and the number of
+        regressions
+    """
+    base_results = {result['name']: result for result in baseline['results']}
+    rows = []
+    num_slower = 0
+    for result in results:
+        if result['name'] not in base_results:
+            continue
+        base_rate = base_results[result['name']]['mb_per_s']
+        ratio = result['mb_per_s'] / base_rate
+        flag = ''
+        if ratio < 1. - tolerance:
+            flag = 'SLOWER'
+            num_slower += 1
+        elif ratio > 1. + tolerance:
+            flag = 'faster'
+        rows.append((result['name'], base_rate, result['mb_per_s'], ratio, flag))
+    return rows, num_slower
+
+
+def parse_cmdline(argv):
+    """
+    Returns the parsed argument list and return code.
+    `argv` is a list of arguments, or `None` for ``sys.argv[1:]``.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+
+    parser = argparse.ArgumentParser(description='Times the readers and statistics of col_stats on generated files, '
+                                                 'reporting MB/s and peak RSS, and optionally saves or compares '
+                                                 'with a JSON baseline. Returns {} if any case is slower than the '
+                                                 'baseline by more than the tolerance.'.format(INVALID_DATA))
+    parser.add_argument("-s", "--cells", help="Comma-separated list of the numbers of cells (rows x float "
+                                              "columns) of the files. Default is {}."
+                                              "".format(",".join(map(str, DEF_CELL_COUNTS))),
+                        default=",".join(map(str, DEF_CELL_COUNTS)))
+    parser.add_argument("-k", "--kinds", help="Comma-separated list of the kinds of files: {}. Default is all."
+                                              "".format(", ".join(sorted(KINDS))),
+                        default=",".join(sorted(KINDS)))
+    parser.add_argument("--shapes", help="Comma-separated list of the shapes of files: 'tall' ({} columns) and/or "
+                                         "'wide' ({} columns). Default is both."
+                                         "".format(SHAPES['tall'], SHAPES['wide']),
+                        default="tall,wide")
+    parser.add_argument("-t", "--targets", help="Comma-separated list of the functions to time: {}. create_hists "
+                                                "is only timed on mixed files. Default is all."
+                                                "".format(", ".join(TARGETS)),
+                        default=",".join(TARGETS))
+    parser.add_argument("-n", "--repeats", help="Number of timings per case (best is reported). "
+                                                "Default is {}.".format(DEF_REPEATS),
+                        type=int, default=DEF_REPEATS)
+    parser.add_argument("--png", help="Include plotting the histograms (needs matplotlib and seaborn).",
+                        action='store_true')
+    parser.add_argument("--data_dir", help="Directory for the generated files, which are kept and reused by later "
+                                           "runs. Default is a temporary directory, removed when done.",
+                        default=None)
+    parser.add_argument("--save", help="JSON file to save the results to, as a baseline.", default=None)
+    parser.add_argument("--compare", help="JSON baseline file (from --save) to compare the results with.",
+                        default=None)
+    parser.add_argument("--tolerance", help="Relative change in MB/s from the baseline reported as slower or faster. "
+                                            "Default is {}.".format(DEF_TOLERANCE),
+                        type=float, default=DEF_TOLERANCE)
+    args = None
+    try:
+        args = parser.parse_args(argv)
+        args.cells = [int(x) for x in args.cells.split(",")]
+        args.kinds = args.kinds.split(",")
+        args.shapes = args.shapes.split(",")
+        args.targets = args.targets.split(",")
+        for name, vals, choices in [('kind', args.kinds, KINDS), ('shape', args.shapes, SHAPES),
+                                    ('target', args.targets, TARGETS)]:
+            unknown = [val for val in vals if val not in choices]
+            if unknown:
+                raise ValueError("Unknown {}(s): {}".format(name, ", ".join(unknown)))
+    except (SystemExit, ValueError) as e:
+        if hasattr(e, 'code') and e.code == 0:
+            return args, GOOD_RET
+        warning(e)
+        parser.print_help()
+        return args, INPUT_ERROR
+    return args, GOOD_RET
+
+
+def main(argv=None):
+    args, ret = parse_cmdline(argv)
+    if ret != GOOD_RET or args is None:
+        return ret
+
+    baseline = None
+    if args.compare is not None:
+        try:
+            with open(args.compare) as f:
+                baseline = json.load(f)
+        except (IOError, ValueError) as e:
+            warning("Could not read baseline file {}: {}".format(args.compare, e))
+            return IO_ERROR
+
+    data_dir = tempfile.mkdtemp() if args.data_dir is None else args.data_dir
+    out_dir = tempfile.mkdtemp()
+    results = []
+    try:
+        print("{:40s} {:>9s} {:>10s} {:>9s} {:>13s} {:>9s}".format("case", "MB", "time (s)", "MB/s",
+                                                                   "peak RSS (MB)", "increase"))
+        for num_cells in args.cells:
+            for shape in args.shapes:
+                for kind in args.kinds:
+                    f_name = case_file(data_dir, kind, shape, num_cells)
+                    f_mb = os.path.getsize(f_name) / 1.e6
+                    for target in args.targets:
+                        if target == 'create_hists' and KINDS[kind][1] == 0:
+                            continue
+                        name = "{}:{}:{}:{}".format(target, kind, shape, num_cells)
+                        result = time_case(target, f_name, KINDS[kind][0], out_dir, args.repeats,
+                                           make_png=args.png)
+                        result.update(name=name, target=target, kind=kind, shape=shape, cells=num_cells, mb=f_mb,
+                                      mb_per_s=f_mb / max(result['time_s'], 1.e-9))
+                        results.append(result)
+                        rss_cols = ["n/a", "n/a"]
+                        if result['peak_rss_mb'] is not None:
+                            rss_cols[0] = "{:.1f}".format(result['peak_rss_mb'])
+                            if result['start_rss_mb'] is not None:
+                                rss_cols[1] = "{:.1f}".format(result['peak_rss_mb'] - result['start_rss_mb'])
+                        print("{:40s} {:9.2f} {:10.4f} {:9.1f} {:>13s} {:>9s}"
+                              "".format(name, f_mb, result['time_s'], result['mb_per_s'], *rss_cols))
+    finally:
+        if args.data_dir is None:
+            shutil.rmtree(data_dir)
+        shutil.rmtree(out_dir)
+
+    if args.save is not None:
+        meta = {'version': BASELINE_VERSION, 'commit': git_commit(), 'date': datetime.datetime.now().isoformat(),
+                'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+                'repeats': args.repeats}
+        with open(args.save, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=1)
+        print("Wrote file: {}".format(args.save))
+
+    if baseline is not None:
+        rows, num_slower = compare_rows(results, baseline, args.tolerance)
+        print("\nCompared with {} (commit {}):".format(args.compare, baseline['meta'].get('commit')))
+        print("{:40s} {:>12s} {:>9s} {:>7s}".format("case", "base MB/s", "MB/s", "ratio"))
+        for row in rows:
+            print("{:40s} {:12.1f} {:9.1f} {:7.2f} {}".format(*row))
+        if num_slower > 0:
+            warning("{} case(s) slower than the baseline by more than {:.0%}".format(num_slower, args.tolerance))
+            return INVALID_DATA
+    return GOOD_RET
+
+
+if __name__ == '__main__':
+    status = main()
+    sys.exit(status)
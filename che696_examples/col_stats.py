@@ -8,22 +8,24 @@ alternately: returns maximum x, y, and z coordinates, plus the values after a bu
 
 from __future__ import print_function
 
-import copy
+import collections
 import csv
+import functools
+import hashlib
+import json
+from itertools import zip_longest
 from operator import itemgetter
-import matplotlib
-import seaborn as sns
-import pandas as pd
 import numpy as np
 import sys
 import os
 import warnings
 import argparse
-
-matplotlib.use('Agg', warn=False)
-import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
 from che696_examples.common import (InvalidDataError, warning, np_float_array_from_file, create_out_fname,
-                                    list_to_csv, read_csv, GOOD_RET, INPUT_ERROR, IO_ERROR, INVALID_DATA)
+                                    list_to_csv, read_csv, FloatArrayChunks, find_files_by_dir, read_file_list,
+                                    cached_np_float_array_from_file, read_column, cached_read_column,
+                                    cache_file_base, complete_lines_size, StageProfiler, NO_PROFILER,
+                                    DEF_CHUNK_ROWS, GOOD_RET, INPUT_ERROR, IO_ERROR, INVALID_DATA)
 
 __author__ = 'hmayes'
 
@@ -32,7 +34,50 @@ __author__ = 'hmayes'
 # Defaults
 DEF_ARRAY_FILE = 'qm_box_sizes.txt'
 DEF_DELIMITER = ','
+DEF_SUMMARY_FILE = 'col_stats_summary.csv'
 TOL = 0.0001
+# Number of points per column kept by the quantile sketch used in streaming mode
+DEF_SKETCH_SIZE = 5000
+# Types for storing the data; statistics are accumulated in float64 for either
+DTYPES = ['float64', 'float32']
+DEF_DTYPE = 'float64'
+# Number of blocks for the block-averaged standard error, and the window factor for the integrated autocorrelation
+# time (the sum is stopped at the first lag that is at least this multiple of the time so far; Sokal's choice)
+DEF_NUM_BLOCKS = 10
+AUTOCORR_WINDOW = 5
+# Version of the format of the state files written in incremental mode, and the number of bytes at the start and
+# end of the part of the file read that are checked for changes before only the rest is read
+STATE_VERSION = 1
+STATE_CHECK_BYTES = 4096
+# Formats for the stats output file
+OUT_FORMATS = ['csv', 'json', 'npz']
+DEF_OUT_FORMAT = 'csv'
+# Formats for the rolling (window) statistics
+ROLLING_FORMATS = ['csv', 'npy']
+DEF_ROLLING_FORMAT = 'csv'
+# Names of the stages timed with --profile
+READ_STAGE = 'read'
+REDUCE_STAGE = 'reduce'
+PERCENTILE_STAGE = 'percentile'
+BOUND_STAGE = 'bound check'
+WRITE_STAGE = 'write'
+PLOT_STAGE = 'plot'
+
+# Percentiles reported (median and 1 and 2 sigma), with the labels for the output rows
+PERCENTILES = [4.55, 31.73, 50, 68.27, 95.45]
+PERCENTILE_LABELS = ['5% percentile:', '32% percentile:', '50% percentile:', '68% percentile:', '95% percentile:']
+MEDIAN = 50
+
+# Keys for the statistics dict
+MIN_KEY = 'min'
+MAX_KEY = 'max'
+AVG_KEY = 'avg'
+STD_KEY = 'std'
+PCT_KEY = 'percentiles'
+TAU_KEY = 'tau'
+ESS_KEY = 'ess'
+SEM_KEY = 'sem'
+BLOCK_SEM_KEY = 'block_sem'
 
 
 def parse_cmdline(argv):
@@ -49,8 +94,27 @@ def parse_cmdline(argv):
                                                  'non-numerical data.')
     parser.add_argument("-f", "--file", help="The location of the file with the dimensions with one line per vector, "
                                              "space-separated, containing at least two lines. The default file is {}, "
-                                             "located in the current directory".format(DEF_ARRAY_FILE),
-                        default=DEF_ARRAY_FILE)
+                                             "located in the current directory, unless a list file (-l) or file "
+                                             "pattern (-g) is given.".format(DEF_ARRAY_FILE),
+                        default=None)
+
+    parser.add_argument("-l", "--list_file", help="File listing data files to process (one per line), using the same "
+                                                  "options for each. Relative paths are relative to the directory "
+                                                  "of the list file.",
+                        default=None)
+
+    parser.add_argument("-g", "--glob", help="File name pattern (e.g. 'sum_*.csv') of data files to process, using "
+                                             "the same options for each. Files are searched for recursively in the "
+                                             "base directory (-r).",
+                        default=None)
+
+    parser.add_argument("-r", "--base_dir", help="Base directory for the file pattern search (-g). Default is the "
+                                                 "current directory.",
+                        default=os.getcwd())
+
+    parser.add_argument("-j", "--workers", help="Number of processes used to process multiple data files or, for a "
+                                                "single file, to plot histograms. Default is 1.",
+                        type=int, default=1)
 
     parser.add_argument("-b", "--buffer", help="If specified, the program will output only the max dimension"
                                                "in each column plus an additional buffer amount (float).",
@@ -75,6 +139,136 @@ def parse_cmdline(argv):
     parser.add_argument("-s", "--histogram", help="Create histograms of the non-numerical data (default is false).",
                         action='store_true')
 
+    parser.add_argument("--no_png", help="With -s/--histogram, write only the table of counts of the non-numerical "
+                                         "data, without plotting them (default is false).",
+                        action='store_true')
+
+    parser.add_argument("-p", "--percentiles", help="Comma-separated list of percentiles (0 to 100) to report. "
+                                                    "Default is {}.".format(",".join(map(str, PERCENTILES))),
+                        default=None)
+
+    parser.add_argument("--cache", help="Save the parsed data in a binary cache file, and use it when the data file "
+                                        "(path, modification time, and size) and delimiter and header options "
+                                        "are unchanged, to skip reading the text again (default is false). "
+                                        "With --group_by, the key column is cached too. "
+                                        "Not used in streaming mode.",
+                        action='store_true')
+
+    parser.add_argument("--cache_dir", help="Directory for cache files (and the state files of --incremental). "
+                                            "Default is the directory of the data file.",
+                        default=None)
+
+    parser.add_argument("--incremental", help="For files that are appended to (e.g. by a running simulation), save "
+                                              "the running statistics (as in streaming mode) and the part of the "
+                                              "file read in a state file, so that the next run only reads the rows "
+                                              "added since (default is false). A line without a line ending is "
+                                              "left for the next run. The file is read again from the start if the "
+                                              "part read before has changed or the options differ. Not available "
+                                              "for compressed files, or with --group_by, --weights, --autocorr, or "
+                                              "--rolling.",
+                        action='store_true')
+
+    parser.add_argument("--stream", help="Read the file in chunks of rows, updating running statistics, so that "
+                                         "memory use does not grow with the file length (default is false). "
+                                         "Percentiles are exact for files with up to {} rows, and approximated "
+                                         "with a quantile sketch otherwise.".format(2 * DEF_SKETCH_SIZE),
+                        action='store_true')
+
+    parser.add_argument("--chunk_rows", help="Number of rows per chunk in streaming mode, and per block of rows "
+                                             "added to the sums for --corr. Default is {}.".format(DEF_CHUNK_ROWS),
+                        type=int, default=DEF_CHUNK_ROWS)
+
+    parser.add_argument("-c", "--columns", help="Comma-separated list of the columns to analyze, given by name (from "
+                                                "the header row) or 0-based index; names that contain commas must "
+                                                "be given by index. Other columns are not converted to floats or "
+                                                "counted for histograms. Default is all columns.",
+                        default=None)
+
+    parser.add_argument("--group_by", help="Name (from the header row) or 0-based index of a key column (e.g. a run "
+                                           "id). The statistics are calculated for the rows of each value of the "
+                                           "key, and written in long format: one set of statistics rows per key "
+                                           "value (in order of first appearance), each row starting with the key. "
+                                           "The key column is not analyzed unless selected with -c. "
+                                           "Not available in streaming mode.",
+                        default=None)
+
+    parser.add_argument("--weights", help="Name (from the header row) or 0-based index of a column of non-negative "
+                                          "row weights (e.g. from enhanced sampling). The mean, standard deviation "
+                                          "(with the reliability-weights correction), and percentiles of the other "
+                                          "columns are then weighted; the weight column is not reported. "
+                                          "Not available in streaming mode or with --group_by.",
+                        default=None)
+
+    parser.add_argument("--autocorr", help="Treat the rows as a time series (e.g. MD frames) and add rows of the "
+                                           "integrated autocorrelation time (in rows), effective sample size, and "
+                                           "standard error of the mean from each, and from block averaging (see "
+                                           "--num_blocks). Not available in streaming mode or with --group_by or "
+                                           "--weights.",
+                        action='store_true')
+
+    parser.add_argument("--num_blocks", help="With --autocorr, the number of blocks of consecutive rows for the "
+                                             "block-averaged standard error. Default is {}.".format(DEF_NUM_BLOCKS),
+                        type=int, default=DEF_NUM_BLOCKS)
+
+    parser.add_argument("--rolling", help="Also write the mean, standard deviation, min, and max of each column over "
+                                          "a rolling window of this many rows (e.g. to check equilibration), to a "
+                                          "file with the prefix 'rolling_'. Not available in streaming mode or "
+                                          "with --group_by or --weights.",
+                        type=int, default=None)
+
+    parser.add_argument("--rolling_step", help="With --rolling, write the statistics of every this many windows. "
+                                               "Default is 1 (all windows).",
+                        type=int, default=1)
+
+    parser.add_argument("--rolling_format", help="With --rolling, the output format: 'csv', or 'npy' for a 2D numpy "
+                                                 "array with the same columns as the csv (without its header). "
+                                                 "Default is {}.".format(DEF_ROLLING_FORMAT),
+                        choices=ROLLING_FORMATS, default=DEF_ROLLING_FORMAT)
+
+    parser.add_argument("--out_format", help="Format of the stats file: 'csv', or 'json' or 'npz' (numpy) with the "
+                                             "column names ('columns'), row labels ('labels'), group keys ('groups', "
+                                             "with --group_by), and a 2D array of the statistics ('stats'). "
+                                             "Default is {}. The summary of multiple files is always a csv."
+                                             "".format(DEF_OUT_FORMAT),
+                        choices=OUT_FORMATS, default=DEF_OUT_FORMAT)
+
+    parser.add_argument("-q", "--quiet", help="Do not print the table of statistics, or the names of the files "
+                                              "written (default is false).",
+                        action='store_true')
+
+    parser.add_argument("--corr", help="Also write the covariance and Pearson correlation matrices of the columns "
+                                       "(files with the prefixes 'cov_' and 'corr_', in the --out_format), each "
+                                       "pair using the rows in which neither value is nan. The sums are accumulated "
+                                       "a block (--chunk_rows) of rows at a time, or a chunk at a time with "
+                                       "--stream. Not available with --group_by, --weights, or --incremental.",
+                        action='store_true')
+
+    parser.add_argument("--bins", help="Also write histograms of the numeric values of every column, to one file "
+                                       "(with the prefix 'numhist_', in the --out_format): either a number of "
+                                       "equal-width bins spanning the range of the (finite) values of each column, "
+                                       "or comma-separated increasing bin edges used for every column (values "
+                                       "outside them are not counted; write e.g. '--bins=-1,0,1' if the first "
+                                       "edge is negative). The values are counted a block (or, with "
+                                       "--stream, a chunk) of rows at a time; with --stream and a number of bins, "
+                                       "the file is read a second time, once the ranges are known. Not available "
+                                       "with --group_by, --weights, or --incremental.",
+                        default=None)
+
+    parser.add_argument("--profile", help="Print a table of the wall time, CPU time, and peak memory (RSS; on Linux, "
+                                          "of each stage) of the stages of the run: reading, reducing the data to "
+                                          "statistics, percentiles, bound check (-m), writing, and plotting "
+                                          "(default is false). Stages run in other processes (plots with -j) count "
+                                          "towards wall time only. Not available for multiple files with -j.",
+                        action='store_true')
+
+    parser.add_argument("--profile_file", help="Also write the profile (see --profile) as JSON to this file.",
+                        default=None)
+
+    parser.add_argument("--dtype", help="Type used to store the data. 'float32' halves the memory used; the mean "
+                                        "and standard deviation are still accumulated in float64. "
+                                        "Default is {}.".format(DEF_DTYPE),
+                        choices=DTYPES, default=DEF_DTYPE)
+
     args = None
     try:
         args = parser.parse_args(argv)
@@ -88,117 +282,1271 @@ def parse_cmdline(argv):
     return args, GOOD_RET
 
 
-# noinspection PyTypeChecker
-def process_file(data_file, out_dir, len_buffer, delimiter, min_max_dict, header=False, make_hist=False):
-    try:
-        dim_vectors, header_row, hist_data = np_float_array_from_file(data_file, delimiter=delimiter,
-                                                                      header=header, gather_hist=make_hist)
+def autocorr_time(series, window=AUTOCORR_WINDOW):
+    """
+    Calculates the integrated autocorrelation time of a series, from its autocorrelation function found with an FFT
+    (zero-padded, so that it is not circular), summed up to the first lag M with M >= window * tau(M)
+    @param series: vector of floats
+    @param window: factor for the choice of the summation window
+    @return: the integrated autocorrelation time (in rows; 1 for uncorrelated rows, and at least 1); nan for series
+        with nan or with no variance
+    """
+    num_rows = len(series)
+    deviations = series.astype(np.float64) - series.mean(dtype=np.float64)
+    fft_len = 1 << (2 * num_rows - 1).bit_length()
+    transform = np.fft.rfft(deviations, n=fft_len)
+    acf = np.fft.irfft(transform * transform.conjugate(), n=fft_len)[:num_rows]
+    if not acf[0] > 0:
+        return np.nan
+    taus = 1. + 2. * np.cumsum(acf[1:] / acf[0])
+    lags = np.arange(1, num_rows)
+    in_window = np.flatnonzero(lags >= window * taus)
+    if len(in_window) == 0:
+        tau = taus[-1] if len(taus) > 0 else 1.
+    else:
+        tau = taus[in_window[0]]
+    # estimates below one (from noise or anti-correlation) would give more effective samples than rows
+    return max(tau, 1.)
 
-    except InvalidDataError as e:
-        raise InvalidDataError("{}\n"
-                               "Run program with '-h' to see options, such as specifying header row (-n) "
-                               "and/or delimiter (-d)".format(e))
 
-    if header:
-        to_print = [[''] + header_row]
+def calc_error_stats(dim_vectors, num_blocks=DEF_NUM_BLOCKS):
+    """
+    Estimates the uncertainty of the mean of each column of correlated rows (a time series)
+    @param dim_vectors: 2D numpy array of floats, with the rows in time order
+    @param num_blocks: number of blocks of consecutive rows for block averaging (trailing rows that do not fill a
+        block are not used)
+    @return: dict of per-column vectors of the integrated autocorrelation time (see autocorr_time), the effective
+        sample size (the number of rows divided by that time), the standard error of the mean from it, and the
+        standard error of the mean from the spread of the block averages
+    """
+    num_rows = len(dim_vectors)
+    if num_blocks < 2 or num_blocks > num_rows:
+        raise InvalidDataError("The number of blocks must be between 2 and the number of rows ({}); found {}."
+                               "".format(num_rows, num_blocks))
+    tau_vector = np.array([autocorr_time(dim_vectors[:, col]) for col in range(dim_vectors.shape[1])])
+    std_vector = dim_vectors.std(axis=0, ddof=1, dtype=np.float64)
+    block_len = num_rows // num_blocks
+    blocks = dim_vectors[:num_blocks * block_len].reshape(num_blocks, block_len, -1)
+    block_avgs = blocks.mean(axis=1, dtype=np.float64)
+    return {TAU_KEY: tau_vector, ESS_KEY: num_rows / tau_vector, SEM_KEY: std_vector * np.sqrt(tau_vector / num_rows),
+            BLOCK_SEM_KEY: block_avgs.std(axis=0, ddof=1) / np.sqrt(num_blocks)}
+
+
+def rolling_extreme(dim_vectors, window, ufunc):
+    """
+    Calculates the min or max of each column over every window of consecutive rows in O(n) (van Herk/Gil-Werman):
+    within blocks of `window` rows, the running extreme from the start and from the end of the block are found with
+    ufunc.accumulate, and each window (which spans at most two blocks) combines one of each
+    @param dim_vectors: 2D numpy array of floats
+    @param window: number of rows per window
+    @param ufunc: np.minimum or np.maximum
+    @return: 2D array with one row per window (the first ending at row window - 1)
+    """
+    num_rows, num_cols = dim_vectors.shape
+    num_blocks = -(-num_rows // window)
+    # the padding rows are not part of any window
+    padded = np.empty((num_blocks * window, num_cols), dtype=dim_vectors.dtype)
+    padded[:num_rows] = dim_vectors
+    padded[num_rows:] = dim_vectors[-1]
+    blocks = padded.reshape(num_blocks, window, num_cols)
+    from_start = ufunc.accumulate(blocks, axis=1).reshape(-1, num_cols)
+    from_end = ufunc.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].reshape(-1, num_cols)
+    return ufunc(from_end[:num_rows - window + 1], from_start[window - 1:num_rows])
+
+
+def calc_rolling_stats(dim_vectors, window):
+    """
+    Calculates the mean, standard deviation, min, and max of each column over every window of consecutive rows, in
+    O(n) per column: the mean and standard deviation from cumulative sums (in float64, of the deviations from the
+    column mean, to limit round-off), and the min and max with rolling_extreme. Windows that include nan give nan.
+    @param dim_vectors: 2D numpy array of floats
+    @param window: number of rows per window
+    @return: dict of 2D arrays (one row per window, the first ending at row window - 1), keyed as in calc_stats
+    """
+    num_rows = len(dim_vectors)
+    if window < 2 or window > num_rows:
+        raise InvalidDataError("The rolling window must be between 2 and the number of rows ({}); found {}."
+                               "".format(num_rows, window))
+    is_nan = np.isnan(dim_vectors)
+    with warnings.catch_warnings():
+        # columns of only nan
+        warnings.simplefilter("ignore", RuntimeWarning)
+        col_means = np.nan_to_num(np.nanmean(dim_vectors, axis=0, dtype=np.float64))
+    deviations = dim_vectors - col_means
+    deviations[is_nan] = 0.
+
+    def window_sums(values):
+        sums = np.cumsum(values, axis=0, dtype=np.float64)
+        return np.concatenate((sums[window - 1:window], sums[window:] - sums[:-window]))
+
+    sums = window_sums(deviations)
+    sq_sums = window_sums(np.square(deviations))
+    nan_counts = window_sums(is_nan)
+    avg_vectors = sums / window
+    std_vectors = np.sqrt(np.maximum(sq_sums - sums * avg_vectors, 0.) / (window - 1))
+    avg_vectors += col_means
+    avg_vectors[nan_counts > 0] = np.nan
+    std_vectors[nan_counts > 0] = np.nan
+    return {AVG_KEY: avg_vectors, STD_KEY: std_vectors, MIN_KEY: rolling_extreme(dim_vectors, window, np.minimum),
+            MAX_KEY: rolling_extreme(dim_vectors, window, np.maximum)}
+
+
+def write_rolling_stats(data_file, out_dir, rolling_stats, header_row, window, step=1,
+                        out_format=DEF_ROLLING_FORMAT, print_message=True):
+    """
+    Writes the statistics of calc_rolling_stats, with one row per window: the index (0-based, among the data rows)
+    of the last row of the window, then the mean, std dev, min, and max of each column in turn
+    @param data_file: name of the data file
+    @param out_dir: output directory (None for the directory of the data file)
+    @param rolling_stats: dict of the statistics of each window, as returned by calc_rolling_stats
+    @param header_row: list of column names (None to use column numbers)
+    @param window: number of rows per window
+    @param step: write every `step` windows
+    @param out_format: 'csv' or 'npy'
+    @param print_message: boolean to print a message that the file was written
+    @return: the name of the file written
+    """
+    stat_keys = [AVG_KEY, STD_KEY, MIN_KEY, MAX_KEY]
+    num_windows, num_cols = rolling_stats[AVG_KEY].shape
+    out_array = np.empty((-(-num_windows // step), 1 + len(stat_keys) * num_cols))
+    out_array[:, 0] = np.arange(window - 1, window - 1 + num_windows, step)
+    for index, stat_key in enumerate(stat_keys):
+        out_array[:, 1 + index::len(stat_keys)] = rolling_stats[stat_key][::step]
+
+    f_name = create_out_fname(data_file, prefix='rolling_', ext='.' + out_format, base_dir=out_dir)
+    if out_format == 'npy':
+        np.save(f_name, out_array)
     else:
-        to_print = []
+        if header_row is None:
+            header_row = [str(col) for col in range(num_cols)]
+        labels = ['row'] + ['{}_{}'.format(col_name.strip(), stat_key) for col_name in header_row
+                            for stat_key in stat_keys]
+        np.savetxt(f_name, out_array, fmt='%.10g', delimiter=',', comments='',
+                   header=','.join(['"{}"'.format(label) for label in labels]))
+    if print_message:
+        print("Wrote file: {}".format(f_name))
+    return f_name
+
+
+def weighted_percentiles(sorted_values, weights, percentiles, min_val, max_val):
+    """
+    Interpolates percentiles of weighted values, with the weights summing to the number of (unweighted) rows they
+    represent; for equal weights of one, the results are those of np.percentile (linear interpolation)
+    @param sorted_values: vector of the values, sorted
+    @param weights: vector of the (positive) weight of each value
+    @param percentiles: list of percentiles (0 to 100)
+    @param min_val: the lowest value, used as the 0th percentile
+    @param max_val: the highest value, used as the 100th percentile
+    @return: vector of the percentiles
+    """
+    # each value sits at the (0-based) rank of the middle of its weight, which increases for any positive weights
+    # and is the rank np.percentile uses for weights of one; values whose middle falls outside the ends of the
+    # ranks (a weight below one at either end) are left to the min and max
+    total = weights.sum()
+    centers = np.cumsum(weights) - weights / 2. - 0.5
+    inside = (centers > 0.) & (centers < total - 1.)
+    ranks = np.concatenate(([0.], centers[inside], [max(total - 1., 0.)]))
+    values = np.concatenate(([min_val], sorted_values[inside], [max_val]))
+    return np.interp(np.asarray(percentiles, dtype=np.float64) / 100. * (total - 1.), ranks, values)
+
+
+class QuantileSketch(object):
+    """
+    Mergeable per-column quantile summary. Values (and their weights) are kept exactly until more than twice
+    `sketch_size` rows have been added; then each column is compressed to `sketch_size` points evenly spaced in
+    rank, each carrying an equal share of the weight. Columns containing nan return nan, as np.percentile does.
+    """
+    def __init__(self, num_cols, sketch_size=DEF_SKETCH_SIZE):
+        self.sketch_size = sketch_size
+        self.values = np.empty((0, num_cols))
+        self.weights = np.empty((0, num_cols))
+        self.has_nan = np.zeros(num_cols, dtype=bool)
+        self.exact = True
+
+    def update(self, chunk):
+        self.has_nan |= np.isnan(chunk).any(axis=0)
+        self._add(chunk, np.ones(chunk.shape))
+
+    def state(self):
+        """
+        @return: dict of the arrays from which from_state restores the sketch
+        """
+        return {'values': self.values, 'weights': self.weights, 'has_nan': self.has_nan, 'exact': np.array(self.exact)}
+
+    @classmethod
+    def from_state(cls, state, sketch_size=DEF_SKETCH_SIZE):
+        sketch = cls(state['values'].shape[1], sketch_size=sketch_size)
+        sketch.values = state['values']
+        sketch.weights = state['weights']
+        sketch.has_nan = state['has_nan']
+        sketch.exact = bool(state['exact'])
+        return sketch
+
+    def merge(self, other):
+        self.has_nan |= other.has_nan
+        self.exact = self.exact and other.exact
+        self._add(other.values, other.weights)
+
+    def _add(self, values, weights):
+        self.values = np.concatenate((self.values, values))
+        self.weights = np.concatenate((self.weights, weights))
+        if len(self.values) > 2 * self.sketch_size:
+            self._compress()
+
+    def _sorted(self):
+        order = np.argsort(self.values, axis=0)
+        return np.take_along_axis(self.values, order, axis=0), np.take_along_axis(self.weights, order, axis=0)
+
+    def _compress(self):
+        values, weights = self._sorted()
+        centers = np.cumsum(weights, axis=0) - weights / 2.
+        total = centers[-1] + weights[-1] / 2.
+        targets = (np.arange(self.sketch_size) + 0.5) / self.sketch_size
+        new_values = np.empty((self.sketch_size, values.shape[1]))
+        for col in range(values.shape[1]):
+            new_values[:, col] = np.interp(targets * total[col], centers[:, col], values[:, col])
+        self.values = new_values
+        self.weights = np.tile(total / self.sketch_size, (self.sketch_size, 1))
+        self.exact = False
+
+    def percentiles(self, percentiles, min_vector, max_vector):
+        """
+        @param percentiles: list of percentiles (0 to 100)
+        @param min_vector: the min of each column, used as the lowest point of the sketch
+        @param max_vector: the max of each column, used as the highest point of the sketch
+        @return: list of vectors, one per percentile
+        """
+        if self.exact:
+            pct_vectors = calc_percentiles(self.values, percentiles)
+        else:
+            sorted_values, weights = self._sorted()
+            pct_vectors = [np.empty(sorted_values.shape[1]) for _ in percentiles]
+            for col in range(sorted_values.shape[1]):
+                col_pcts = weighted_percentiles(sorted_values[:, col], weights[:, col], percentiles,
+                                                min_vector[col], max_vector[col])
+                for pct_vector, col_pct in zip(pct_vectors, col_pcts):
+                    pct_vector[col] = col_pct
+        for pct_vector in pct_vectors:
+            pct_vector[self.has_nan] = np.nan
+        return pct_vectors
+
+
+class ColumnAccumulator(object):
+    """
+    Mergeable running per-column statistics: count, min, max, mean and variance (Welford's algorithm, updated a
+    chunk at a time with Chan et al.'s pairwise combination), and a quantile sketch.
+    """
+    def __init__(self, num_cols, sketch_size=DEF_SKETCH_SIZE):
+        self.count = 0
+        self.min_vector = np.full(num_cols, np.inf)
+        self.max_vector = np.full(num_cols, -np.inf)
+        self.mean = np.zeros(num_cols)
+        self.m2 = np.zeros(num_cols)
+        self.sketch = QuantileSketch(num_cols, sketch_size=sketch_size)
+
+    def update(self, chunk):
+        chunk_count = len(chunk)
+        if chunk_count == 0:
+            return
+        chunk_mean = chunk.mean(axis=0, dtype=np.float64)
+        chunk_m2 = np.square(chunk - chunk_mean).sum(axis=0)
+        self._combine(chunk_count, chunk_mean, chunk_m2, chunk.min(axis=0), chunk.max(axis=0))
+        self.sketch.update(chunk)
+
+    def state(self):
+        """
+        @return: dict of the arrays from which from_state restores the accumulator
+        """
+        state = {'count': np.array(self.count), 'min': self.min_vector, 'max': self.max_vector, 'mean': self.mean,
+                 'm2': self.m2}
+        state.update(('sketch_' + key, val) for key, val in self.sketch.state().items())
+        return state
+
+    @classmethod
+    def from_state(cls, state, sketch_size=DEF_SKETCH_SIZE):
+        accumulator = cls(len(state['mean']), sketch_size=sketch_size)
+        accumulator.count = int(state['count'])
+        accumulator.min_vector = state['min']
+        accumulator.max_vector = state['max']
+        accumulator.mean = state['mean']
+        accumulator.m2 = state['m2']
+        accumulator.sketch = QuantileSketch.from_state({key[len('sketch_'):]: val for key, val in state.items()
+                                                        if key.startswith('sketch_')}, sketch_size=sketch_size)
+        return accumulator
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+        self._combine(other.count, other.mean, other.m2, other.min_vector, other.max_vector)
+        self.sketch.merge(other.sketch)
+
+    def _combine(self, count, mean, m2, min_vector, max_vector):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * count / total
+        self.m2 = self.m2 + m2 + np.square(delta) * self.count * count / total
+        self.count = total
+        # np.minimum and np.maximum propagate nan, as do ndarray.min and max
+        self.min_vector = np.minimum(self.min_vector, min_vector)
+        self.max_vector = np.maximum(self.max_vector, max_vector)
+
+    def stats(self, percentiles=PERCENTILES):
+        """
+        @return: dict of statistics vectors, as returned by calc_stats
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            std_vector = np.sqrt(self.m2 / (self.count - 1))
+        return {MIN_KEY: self.min_vector, MAX_KEY: self.max_vector, AVG_KEY: self.mean, STD_KEY: std_vector,
+                PCT_KEY: self.sketch.percentiles(percentiles, self.min_vector, self.max_vector)}
+
+
+class PairwiseCovAccumulator(object):
+    """
+    Running sums for the covariance and Pearson correlation of every pair of columns, each using the rows in which
+    neither column is nan (as pandas' DataFrame.cov and corr do). The sums are updated a block of rows at a time with
+    matrix products (of the values, with nan set to zero, and of the masks of values that are not nan), so that
+    besides the (columns x columns) sums, only (block rows x columns) arrays are needed. Values are shifted by the
+    column means of the first block, to limit round-off.
+    """
+    def __init__(self):
+        self.shift = None
+        self.count = 0
+        self.sum_x = 0
+        self.sum_sq = 0
+        self.sum_xy = 0
+
+    def update(self, chunk):
+        if self.shift is None:
+            with warnings.catch_warnings():
+                # columns of only nan
+                warnings.simplefilter("ignore", RuntimeWarning)
+                self.shift = np.nan_to_num(np.nanmean(chunk, axis=0, dtype=np.float64))
+        values = chunk - self.shift
+        valid = ~np.isnan(values)
+        if valid.all():
+            # every pair uses every row
+            self.count = self.count + len(values)
+            self.sum_x = self.sum_x + values.sum(axis=0)[:, np.newaxis]
+            self.sum_sq = self.sum_sq + np.square(values).sum(axis=0)[:, np.newaxis]
+        else:
+            values[~valid] = 0.
+            valid = valid.astype(np.float64)
+            self.count = self.count + valid.T.dot(valid)
+            # for the pair (i, j), the sums of column i over the rows in which column j is not nan
+            self.sum_x = self.sum_x + values.T.dot(valid)
+            self.sum_sq = self.sum_sq + np.square(values).T.dot(valid)
+        self.sum_xy = self.sum_xy + values.T.dot(values)
+
+    def matrices(self):
+        """
+        @return: the covariance matrix (normalized by the number of rows used minus one) and the correlation matrix;
+            nan for pairs without enough rows (or without variance, for the correlation)
+        """
+        num_cols = len(self.shift)
+        count = np.broadcast_to(self.count, (num_cols, num_cols))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            co_moments = self.sum_xy - self.sum_x * self.sum_x.T / count
+            sq_devs = self.sum_sq - np.square(self.sum_x) / count
+            cov_matrix = co_moments / (count - 1)
+            corr_matrix = co_moments / np.sqrt(sq_devs * sq_devs.T)
+        return cov_matrix, np.clip(corr_matrix, -1., 1.)
+
+
+class FiniteRangeAccumulator(object):
+    """
+    Running min and max of the finite values of each column (nan for columns without any), updated a chunk of rows
+    at a time
+    """
+    def __init__(self):
+        self.min_vector = None
+        self.max_vector = None
+
+    def update(self, chunk):
+        finite = np.where(np.isfinite(chunk), chunk, np.nan)
+        with warnings.catch_warnings():
+            # columns without finite values
+            warnings.simplefilter("ignore", RuntimeWarning)
+            min_vector = np.nanmin(finite, axis=0).astype(np.float64)
+            max_vector = np.nanmax(finite, axis=0).astype(np.float64)
+        if self.min_vector is None:
+            self.min_vector = min_vector
+            self.max_vector = max_vector
+        else:
+            self.min_vector = np.fmin(self.min_vector, min_vector)
+            self.max_vector = np.fmax(self.max_vector, max_vector)
+
+
+def equal_width_edges(num_bins, min_vector, max_vector):
+    """
+    @param num_bins: the number of bins
+    @param min_vector: vector of the lowest value of each column
+    @param max_vector: vector of the highest value of each column
+    @return: 2D array (one row per column) of the edges of num_bins equal-width bins spanning the range of each
+        column; as with np.histogram, a range of a single value is widened by 0.5 each way. Rows are nan for columns
+        with a nan min or max.
+    """
+    lower = np.array(min_vector, dtype=np.float64)
+    upper = np.array(max_vector, dtype=np.float64)
+    same = lower == upper
+    lower[same] -= 0.5
+    upper[same] += 0.5
+    return np.linspace(lower, upper, num_bins + 1, axis=1)
+
+
+class NumericHistogram(object):
+    """
+    Counts of the values of each column in bins, updated a chunk of rows at a time: the bin of each value is found
+    with np.searchsorted (per column, as the bins may differ between columns), and the values of all columns are
+    counted with a single np.bincount call, with the bins of each column offset by the bins of the columns before it.
+    As with np.histogram, each bin includes its lower edge, the last bin also its upper edge, and values outside the
+    edges (and nan) are not counted.
+    """
+    def __init__(self, edges):
+        """
+        @param edges: increasing bin edges: a vector used for every column, or a 2D array with one row per column;
+            columns with nan edges are not counted
+        """
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.counts = None
+
+    def update(self, chunk):
+        num_cols = chunk.shape[1]
+        if self.counts is None:
+            if self.edges.ndim == 1:
+                self.edges = np.tile(self.edges, (num_cols, 1))
+            self.counts = np.zeros((num_cols, self.edges.shape[1] - 1), dtype=np.int64)
+        num_bins = self.counts.shape[1]
+        bins = np.empty(chunk.shape, dtype=np.intp)
+        for col in range(num_cols):
+            bins[:, col] = np.searchsorted(self.edges[col], chunk[:, col], side='right')
+        bins -= 1
+        # the last bin is closed
+        bins[chunk == self.edges[:, -1]] = num_bins - 1
+        counted = (bins >= 0) & (bins < num_bins) & ~np.isnan(self.edges[:, 0])
+        flat_bins = (bins + np.arange(num_cols) * num_bins)[counted]
+        self.counts += np.bincount(flat_bins, minlength=self.counts.size).reshape(self.counts.shape)
+
+
+def calc_percentiles(dim_vectors, percentiles, overwrite_input=False):
+    """
+    Calculates all requested percentiles of each column with a single partition of the data, giving the same
+    results as np.percentile (linear interpolation), including nan for columns that contain nan.
+    The interpolation is done in float64, whatever the type of dim_vectors.
+    @param dim_vectors: 2D numpy array of floats
+    @param percentiles: list of percentiles (0 to 100)
+    @param overwrite_input: if True, partition dim_vectors in place (its row order is then lost) instead of a copy
+    @return: 2D numpy array with one row per percentile
+    """
+    num_rows = len(dim_vectors)
+    positions = np.asarray(percentiles, dtype=np.float64) / 100. * (num_rows - 1)
+    lower = np.floor(positions).astype(int)
+    upper = np.minimum(lower + 1, num_rows - 1)
+    fractions = (positions - lower)[:, np.newaxis]
+    if overwrite_input:
+        scratch = dim_vectors
+    else:
+        scratch = dim_vectors.copy()
+    # also partition the last row, as nan values are sorted to the end
+    scratch.partition(np.unique(np.concatenate((lower, upper, [num_rows - 1]))), axis=0)
+    lower_vals = scratch[lower].astype(np.float64)
+    upper_vals = scratch[upper].astype(np.float64)
+    diffs = upper_vals - lower_vals
+    # same interpolation as numpy, for identical results
+    pct_vectors = np.where(fractions >= 0.5, upper_vals - diffs * (1 - fractions), lower_vals + diffs * fractions)
+    pct_vectors[:, np.isnan(scratch[-1])] = np.nan
+    return pct_vectors
 
-    max_vector = dim_vectors.max(axis=0)
-    min_vector = dim_vectors.min(axis=0)
-    avg_vector = dim_vectors.mean(axis=0)
-    med_vector = np.percentile(dim_vectors, 50, axis=0)
+
+def calc_moments(dim_vectors):
+    """
+    @param dim_vectors: 2D numpy array of floats
+    @return: dict of per-column vectors of the min, max, average, and standard deviation (accumulated in float64)
+    """
+    avg_vector = dim_vectors.mean(axis=0, dtype=np.float64)
+    # squared deviations are summed a block of rows at a time, so that only a small float64 temporary array is made
+    sq_dev_sum = np.zeros(dim_vectors.shape[1])
+    for start in range(0, len(dim_vectors), DEF_CHUNK_ROWS):
+        sq_dev_sum += np.square(dim_vectors[start:start + DEF_CHUNK_ROWS] - avg_vector).sum(axis=0)
+    return {MIN_KEY: dim_vectors.min(axis=0), MAX_KEY: dim_vectors.max(axis=0), AVG_KEY: avg_vector,
+            STD_KEY: np.sqrt(sq_dev_sum / (len(dim_vectors) - 1))}
+
+
+def calc_stats(dim_vectors, percentiles=PERCENTILES, overwrite_input=False):
+    """
+    @param dim_vectors: 2D numpy array of floats
+    @param percentiles: list of percentiles to calculate
+    @param overwrite_input: if True, dim_vectors is used as scratch space for the percentiles (see calc_percentiles)
+    @return: dict of per-column vectors of the min, max, average, and standard deviation (accumulated in float64),
+        and a list of the vectors of the requested percentiles
+    """
+    stats = calc_moments(dim_vectors)
+    stats[PCT_KEY] = calc_percentiles(dim_vectors, percentiles, overwrite_input=overwrite_input)
+    return stats
+
+
+def calc_weighted_stats(dim_vectors, weights, percentiles=PERCENTILES):
+    """
+    Calculates the statistics of calc_stats with each row weighted: those of calc_weighted_moments and
+    calc_weighted_percentiles
+    @param dim_vectors: 2D numpy array of floats
+    @param weights: vector of non-negative weights, one per row
+    @param percentiles: list of percentiles to calculate
+    @return: dict of per-column vectors, as returned by calc_stats
+    """
+    stats = calc_weighted_moments(dim_vectors, weights)
+    stats[PCT_KEY] = calc_weighted_percentiles(dim_vectors, weights, percentiles)
+    return stats
+
+
+def calc_weighted_moments(dim_vectors, weights):
+    """
+    Calculates the weighted mean and the standard deviation with the (unbiased) reliability-weights correction, which
+    reduces to the sample standard deviation for equal weights. The min and max are those of all rows.
+    @param dim_vectors: 2D numpy array of floats
+    @param weights: vector of non-negative weights, one per row
+    @return: dict of per-column vectors (min, max, mean, and standard deviation)
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    if np.isnan(weights).any() or (weights < 0).any() or weights.sum() == 0:
+        raise InvalidDataError("Weights must be non-negative numbers, not all zero.")
+    total = weights.sum()
+    # sums are accumulated in float64 a block of rows at a time, as in calc_stats
+    weighted_sum = np.zeros(dim_vectors.shape[1])
+    for start in range(0, len(dim_vectors), DEF_CHUNK_ROWS):
+        weighted_sum += weights[start:start + DEF_CHUNK_ROWS].dot(dim_vectors[start:start + DEF_CHUNK_ROWS])
+    avg_vector = weighted_sum / total
+    sq_dev_sum = np.zeros(dim_vectors.shape[1])
+    for start in range(0, len(dim_vectors), DEF_CHUNK_ROWS):
+        sq_dev_sum += weights[start:start + DEF_CHUNK_ROWS].dot(
+            np.square(dim_vectors[start:start + DEF_CHUNK_ROWS] - avg_vector))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        std_vector = np.sqrt(sq_dev_sum / (total - np.square(weights).sum() / total))
+    return {MIN_KEY: dim_vectors.min(axis=0), MAX_KEY: dim_vectors.max(axis=0), AVG_KEY: avg_vector,
+            STD_KEY: std_vector}
+
+
+def calc_weighted_percentiles(dim_vectors, weights, percentiles=PERCENTILES):
+    """
+    Calculates the percentiles of weighted_percentiles of each column, leaving out rows of zero weight
+    @param dim_vectors: 2D numpy array of floats
+    @param weights: vector of non-negative weights, one per row, not all zero (see calc_weighted_moments)
+    @param percentiles: list of percentiles to calculate
+    @return: list of vectors, one per percentile
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    # rows of zero weight are dropped, and the rest scaled to sum to the number of rows left
+    weighted = weights > 0
+    pct_rows = dim_vectors[weighted]
+    pct_weights = weights[weighted] * (weighted.sum() / weights.sum())
+    pct_vectors = np.empty((len(percentiles), dim_vectors.shape[1]))
+    for col in range(dim_vectors.shape[1]):
+        order = np.argsort(pct_rows[:, col])
+        sorted_values = pct_rows[order, col]
+        if np.isnan(sorted_values[-1]):
+            # as with np.percentile, columns containing nan return nan (they are sorted to the end)
+            pct_vectors[:, col] = np.nan
+        else:
+            pct_vectors[:, col] = weighted_percentiles(sorted_values, pct_weights[order], percentiles,
+                                                       sorted_values[0], sorted_values[-1])
+    return list(pct_vectors)
+
+
+def group_codes(group_keys):
+    """
+    @param group_keys: array of the group key of each row
+    @return: the distinct keys, in order of first appearance, and the (int) index in them of each row's key
+    """
+    keys, first_rows, codes = np.unique(group_keys, return_index=True, return_inverse=True)
+    order = np.argsort(first_rows)
+    # renumber the groups to match the order of first appearance
+    ranks = np.empty(len(order), dtype=int)
+    ranks[order] = np.arange(len(order))
+    return keys[order], ranks[codes]
+
+
+def calc_group_stats(dim_vectors, codes, num_groups, percentiles=PERCENTILES):
+    """
+    Calculates the statistics of calc_stats for each group of rows in one pass: the rows are sorted by group (see
+    sort_groups), and each statistic is reduced over the (contiguous) rows of every group at once (see
+    calc_group_moments and calc_group_percentiles)
+    @param dim_vectors: 2D numpy array of floats
+    @param codes: int array of the group (0 to num_groups - 1) of each row
+    @param num_groups: the number of groups; each must have at least one row
+    @param percentiles: list of percentiles to calculate
+    @return: dict, with the keys of calc_stats, of 2D arrays (one row per group) and, for the percentiles, a list of
+        2D arrays (one per percentile)
+    """
+    grouped = sort_groups(dim_vectors, codes, num_groups)
+    stats = calc_group_moments(grouped)
+    stats[PCT_KEY] = calc_group_percentiles(grouped, percentiles)
+    return stats
+
+
+def sort_groups(dim_vectors, codes, num_groups):
+    """
+    @param dim_vectors: 2D numpy array of floats
+    @param codes: int array of the group (0 to num_groups - 1) of each row
+    @param num_groups: the number of groups; each must have at least one row
+    @return: tuple of the rows sorted by group (a copy), the group of each sorted row, the number of rows of each
+        group, and the index of the first sorted row of each group
+    """
+    order = np.argsort(codes, kind='mergesort')
+    sorted_codes = codes[order]
+    counts = np.bincount(sorted_codes, minlength=num_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    return dim_vectors[order], sorted_codes, counts, starts
+
+
+def calc_group_moments(grouped):
+    """
+    @param grouped: the rows sorted by group, as returned by sort_groups
+    @return: dict of the min, max, mean, and standard deviation of each group (2D arrays, one row per group),
+        reduced over the rows of every group at once with ufunc.reduceat
+    """
+    sorted_vectors, _, counts, starts = grouped
+    avg_vectors = np.add.reduceat(sorted_vectors, starts, axis=0, dtype=np.float64) / counts[:, np.newaxis]
+    sq_dev_sums = np.add.reduceat(np.square(sorted_vectors - np.repeat(avg_vectors, counts, axis=0)), starts, axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        std_vectors = np.sqrt(sq_dev_sums / (counts - 1)[:, np.newaxis])
+    return {MIN_KEY: np.minimum.reduceat(sorted_vectors, starts, axis=0),
+            MAX_KEY: np.maximum.reduceat(sorted_vectors, starts, axis=0),
+            AVG_KEY: avg_vectors, STD_KEY: std_vectors}
+
+
+def calc_group_percentiles(grouped, percentiles=PERCENTILES):
+    """
+    @param grouped: the rows sorted by group, as returned by sort_groups; the values of each column are then sorted
+        within each group (in place)
+    @param percentiles: list of percentiles to calculate
+    @return: list of 2D arrays (one per percentile, with one row per group), interpolated as in calc_percentiles
+    """
+    sorted_vectors, sorted_codes, counts, starts = grouped
+    # sort the values of each column within each group (nan last)
+    for col in range(sorted_vectors.shape[1]):
+        sorted_vectors[:, col] = sorted_vectors[np.lexsort((sorted_vectors[:, col], sorted_codes)), col]
+    positions = np.asarray(percentiles, dtype=np.float64)[:, np.newaxis] / 100. * (counts - 1)
+    lower = np.floor(positions).astype(int)
+    upper = np.minimum(lower + 1, counts - 1)
+    fractions = (positions - lower)[:, :, np.newaxis]
+    lower_vals = sorted_vectors[starts + lower].astype(np.float64)
+    upper_vals = sorted_vectors[starts + upper].astype(np.float64)
+    diffs = upper_vals - lower_vals
+    pct_vectors = np.where(fractions >= 0.5, upper_vals - diffs * (1 - fractions), lower_vals + diffs * fractions)
+    pct_vectors[:, np.isnan(sorted_vectors[starts + counts - 1])] = np.nan
+    return list(pct_vectors)
+
+
+def calc_bound_rows(header_row, min_vector, max_vector, avg_vector, med_vector, min_max_dict):
+    """
+    Compares the stats of the columns named in a min_max_file with their initial values and bounds, warning if the
+    data is outside of the bounds
+    @param header_row: list of column names
+    @param min_vector: vector of the min of each column
+    @param max_vector: vector of the max of each column
+    @param avg_vector: vector of the average of each column
+    @param med_vector: vector of the median of each column
+    @param min_max_dict: list of dicts, keyed by column name, of the initial values, lower bounds, and upper bounds
+    @return: list of rows (label followed by one value per column; nan for columns not in the min_max_dict) of the
+        percent difference of the average and median from the initial value, and whether the median is at the
+        lower or upper bound (1) or not (0)
+    """
+    ini_dict, low_dict, upp_dict = min_max_dict[:3]
+    # column numbers and names of the columns in the min_max_dict (a header may be repeated)
+    col_names = [col_name for col_name in header_row if col_name in ini_dict]
+    cols = np.array([col for col, col_name in enumerate(header_row) if col_name in ini_dict], dtype=int)
+    ini_vals = np.array([ini_dict[col_name] for col_name in col_names], dtype=np.float64)
+    low_vals = np.array([low_dict[col_name] for col_name in col_names], dtype=np.float64)
+    upp_vals = np.array([upp_dict[col_name] for col_name in col_names], dtype=np.float64)
+    min_vals = min_vector[cols]
+    max_vals = max_vector[cols]
+    med_vals = med_vector[cols]
+
+    min_tol = np.maximum(TOL * np.maximum(np.abs(min_vals), np.abs(low_vals)), TOL)
+    med_tol = np.maximum(TOL * np.abs(med_vals), TOL)
+    max_tol = np.maximum(TOL * np.maximum(np.abs(max_vals), np.abs(upp_vals)), TOL)
+    with np.errstate(invalid='ignore'):
+        below_min = (low_vals - min_vals) > min_tol
+        above_max = (max_vals - upp_vals) > max_tol
+        med_not_min = np.abs(med_vals - low_vals) > med_tol
+        med_not_max = np.abs(med_vals - upp_vals) > med_tol
+    warn_msgs = []
+    for index in np.nonzero(below_min | above_max)[0]:
+        if below_min[index]:
+            warn_msgs.append("Minimum value found for header '{}' ({}) is less than lower bound ({})"
+                             "".format(col_names[index], min_vals[index], low_vals[index]))
+        if above_max[index]:
+            warn_msgs.append("Maximum value found for header '{}' ({}) is greater than upper bound ({})"
+                             "".format(col_names[index], max_vals[index], upp_vals[index]))
+    if len(warn_msgs) > 0:
+        warning("\n          ".join(warn_msgs))
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        row_vals = [('Avg % Diff:', (avg_vector[cols] - ini_vals) / ini_vals * 100),
+                    ('Med % Diff:', (med_vals - ini_vals) / ini_vals * 100),
+                    ('Median is Min:', np.where(med_not_min, 0, 1)),
+                    ('Median is Max:', np.where(med_not_max, 0, 1))]
+    bound_rows = []
+    for label, vals in row_vals:
+        row = np.full(len(header_row), np.nan, dtype=object)
+        row[cols] = vals.tolist()
+        bound_rows.append([label] + row.tolist())
+    return bound_rows
+
+
+def percentile_label(pct):
+    """
+    @return: the stats row label for the given percentile
+    """
+    if pct in PERCENTILES:
+        return PERCENTILE_LABELS[PERCENTILES.index(pct)]
+    return "{:g}% percentile:".format(pct)
+
+
+def stream_stats_from_file(data_file, delimiter, header=False, make_hist=False, chunk_rows=DEF_CHUNK_ROWS,
+                           percentiles=PERCENTILES, dtype=DEF_DTYPE, usecols=None, accumulators=(),
+                           profiler=NO_PROFILER):
+    """
+    Calculates the statistics returned by calc_stats by reading the file in chunks (of type dtype)
+    @param accumulators: other accumulators (e.g. a PairwiseCovAccumulator) also updated with each chunk
+    @param profiler: StageProfiler timing the reading and reduction of each chunk, and the percentiles
+    @return: dict of statistics vectors, the header row, and the histogram data
+    """
+    chunks = FloatArrayChunks(data_file, delimiter=delimiter, header=header, gather_hist=make_hist,
+                              chunk_rows=chunk_rows, dtype=dtype, usecols=usecols)
+    accumulator = None
+    for chunk in profiler.iterate(chunks, READ_STAGE):
+        with profiler.stage(REDUCE_STAGE):
+            if accumulator is None:
+                accumulator = ColumnAccumulator(chunk.shape[1])
+            accumulator.update(chunk)
+            for other_accumulator in accumulators:
+                other_accumulator.update(chunk)
+    with profiler.stage(PERCENTILE_STAGE):
+        stats = accumulator.stats(percentiles)
+    return stats, chunks.header_row, chunks.hist_data
+
+
+def weight_column(weights, usecols, header_row, num_cols, data_file):
+    """
+    @param weights: name (from the header row) or index of the weight column in the data file
+    @param usecols: list of the columns read (with the weight column last), or None if all columns were read
+    @param header_row: list of the names of the columns read (None if none specified)
+    @param num_cols: number of columns read
+    @param data_file: name of the data file, for error messages
+    @return: the index of the weight column in the array read
+    """
+    if usecols is not None:
+        return num_cols - 1
+    if isinstance(weights, int):
+        weight_col = weights
+    elif header_row is not None and weights in header_row:
+        weight_col = header_row.index(weights)
+    else:
+        raise InvalidDataError("Column '{}' not found in the header row of file: {}".format(weights, data_file))
+    if weight_col >= num_cols:
+        raise InvalidDataError("Weight column {} not found in file with {} columns: {}"
+                               "".format(weight_col, num_cols, data_file))
+    return weight_col
+
+
+def drop_column(col, stats, header_row, hist_data):
+    """
+    @return: the stats, header_row, and hist_data without the entries for the given column
+    """
+    keep = [keep_col for keep_col in range(len(stats[MIN_KEY])) if keep_col != col]
+    new_stats = {stat_key: stats[stat_key][keep] for stat_key in (MIN_KEY, MAX_KEY, AVG_KEY, STD_KEY)}
+    new_stats[PCT_KEY] = [pct_vector[keep] for pct_vector in stats[PCT_KEY]]
+    if header_row is not None:
+        header_row = [header_row[keep_col] for keep_col in keep]
+    hist_data = {new_col: hist_data[keep_col] for new_col, keep_col in enumerate(keep) if keep_col in hist_data}
+    return new_stats, header_row, hist_data
+
+
+def stats_rows(stats, percentiles, calc_pcts, header_row, len_buffer=None, min_max_dict=None):
+    """
+    @param stats: dict of statistics vectors, as returned by calc_stats, and optionally those of calc_error_stats
+    @param percentiles: list of the percentiles to report
+    @param calc_pcts: list of the percentiles in stats (the reported ones, plus the median)
+    @param header_row: list of column names (None if none specified)
+    @param len_buffer: if not None, a row of the max values plus this buffer is added
+    @param min_max_dict: if not None, the rows of calc_bound_rows are added
+    @return: list of rows (label followed by one value per column)
+    """
+    max_vector = stats[MAX_KEY]
 
     # noinspection PyTypeChecker
-    to_print += [['Min values:'] + min_vector.tolist(),
-                 ['Max values:'] + max_vector.tolist(),
-                 ['Avg values:'] + avg_vector.tolist(),
-                 ['Std dev:'] + dim_vectors.std(axis=0, ddof=1).tolist(),
-                 ['5% percentile:'] + np.percentile(dim_vectors, 4.55, axis=0).tolist(),
-                 ['32% percentile:'] + np.percentile(dim_vectors, 31.73, axis=0).tolist(),
-                 ['50% percentile:'] + med_vector.tolist(),
-                 ['68% percentile:'] + np.percentile(dim_vectors, 68.27, axis=0).tolist(),
-                 ['95% percentile:'] + np.percentile(dim_vectors, 95.45, axis=0).tolist(),
+    rows = [['Min values:'] + stats[MIN_KEY].tolist(),
+            ['Max values:'] + max_vector.tolist(),
+            ['Avg values:'] + stats[AVG_KEY].tolist(),
+            ['Std dev:'] + stats[STD_KEY].tolist(),
+            ]
+    for pct, pct_vector in zip(percentiles, stats[PCT_KEY]):
+        rows.append([percentile_label(pct)] + pct_vector.tolist())
+    if TAU_KEY in stats:
+        rows += [['Autocorr time:'] + stats[TAU_KEY].tolist(),
+                 ['Eff sample size:'] + stats[ESS_KEY].tolist(),
+                 ['Std err (tau):'] + stats[SEM_KEY].tolist(),
+                 ['Block std err:'] + stats[BLOCK_SEM_KEY].tolist(),
                  ]
     if len_buffer is not None:
-        to_print.append(['Max plus {} buffer:'.format(len_buffer)] + (max_vector + len_buffer).tolist())
+        rows.append(['Max plus {} buffer:'.format(len_buffer)] + (max_vector + len_buffer).tolist())
 
     if min_max_dict is not None:
-        nan_list = [np.nan] * len(header_row)
-        avg_ini_diff = ['Avg % Diff:'] + nan_list
-        med_ini_diff = ['Med % Diff:'] + nan_list
-        med_is_min = ['Median is Min:'] + nan_list
-        med_is_max = ['Median is Max:'] + nan_list
-        for col_num, header in enumerate(to_print[0]):
-            if header in min_max_dict[0]:
-                ini_val = min_max_dict[0][header]
-                low_val = min_max_dict[1][header]
-                upp_val = min_max_dict[2][header]
-                avg_val = avg_vector[col_num - 1]
-                med_val = med_vector[col_num - 1]
-                min_val = min_vector[col_num - 1]
-                max_val = max_vector[col_num - 1]
-                min_tol = max(TOL * max(abs(min_val), abs(low_val)), TOL)
-                med_tol = max(TOL * abs(med_val), TOL)
-                max_tol = max(TOL * max(abs(max_val), abs(upp_val)), TOL)
-                if (low_val - min_val) > min_tol:
-                    warning("Minimum value found for header '{}' ({}) is less than lower bound ({})"
-                            "".format(header, min_val, low_val))
-                if (max_val - upp_val) > max_tol:
-                    warning("Maximum value found for header '{}' ({}) is greater than upper bound ({})"
-                            "".format(header, max_val, upp_val))
-                avg_ini_diff[col_num] = (avg_val - ini_val) / ini_val * 100
-                med_ini_diff[col_num] = (med_val - ini_val) / ini_val * 100
-                if abs(med_val - low_val) > med_tol:
-                    med_is_min[col_num] = 0
+        rows += bound_rows(stats, calc_pcts, header_row, min_max_dict)
+    return rows
+
+
+def bound_rows(stats, calc_pcts, header_row, min_max_dict):
+    """
+    @param stats: dict of statistics vectors, as returned by calc_stats
+    @param calc_pcts: list of the percentiles in stats (including the median)
+    @param header_row: list of column names (None if none specified)
+    @param min_max_dict: list of dicts of the initial values, lower bounds, and upper bounds (see calc_bound_rows)
+    @return: the rows of calc_bound_rows
+    """
+    if header_row is None:
+        raise InvalidDataError("Comparing with the values in a min_max_file requires a header row (-n).")
+    return calc_bound_rows(header_row, stats[MIN_KEY], stats[MAX_KEY], stats[AVG_KEY],
+                           stats[PCT_KEY][calc_pcts.index(MEDIAN)], min_max_dict)
+
+
+def _file_part_checks(data_file, end_offset):
+    """
+    @return: md5 hex digests of the first and last (up to) STATE_CHECK_BYTES of the first end_offset bytes of the file
+    """
+    with open(data_file, 'rb') as f:
+        head = f.read(min(STATE_CHECK_BYTES, end_offset))
+        f.seek(max(end_offset - STATE_CHECK_BYTES, 0))
+        tail = f.read(end_offset - f.tell())
+    return [hashlib.md5(head).hexdigest(), hashlib.md5(tail).hexdigest()]
+
+
+def _load_state(state_file, state_key, data_file, end_offset):
+    """
+    @return: the info dict and accumulator saved by incremental_stats_from_file, or None if there is no usable
+        state: none saved, saved with other options, or saved for a file that has since changed
+    """
+    try:
+        with np.load(state_file) as saved:
+            info = json.loads(str(saved['info']))
+            if info['key'] != state_key:
+                return None
+            if info['offset'] > end_offset or _file_part_checks(data_file, info['offset']) != info['checks']:
+                warning("File {} has changed since it was last read (not only by appending rows); reading it "
+                        "from the start.".format(data_file))
+                return None
+            return info, ColumnAccumulator.from_state({key: saved[key] for key in saved.files if key != 'info'})
+    except (IOError, ValueError, KeyError):
+        return None
+
+
+def incremental_stats_from_file(data_file, delimiter, header=False, make_hist=False, chunk_rows=DEF_CHUNK_ROWS,
+                                percentiles=PERCENTILES, dtype=DEF_DTYPE, usecols=None, state_dir=None,
+                                profiler=NO_PROFILER):
+    """
+    Calculates the statistics of stream_stats_from_file, reading only the rows appended to the file since the last
+    call: the running statistics (and histogram counts) are saved in a state file (next to the cache files of
+    cached_np_float_array_from_file), with the number of bytes of the file read (up to its last line ending).
+    The file is read from the start if there is no state for it, if the options differ, or if the part already read
+    has changed (as checked at its start and end).
+    @param state_dir: directory for the state file; default is the directory of the data file
+    @param profiler: StageProfiler timing the reading (including of the state) and reduction of each chunk, the
+        percentiles, and the writing of the state
+    @return: dict of statistics vectors, the header row, and the histogram data
+    """
+    state_file = cache_file_base(data_file, state_dir) + '.state.npz'
+    state_key = {'version': STATE_VERSION, 'path': os.path.abspath(data_file), 'delimiter': delimiter,
+                 'header': bool(header), 'usecols': usecols, 'dtype': np.dtype(dtype).name, 'gather_hist': make_hist}
+    with profiler.stage(READ_STAGE):
+        end_offset = complete_lines_size(data_file)
+        state = _load_state(state_file, state_key, data_file, end_offset)
+    if state is None:
+        chunks = FloatArrayChunks(data_file, delimiter=delimiter, header=header, gather_hist=make_hist,
+                                  chunk_rows=chunk_rows, dtype=dtype, usecols=usecols, end_offset=end_offset)
+        accumulator = None
+    else:
+        info, accumulator = state
+        chunks = FloatArrayChunks(data_file, delimiter=delimiter, gather_hist=make_hist, chunk_rows=chunk_rows,
+                                  dtype=dtype, usecols=info['cols'], offset=info['offset'], end_offset=end_offset)
+        chunks.hist_data = {int(col): col_counts for col, col_counts in info['hist_data'].items()}
+    for chunk in profiler.iterate(chunks, READ_STAGE):
+        with profiler.stage(REDUCE_STAGE):
+            if accumulator is None:
+                accumulator = ColumnAccumulator(chunk.shape[1])
+            accumulator.update(chunk)
+    if state is None:
+        info = {'key': state_key, 'header_row': chunks.header_row, 'cols': chunks.usecols, 'line_len': chunks.line_len}
+    elif chunks.line_len not in (0, info['line_len']):
+        raise InvalidDataError("Rows added to file {} have {} values, while the earlier rows have {}."
+                               "".format(data_file, chunks.line_len, info['line_len']))
+    info.update(offset=end_offset, checks=_file_part_checks(data_file, end_offset), hist_data=chunks.hist_data)
+
+    # the state is replaced only once completely written
+    with profiler.stage(WRITE_STAGE):
+        try:
+            with open(state_file + '.tmp', 'wb') as f:
+                np.savez(f, info=np.array(json.dumps(info)), **accumulator.state())
+            os.replace(state_file + '.tmp', state_file)
+        except IOError as e:
+            warning("Could not write state for file {}: {}".format(data_file, e))
+    with profiler.stage(PERCENTILE_STAGE):
+        stats = accumulator.stats(percentiles)
+    return stats, info['header_row'], chunks.hist_data
+
+
+def write_stats(to_print, f_name, header=False, num_labels=1, out_format=DEF_OUT_FORMAT, print_message=True):
+    """
+    Writes the stats rows of process_file. Besides csv, they can be written as json or npz, with the same entries:
+    'columns' (the column names, or numbers if there is no header), 'labels' (the label of each stats row),
+    'groups' (with group_by only: the group key of each row), and 'stats' (a 2D array of floats, one row per
+    label). In json, nan is written as null.
+    @param to_print: list of stats rows (labels followed by one value per column), starting with the header row (the
+        labels followed by the column names) if header is True
+    @param f_name: name of the file to write
+    @param header: boolean indicating whether to_print starts with the header row
+    @param num_labels: number of labels at the start of each row (2 with group_by)
+    @param out_format: 'csv', 'json', or 'npz'
+    @param print_message: boolean to print the name of the file written
+    """
+    if out_format == 'csv':
+        list_to_csv(to_print, f_name, print_message=print_message)
+        return
+    stat_rows = to_print[1:] if header else to_print
+    if header:
+        columns = to_print[0][num_labels:]
+    else:
+        columns = [str(col) for col in range(len(stat_rows[0]) - num_labels)]
+    out_dict = collections.OrderedDict([('columns', columns), ('labels', [row[num_labels - 1] for row in stat_rows])])
+    if num_labels == 2:
+        out_dict['groups'] = [row[0] for row in stat_rows]
+    stats = np.array([row[num_labels:] for row in stat_rows], dtype=np.float64)
+    if out_format == 'npz':
+        out_dict['stats'] = stats
+        with open(f_name, 'wb') as f:
+            np.savez(f, **{key: np.asarray(val) for key, val in out_dict.items()})
+    else:
+        out_dict['stats'] = np.where(np.isnan(stats), None, stats).tolist()
+        with open(f_name, 'w') as f:
+            json.dump(out_dict, f)
+    if print_message:
+        print("Wrote file: {}".format(f_name))
+
+
+def write_numeric_hists(data_file, out_dir, num_hist, col_names, out_format=DEF_OUT_FORMAT, print_message=True):
+    """
+    Writes the counts of a NumericHistogram to one file (with the prefix 'numhist_'): as csv, a row per column and
+    bin, with the column name, the lower and upper edges of the bin, and the count; as json or npz, the entries
+    'columns', 'edges' (one row per column), and 'counts' (one row per column). In json, nan is written as null.
+    @param data_file: name of the data file
+    @param out_dir: output directory (None for the directory of the data file)
+    @param num_hist: a NumericHistogram
+    @param col_names: list of the names (or numbers) of the columns
+    @param out_format: 'csv', 'json', or 'npz'
+    @param print_message: boolean to print the name of the file written
+    """
+    f_name = create_out_fname(data_file, prefix='numhist_', ext='.' + out_format, base_dir=out_dir)
+    if out_format == 'csv':
+        to_print = [['column', 'lower_edge', 'upper_edge', 'count']]
+        for col_name, edges, counts in zip(col_names, num_hist.edges.tolist(), num_hist.counts.tolist()):
+            to_print += [[col_name, lower, upper, count] for lower, upper, count in zip(edges[:-1], edges[1:], counts)]
+        list_to_csv(to_print, f_name, print_message=print_message)
+        return
+    columns = [str(col_name) for col_name in col_names]
+    if out_format == 'npz':
+        with open(f_name, 'wb') as f:
+            np.savez(f, columns=np.asarray(columns), edges=num_hist.edges, counts=num_hist.counts)
+    else:
+        edges = np.where(np.isnan(num_hist.edges), None, num_hist.edges).tolist()
+        with open(f_name, 'w') as f:
+            json.dump(collections.OrderedDict([('columns', columns), ('edges', edges),
+                                               ('counts', num_hist.counts.tolist())]), f)
+    if print_message:
+        print("Wrote file: {}".format(f_name))
+
+
+# noinspection PyTypeChecker
+def process_file(data_file, out_dir, len_buffer, delimiter, min_max_dict, header=False, make_hist=False,
+                 stream=False, chunk_rows=DEF_CHUNK_ROWS, percentiles=PERCENTILES, make_png=True, hist_workers=1,
+                 cache=False, cache_dir=None, dtype=DEF_DTYPE, usecols=None, group_by=None, weights=None,
+                 autocorr=False, num_blocks=DEF_NUM_BLOCKS, rolling=None, rolling_step=1,
+                 rolling_format=DEF_ROLLING_FORMAT, incremental=False, out_format=DEF_OUT_FORMAT, quiet=False,
+                 corr=False, bins=None, profiler=NO_PROFILER):
+    # the median is always needed to compare with the min_max_dict
+    if MEDIAN in percentiles:
+        calc_pcts = percentiles
+    else:
+        calc_pcts = percentiles + [MEDIAN]
+    pair_accumulator = PairwiseCovAccumulator() if corr else None
+    # given bin edges, the numeric values are counted with the other statistics; given a number of bins, they are
+    # counted in a second pass, once the range of each column is known
+    num_hist = None
+    range_accumulator = None
+    if bins is not None:
+        if np.ndim(bins) == 0:
+            range_accumulator = FiniteRangeAccumulator()
+        else:
+            num_hist = NumericHistogram(bins)
+    accumulators = [acc for acc in (pair_accumulator, num_hist, range_accumulator) if acc is not None]
+    try:
+        if group_by is not None:
+            with profiler.stage(READ_STAGE):
+                if cache:
+                    group_keys, group_col, line_len, file_header = cached_read_column(
+                        data_file, group_by, delimiter=delimiter, header=header, cache_dir=cache_dir)
                 else:
-                    med_is_min[col_num] = 1
-                if abs(med_val - upp_val) > med_tol:
-                    med_is_max[col_num] = 0
+                    group_keys, group_col, line_len, file_header = read_column(
+                        data_file, group_by, delimiter=delimiter, header=header)
+            # the key column is not analyzed unless it is selected
+            if usecols is None:
+                usecols = [col for col in range(line_len) if col != group_col]
+        if weights is not None and usecols is not None:
+            # the weight column is read last
+            usecols = list(usecols) + [weights]
+        if incremental:
+            stats, header_row, hist_data = incremental_stats_from_file(data_file, delimiter, header=header,
+                                                                       make_hist=make_hist, chunk_rows=chunk_rows,
+                                                                       percentiles=calc_pcts, dtype=dtype,
+                                                                       usecols=usecols, state_dir=cache_dir,
+                                                                       profiler=profiler)
+        elif stream:
+            stats, header_row, hist_data = stream_stats_from_file(data_file, delimiter, header=header,
+                                                                  make_hist=make_hist, chunk_rows=chunk_rows,
+                                                                  percentiles=calc_pcts, dtype=dtype,
+                                                                  usecols=usecols, accumulators=accumulators,
+                                                                  profiler=profiler)
+            if range_accumulator is not None:
+                num_hist = NumericHistogram(equal_width_edges(bins, range_accumulator.min_vector,
+                                                              range_accumulator.max_vector))
+                for chunk in profiler.iterate(FloatArrayChunks(data_file, delimiter=delimiter, header=header,
+                                                               chunk_rows=chunk_rows, dtype=dtype, usecols=usecols),
+                                              READ_STAGE):
+                    with profiler.stage(REDUCE_STAGE):
+                        num_hist.update(chunk)
+        else:
+            with profiler.stage(READ_STAGE):
+                if cache:
+                    dim_vectors, header_row, hist_data = cached_np_float_array_from_file(
+                        data_file, delimiter=delimiter, header=header, gather_hist=make_hist, cache_dir=cache_dir,
+                        dtype=dtype, usecols=usecols)
                 else:
-                    med_is_max[col_num] = 1
-                    # else:
-                    #     for min_max_list in [avg_ini_diff, med_ini_diff, med_is_min, med_is_max]:
-                    #         min_max_list.append(np.nan)
-        for min_max_list in [avg_ini_diff, med_ini_diff, med_is_min, med_is_max]:
-            to_print.append(min_max_list)
-
-    # Printing to standard out: do not print quotes around strings because using csv writer
-    # print("Number of dimensions ({}) based on first line of file: {}".format(len(dim_vectors[0]), data_file))
-    if len(dim_vectors[0]) < 12:
-        for index, row in enumerate(to_print):
-            # formatting for header
-            if index == 0 and header:
-                print("{:>20s} {}".format(row[0],
-                                          ' '.join(['{:>16s}'.format(x.strip()) for x in row[1:]])))
-            # formatting for vals
+                    dim_vectors, header_row, hist_data = np_float_array_from_file(
+                        data_file, delimiter=delimiter, header=header, gather_hist=make_hist, dtype=dtype,
+                        usecols=usecols)
+            if weights is not None:
+                with profiler.stage(REDUCE_STAGE):
+                    weight_col = weight_column(weights, usecols, header_row, dim_vectors.shape[1], data_file)
+                    stats = calc_weighted_moments(dim_vectors, dim_vectors[:, weight_col])
+                with profiler.stage(PERCENTILE_STAGE):
+                    stats[PCT_KEY] = calc_weighted_percentiles(dim_vectors, dim_vectors[:, weight_col], calc_pcts)
+                # the weight column is not reported
+                stats, header_row, hist_data = drop_column(weight_col, stats, header_row, hist_data)
+            elif group_by is None:
+                with profiler.stage(REDUCE_STAGE):
+                    # the error estimates and rolling statistics need the rows in order, so are found before the
+                    # percentiles reorder them
+                    error_stats = calc_error_stats(dim_vectors, num_blocks) if autocorr else {}
+                    blocks = [dim_vectors[start:start + chunk_rows]
+                              for start in range(0, len(dim_vectors), chunk_rows)]
+                    for acc in accumulators:
+                        for block in blocks:
+                            acc.update(block)
+                    if range_accumulator is not None:
+                        num_hist = NumericHistogram(equal_width_edges(bins, range_accumulator.min_vector,
+                                                                      range_accumulator.max_vector))
+                        for block in blocks:
+                            num_hist.update(block)
+                    if rolling is not None:
+                        rolling_stats = calc_rolling_stats(dim_vectors, rolling)
+                    stats = calc_moments(dim_vectors)
+                    stats.update(error_stats)
+                if rolling is not None:
+                    with profiler.stage(WRITE_STAGE):
+                        write_rolling_stats(data_file, out_dir, rolling_stats, header_row, rolling, step=rolling_step,
+                                            out_format=rolling_format, print_message=not quiet)
+                with profiler.stage(PERCENTILE_STAGE):
+                    stats[PCT_KEY] = calc_percentiles(dim_vectors, calc_pcts, overwrite_input=True)
             else:
-                print("{:>20s} {}".format(row[0], ' '.join(['{:16.6f}'.format(x) for x in row[1:]])))
+                with profiler.stage(REDUCE_STAGE):
+                    keys, codes = group_codes(group_keys)
+                    grouped = sort_groups(dim_vectors, codes, len(keys))
+                    stats = calc_group_moments(grouped)
+                with profiler.stage(PERCENTILE_STAGE):
+                    stats[PCT_KEY] = calc_group_percentiles(grouped, calc_pcts)
 
-    f_name = create_out_fname(data_file, prefix='stats_', ext='.csv', base_dir=out_dir)
-    list_to_csv(to_print, f_name)
-    # list_to_file(to_print, f_name, delimiter=',')
+    except InvalidDataError as e:
+        raise InvalidDataError("{}\n"
+                               "Run program with '-h' to see options, such as specifying header row (-n) "
+                               "and/or delimiter (-d)".format(e))
+
+    if group_by is None:
+        with profiler.stage(WRITE_STAGE):
+            to_print = stats_rows(stats, percentiles, calc_pcts, header_row, len_buffer)
+        if min_max_dict is not None:
+            with profiler.stage(BOUND_STAGE):
+                to_print += bound_rows(stats, calc_pcts, header_row, min_max_dict)
+        if header:
+            to_print.insert(0, [''] + header_row)
+    else:
+        # long format: the rows of each group, labeled with the group key
+        to_print = []
+        for group, key in enumerate(keys):
+            group_stats = {stat_key: stats[stat_key][group] for stat_key in (MIN_KEY, MAX_KEY, AVG_KEY, STD_KEY)}
+            group_stats[PCT_KEY] = [pct_vectors[group] for pct_vectors in stats[PCT_KEY]]
+            with profiler.stage(WRITE_STAGE):
+                group_rows = stats_rows(group_stats, percentiles, calc_pcts, header_row, len_buffer)
+            if min_max_dict is not None:
+                with profiler.stage(BOUND_STAGE):
+                    group_rows += bound_rows(group_stats, calc_pcts, header_row, min_max_dict)
+            to_print += [[key] + row for row in group_rows]
+        if header:
+            to_print.insert(0, [file_header[group_col], ''] + header_row)
+
+    if pair_accumulator is not None:
+        with profiler.stage(REDUCE_STAGE):
+            matrices = pair_accumulator.matrices()
+
+    with profiler.stage(WRITE_STAGE):
+        # Printing to standard out: do not print quotes around strings because using csv writer
+        num_labels = 1 if group_by is None else 2
+        if len(to_print[-1]) - num_labels < 12 and not quiet:
+            for index, row in enumerate(to_print):
+                labels = ' '.join(['{:>20s}'.format(label) for label in row[:num_labels]])
+                # formatting for header
+                if index == 0 and header:
+                    print("{} {}".format(labels, ' '.join(['{:>16s}'.format(x.strip()) for x in row[num_labels:]])))
+                # formatting for vals
+                else:
+                    print("{} {}".format(labels, ' '.join(['{:16.6f}'.format(x) for x in row[num_labels:]])))
+
+        f_name = create_out_fname(data_file, prefix='stats_', ext='.' + out_format, base_dir=out_dir)
+        write_stats(to_print, f_name, header=header, num_labels=num_labels, out_format=out_format,
+                    print_message=not quiet)
+
+        col_names = list(range(len(to_print[-1]) - num_labels)) if header_row is None else header_row
+        if pair_accumulator is not None:
+            for prefix, matrix in zip(['cov_', 'corr_'], matrices):
+                f_name = create_out_fname(data_file, prefix=prefix, ext='.' + out_format, base_dir=out_dir)
+                write_stats([[''] + col_names] + [[col_name] + row
+                                                  for col_name, row in zip(col_names, matrix.tolist())],
+                            f_name, header=True, out_format=out_format, print_message=not quiet)
+        if num_hist is not None:
+            write_numeric_hists(data_file, out_dir, num_hist, col_names, out_format=out_format,
+                                print_message=not quiet)
 
     if make_hist:
-        create_hists(data_file, header_row, hist_data, out_dir)
+        create_hists(data_file, header_row, hist_data, out_dir, make_png=make_png, num_workers=hist_workers,
+                     profiler=profiler, print_message=not quiet)
+
+    return to_print
 
 
-def create_hist_plot(hist_dict, header, out_dir, data_file):
+def summary_rows(data_file, to_print, header=False, grouped=False):
     """
-    See https://stanford.edu/~mwaskom/software/seaborn/examples/horizontal_barplot.html
-    @param hist_dict: dict of label, count
-    @param header: name of dictionary
-    @param out_dir: str, name of directory where files are to be saved
-    @param data_file: name of data file
-    @return: a list of lists (label, count)
+    Converts the stats rows of one file (as returned by process_file) to rows of a summary table
+    @param data_file: name of the data file
+    @param to_print: list of stats rows, with a header row (column names) if header is True
+    @param header: boolean indicating whether to_print starts with the header row
+    @param grouped: boolean indicating whether to_print has the group key before the label of each row (group_by)
+    @return: a list with one row per data column (and group, if grouped): the file, group key (if grouped), column
+        name (or number), and the stats for that column
     """
-    # remove spaces in name
-    header = "".join(header.split())
+    num_labels = 2 if grouped else 1
+    if header:
+        col_names = to_print[0][num_labels:]
+        stat_rows = to_print[1:]
+    else:
+        col_names = list(range(len(to_print[0]) - num_labels))
+        stat_rows = to_print
+    if not grouped:
+        return [[data_file, col_name] + [row[col + 1] for row in stat_rows] for col, col_name in enumerate(col_names)]
+    group_rows = collections.OrderedDict()
+    for row in stat_rows:
+        group_rows.setdefault(row[0], []).append(row)
+    return [[data_file, key, col_name] + [row[col + 2] for row in rows]
+            for key, rows in group_rows.items() for col, col_name in enumerate(col_names)]
+
 
-    # convert dict to list for creating bar chat
+def process_files(data_files, out_dir, summary_file, num_workers=1, **kwargs):
+    """
+    Runs process_file for each data file, in a pool of processes if num_workers > 1, and writes a summary csv
+    with one row per file and column (with file names relative to the directory of the summary file)
+    @param data_files: list of data file names
+    @param out_dir: output directory (None to write outputs next to each data file)
+    @param summary_file: name of the summary file to write
+    @param num_workers: number of processes
+    @param kwargs: keyword arguments (other than data_file and out_dir) for process_file
+    @return: the return code: GOOD_RET, unless a file could not be processed
+    """
+    ret = GOOD_RET
+    results = []
+    executor = None
+    if num_workers > 1:
+        executor = ProcessPoolExecutor(max_workers=num_workers)
+        jobs = [executor.submit(process_file, data_file, out_dir, **kwargs).result for data_file in data_files]
+    else:
+        jobs = [functools.partial(process_file, data_file, out_dir, **kwargs) for data_file in data_files]
+    try:
+        for data_file, job in zip(data_files, jobs):
+            try:
+                results.append((data_file, job()))
+            except IOError as e:
+                warning("Problems reading file:", e)
+                ret = IO_ERROR
+            except InvalidDataError as e:
+                warning("Problems reading data in file {}:".format(data_file), e)
+                ret = INVALID_DATA
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if len(results) > 0:
+        profiler = kwargs.get('profiler', NO_PROFILER)
+        header = kwargs.get('header', False)
+        grouped = kwargs.get('group_by') is not None
+        if grouped:
+            # the labels of the stats rows of the first group, without the colons
+            first_key = results[0][1][int(header)][0]
+            stat_labels = [row[1].rstrip(':') for row in results[0][1][int(header):] if row[0] == first_key]
+            to_print = [['file', 'group', 'column'] + stat_labels]
+        else:
+            # the labels of the stats rows, without the colons
+            stat_labels = [row[0].rstrip(':') for row in results[0][1][int(header):]]
+            to_print = [['file', 'column'] + stat_labels]
+        summary_dir = os.path.dirname(summary_file)
+        with profiler.stage(WRITE_STAGE):
+            for data_file, file_rows in results:
+                to_print += summary_rows(os.path.relpath(data_file, summary_dir), file_rows, header=header,
+                                         grouped=grouped)
+            list_to_csv(to_print, summary_file, print_message=not kwargs.get('quiet', False))
+    return ret
+
+
+def hist_bar_data(hist_dict):
+    """
+    @param hist_dict: dict of label, count
+    @return: a list of lists (label, count), sorted by decreasing count and then by label
+    """
     bar_data = [[key, val] for key, val in hist_dict.items()]
     bar_data.sort(key=itemgetter(0))
     bar_data.sort(key=itemgetter(1), reverse=True)
+    return bar_data
+
+
+def create_hist_plot(bar_data, header, f_name):
+    """
+    See https://stanford.edu/~mwaskom/software/seaborn/examples/horizontal_barplot.html
+    Each call draws on its own figure, which is closed once saved, so that calls can be made in separate processes.
+    @param bar_data: a list of lists (label, count)
+    @param header: title of the plot
+    @param f_name: str, name of the png file to be saved
+    @return: f_name
+    """
+    # plotting libraries are only imported when needed, as they are slow to import
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    import pandas as pd
 
     # bar chart background style
     sns.set(style="whitegrid", font='Arial')
@@ -216,44 +1564,82 @@ def create_hist_plot(hist_dict, header, out_dir, data_file):
     ax.set_title(header)
     with warnings.catch_warnings():
         warnings.simplefilter("ignore")
-        plt.tight_layout()
-
-    f_name = create_out_fname(data_file, suffix=header, base_dir=out_dir, ext=".png")
-    plt.savefig(f_name, dpi=300)
-    print("Wrote file: {}".format(f_name))
+        f.tight_layout()
 
-    # quote strings for printing so csv properly read, and add header
-    count_to_print = [[header + "_key", header + "_count"]]
-    for row in bar_data:
-        count_to_print.append([row[0], row[1]])
+    f.savefig(f_name, dpi=300)
+    plt.close(f)
+    return f_name
 
-    return count_to_print
 
-
-def create_hists(data_file, header_row, hist_data, out_dir):
-    counts_to_print = []
-    if len(hist_data) > 0:
+def create_hists(data_file, header_row, hist_data, out_dir, make_png=True, num_workers=1, profiler=NO_PROFILER,
+                 print_message=True):
+    """
+    Writes a csv with the counts of the non-numerical entries of each column and, optionally, a bar chart per column
+    @param data_file: name of data file
+    @param header_row: list of column names (None to use column numbers)
+    @param hist_data: dict (keyed by column number) of dicts of label, count
+    @param out_dir: str, name of directory where files are to be saved
+    @param make_png: boolean to flag whether to plot the counts
+    @param num_workers: number of processes to use for plotting
+    @param profiler: StageProfiler timing the plotting and the writing of the counts
+    @param print_message: boolean to print the names of the files written
+    """
+    count_cols = []
+    plot_jobs = []
+    with profiler.stage(WRITE_STAGE):
         for col in hist_data:
-            count_to_print = create_hist_plot(hist_data[col], header_row[col], out_dir, data_file)
+            if header_row is None:
+                header = str(col)
+            else:
+                # remove spaces in name
+                header = "".join(header_row[col].split())
+            bar_data = hist_bar_data(hist_data[col])
+            if make_png:
+                png_file = create_out_fname(data_file, suffix=header, base_dir=out_dir, ext=".png")
+                plot_jobs.append((bar_data, header, png_file))
+            # add header to the counts
+            count_cols.append([[header + "_key", header + "_count"]] + bar_data)
 
-            if len(counts_to_print) == 0:
-                counts_to_print = count_to_print
+    if plot_jobs:
+        with profiler.stage(PLOT_STAGE):
+            if num_workers > 1 and len(plot_jobs) > 1:
+                with ProcessPoolExecutor(max_workers=num_workers) as executor:
+                    png_files = list(executor.map(create_hist_plot, *zip(*plot_jobs)))
             else:
-                len1 = len(counts_to_print)
-                len2 = len(count_to_print)
-                width1 = len(counts_to_print[0])
-                width2 = len(count_to_print[0])
-                combined_list = []
-                for row in range(min(len1, len2)):
-                    combined_list.append(counts_to_print[row] + count_to_print[row])
-                for row in range(len2, len1):
-                    combined_list.append(counts_to_print[row] + [""] * width2)
-                for row in range(len1, len2):
-                    # noinspection PyTypeChecker
-                    combined_list.append([""] * width1 + count_to_print[row])
-                counts_to_print = copy.deepcopy(combined_list)
-    f_name = create_out_fname(data_file, prefix='counts_', ext='.csv', base_dir=out_dir)
-    list_to_csv(counts_to_print, f_name, delimiter=',')
+                png_files = [create_hist_plot(*plot_job) for plot_job in plot_jobs]
+        if print_message:
+            for f_name in png_files:
+                print("Wrote file: {}".format(f_name))
+
+    with profiler.stage(WRITE_STAGE):
+        # the (key, count) columns are side by side, padded with empty strings, and written one row at a time
+        counts_to_print = ([val for key_count in row for val in key_count]
+                           for row in zip_longest(*count_cols, fillvalue=["", ""]))
+        f_name = create_out_fname(data_file, prefix='counts_', ext='.csv', base_dir=out_dir)
+        list_to_csv(counts_to_print, f_name, delimiter=',', print_message=print_message)
+
+
+def report_profile(profiler, data_files, print_table=True, profile_file=None, print_message=True):
+    """
+    Prints the stages recorded with --profile as a table and, optionally, writes them as JSON: the 'stages' (each
+    with the stage name, number of calls, wall and CPU time, and peak RSS), the 'total' for the run, and the data
+    'files' processed
+    @param profiler: the StageProfiler passed to process_file
+    @param data_files: list of the data files processed
+    @param print_table: boolean to print the table
+    @param profile_file: name of the JSON file to write (None to not write one)
+    @param print_message: boolean to print the name of the JSON file written
+    """
+    summary = profiler.summary()
+    summary['files'] = data_files
+    if print_table:
+        print("Profile:")
+        profiler.print_table(summary)
+    if profile_file is not None:
+        with open(profile_file, 'w') as f:
+            json.dump(summary, f, indent=1)
+        if print_message:
+            print("Wrote file: {}".format(profile_file))
 
 
 def main(argv=None):
@@ -270,14 +1656,116 @@ def main(argv=None):
                 len_buffer = float(args.buffer)
             except ValueError:
                 raise InvalidDataError("Input for buffer ({}) could not be converted to a float.".format(args.buffer))
-        if args.out_dir is None:
-            args.out_dir = os.path.dirname(args.file)
+        if args.percentiles is None:
+            percentiles = PERCENTILES
+        else:
+            try:
+                percentiles = [float(pct) for pct in args.percentiles.split(",")]
+            except ValueError:
+                raise InvalidDataError("Could not convert percentiles ({}) to a list of floats."
+                                       "".format(args.percentiles))
+            if min(percentiles) < 0 or max(percentiles) > 100:
+                raise InvalidDataError("Percentiles must be between 0 and 100; found: {}".format(args.percentiles))
+        if args.columns is None:
+            usecols = None
+        else:
+            # indices are converted to ints; other entries are column names
+            usecols = [int(col) if col.isdigit() else col for col in
+                       [col.strip() for col in args.columns.split(",")]]
+        if args.group_by is None:
+            group_by = None
+        else:
+            if args.stream:
+                raise InvalidDataError("Grouped statistics (--group_by) are not available in streaming mode.")
+            group_by = int(args.group_by) if args.group_by.isdigit() else args.group_by
+        if args.weights is None:
+            weights = None
+        else:
+            if args.stream or group_by is not None:
+                raise InvalidDataError("Weighted statistics (--weights) are not available in streaming mode or with "
+                                       "--group_by.")
+            weights = int(args.weights) if args.weights.isdigit() else args.weights
+        if args.autocorr and (args.stream or group_by is not None or weights is not None):
+            raise InvalidDataError("Autocorrelation error estimates (--autocorr) are not available in streaming "
+                                   "mode or with --group_by or --weights.")
+        if args.rolling is not None and (args.stream or group_by is not None or weights is not None):
+            raise InvalidDataError("Rolling statistics (--rolling) are not available in streaming mode or with "
+                                   "--group_by or --weights.")
+        if args.rolling_step < 1:
+            raise InvalidDataError("The rolling step must be a positive integer; found {}.".format(args.rolling_step))
+        if args.incremental and (group_by is not None or weights is not None or args.autocorr or
+                                 args.rolling is not None):
+            raise InvalidDataError("Incremental mode (--incremental) is not available with --group_by, --weights, "
+                                   "--autocorr, or --rolling.")
+        if args.corr and (group_by is not None or weights is not None or args.incremental):
+            raise InvalidDataError("Covariance and correlation matrices (--corr) are not available with --group_by, "
+                                   "--weights, or --incremental.")
+        bins = None
+        if args.bins is not None:
+            if group_by is not None or weights is not None or args.incremental:
+                raise InvalidDataError("Numeric histograms (--bins) are not available with --group_by, --weights, "
+                                       "or --incremental.")
+            try:
+                if ',' in args.bins:
+                    bins = [float(edge) for edge in args.bins.split(",")]
+                else:
+                    bins = int(args.bins)
+            except ValueError:
+                raise InvalidDataError("Could not convert bins ({}) to a number of bins or a list of bin edges."
+                                       "".format(args.bins))
+            if np.ndim(bins) == 0 and bins < 1:
+                raise InvalidDataError("The number of bins must be a positive integer; found {}.".format(bins))
+            if np.ndim(bins) > 0 and not (np.isfinite(bins).all() and (np.diff(bins) > 0).all()):
+                raise InvalidDataError("Bin edges must be finite and increasing; found: {}".format(args.bins))
+        if args.chunk_rows < 1:
+            raise InvalidDataError("The number of rows per chunk must be a positive integer; found {}."
+                                   "".format(args.chunk_rows))
+        if args.workers < 1:
+            raise InvalidDataError("The number of workers must be a positive integer; found {}.".format(args.workers))
+        profiler = StageProfiler(enabled=args.profile or args.profile_file is not None)
+        if profiler.enabled and args.workers > 1 and (args.list_file is not None or args.glob is not None):
+            raise InvalidDataError("Profiling (--profile) is not available when processing multiple files with more "
+                                   "than one worker (-j).")
+        batch_files = []
+        if args.list_file is not None:
+            batch_files += read_file_list(args.list_file)
+        if args.glob is not None:
+            found_files = find_files_by_dir(args.base_dir, args.glob)
+            for found_dir in sorted(found_files):
+                batch_files += [os.path.join(found_dir, f_name) for f_name in sorted(found_files[found_dir])]
+            if len(found_files) == 0:
+                warning("No files matching '{}' found in: {}".format(args.glob, args.base_dir))
         if args.min_max_file is None:
             min_max_dict = None
         else:
-            min_max_dict = read_csv(args.min_max_file, quote_style=csv.QUOTE_NONNUMERIC)
-        process_file(args.file, args.out_dir, len_buffer, args.delimiter, min_max_dict,
-                     header=args.names, make_hist=args.histogram)
+            with profiler.stage(READ_STAGE):
+                min_max_dict = read_csv(args.min_max_file, quote_style=csv.QUOTE_NONNUMERIC)
+        process_kwargs = dict(len_buffer=len_buffer, delimiter=args.delimiter, min_max_dict=min_max_dict,
+                              header=args.names, make_hist=args.histogram, stream=args.stream,
+                              chunk_rows=args.chunk_rows, percentiles=percentiles, make_png=not args.no_png,
+                              cache=args.cache, cache_dir=args.cache_dir, dtype=args.dtype, usecols=usecols,
+                              group_by=group_by, weights=weights,
+                              autocorr=args.autocorr, num_blocks=args.num_blocks, rolling=args.rolling,
+                              rolling_step=args.rolling_step, rolling_format=args.rolling_format,
+                              incremental=args.incremental, out_format=args.out_format, quiet=args.quiet,
+                              corr=args.corr, bins=bins, profiler=profiler)
+        ret = GOOD_RET
+        if args.list_file is None and args.glob is None:
+            if args.file is None:
+                args.file = DEF_ARRAY_FILE
+            batch_files = [args.file]
+            process_file(args.file, args.out_dir, hist_workers=args.workers, **process_kwargs)
+        else:
+            if args.file is not None:
+                batch_files.insert(0, args.file)
+            if args.out_dir is None:
+                summary_file = os.path.abspath(DEF_SUMMARY_FILE)
+            else:
+                summary_file = os.path.join(args.out_dir, DEF_SUMMARY_FILE)
+            ret = process_files(batch_files, args.out_dir, summary_file, num_workers=args.workers, **process_kwargs)
+        if profiler.enabled:
+            report_profile(profiler, batch_files, print_table=args.profile, profile_file=args.profile_file,
+                           print_message=not args.quiet)
     except IOError as e:
         warning("Problems reading file:", e)
         return IO_ERROR
@@ -285,7 +1773,7 @@ def main(argv=None):
         warning("Problems reading data:", e)
         return INVALID_DATA
 
-    return GOOD_RET  # success
+    return ret
 
 
 if __name__ == '__main__':
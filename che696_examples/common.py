@@ -6,18 +6,42 @@ Functions and constants to be used my multiple scripts.
 
 from __future__ import print_function
 
+import bz2
 import collections
 import csv
 import difflib
 import errno
 import fnmatch
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import lzma
+import mmap
 import numpy as np
 import os
+import re
 import six
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 import argparse
 import math
+import warnings
+
+try:
+    import zstandard
+except ImportError:
+    # only needed to read zstd-compressed files
+    zstandard = None
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, where peak memory is then not reported
+    resource = None
 
 
 __author__ = 'hbmayes'
@@ -51,6 +75,30 @@ R = 0.001985877534
 
 XYZ_ORIGIN = np.zeros(3)
 
+# Number of rows per chunk when reading data files in chunks
+DEF_CHUNK_ROWS = 10000
+# Delimiters for which purely numeric files can be parsed by numpy a block of lines at a time, and the number of
+# bytes of the (decompressed) file in each block
+FAST_PARSE_DELIMITERS = (' ', ',', ';', '|', ':')
+TEXT_BLOCK_BYTES = 1 << 20
+# Compression formats that are read (and decompressed as they are read), identified by extension or first bytes
+GZIP = 'gzip'
+BZ2 = 'bz2'
+XZ = 'xz'
+ZSTD = 'zstd'
+COMPRESSION_EXTS = {'.gz': GZIP, '.bz2': BZ2, '.xz': XZ, '.lzma': XZ, '.zst': ZSTD}
+# The first bytes of each format: for bz2, as 'BZh' is plain text, also the block size digit and the magic of the
+# first block (or, for an empty stream, of the end of the stream)
+COMPRESSION_MAGIC = {GZIP: re.compile(re.escape(b'\x1f\x8b')),
+                     BZ2: re.compile(b'BZh[1-9](' + re.escape(b'1AY&SY') + b'|' + re.escape(b'\x17rE8P\x90') + b')'),
+                     XZ: re.compile(re.escape(b'\xfd7zXZ\x00')), ZSTD: re.compile(re.escape(b'\x28\xb5\x2f\xfd'))}
+# enough bytes for any of the above
+COMPRESSION_MAGIC_BYTES = 10
+COMPRESSION_OPENERS = {GZIP: gzip.open, BZ2: bz2.open, XZ: lzma.open,
+                       ZSTD: None if zstandard is None else zstandard.open}
+# Version of the format of the cache files written by cached_np_float_array_from_file
+CACHE_VERSION = 2
+
 
 # Exceptions #
 
@@ -301,6 +349,24 @@ def find_files_by_dir(tgt_dir, pat):
     return match_dirs
 
 
+def read_file_list(list_file):
+    """
+    Reads a file listing file names, one per line. Empty lines and lines beginning with '#' are ignored.
+    Relative paths are taken as relative to the directory of the list file.
+    :param list_file: The file with the list of file names.
+    @return: A list of file names.
+    """
+    base_dir = os.path.dirname(list_file)
+    file_list = []
+    with open(list_file) as f:
+        for line in f:
+            f_name = line.strip()
+            if len(f_name) == 0 or f_name.startswith('#'):
+                continue
+            file_list.append(os.path.join(base_dir, f_name))
+    return file_list
+
+
 def get_fname_root(src_file):
     """
 
@@ -334,7 +400,7 @@ def read_csv_dict(d_file, ints=True, one_to_one=True, pdb_dict=False, str_float=
         one_to_one = False
     # If d_file is None, return the empty dictionary, as no dictionary file was specified
     if d_file is not None:
-        with open(d_file) as csv_file:
+        with open_text(d_file) as csv_file:
             reader = csv.reader(csv_file)
             key_count = 0
             for row in reader:
@@ -372,7 +438,7 @@ def read_csv_header(src_file):
     :param src_file: The CSV file to read.
     @return: The first row or None if empty.
     """
-    with open(src_file) as csv_file:
+    with open_text(src_file) as csv_file:
         for row in csv.reader(csv_file):
             return list(row)
 
@@ -386,7 +452,8 @@ def create_out_fname(src_file, prefix='', suffix='', remove_prefix=None, base_di
     :param suffix: The file suffix to append, if specified.
     :param base_dir: The base directory to use; defaults to `src_file`'s directory.
     :param ext: The extension to use instead of the source file's extension;
-        defaults to the `scr_file`'s extension.
+        defaults to the `scr_file`'s extension. For compressed source files (e.g. 'data.csv.gz'), both extensions
+        are replaced by `ext`.
     @return: The output file name.
     """
 
@@ -398,6 +465,8 @@ def create_out_fname(src_file, prefix='', suffix='', remove_prefix=None, base_di
         base_name = file_name[len(remove_prefix):]
     else:
         base_name = os.path.splitext(file_name)[0]
+        if ext is not None and os.path.splitext(file_name)[1].lower() in COMPRESSION_EXTS:
+            base_name = os.path.splitext(base_name)[0]
 
     if ext is None:
         ext = os.path.splitext(file_name)[1]
@@ -405,72 +474,788 @@ def create_out_fname(src_file, prefix='', suffix='', remove_prefix=None, base_di
     return os.path.abspath(os.path.join(base_dir, prefix + base_name + suffix + ext))
 
 
-def np_float_array_from_file(data_file, delimiter=" ", header=False, gather_hist=False):
+def _float_row_reader(csv_file, delimiter):
+    """
+    Returns a csv reader that, as with np.genfromtxt, ignores leading and trailing spaces and line endings
+    """
+    return csv.reader((line.strip(" \r\n") for line in csv_file), delimiter=delimiter)
+
+
+def _is_data_row(row):
+    """
+    @return: False for empty rows and comment rows (beginning with '#')
+    """
+    return len(row) > 0 and not row[0].startswith('#')
+
+
+def _check_row_len(row, line_len, data_file, delimiter):
+    if len(row) != line_len:
+        raise InvalidDataError('File could not be read as an array of floats: {}\n  Expected '
+                               'values separated by "{}" with an equal number of columns per row.\n'
+                               '  However, found {} values on the first data row'
+                               '  and {} values on the later row: "{}")'
+                               ''.format(data_file, delimiter, line_len, len(row), row))
+
+
+class _FloatRowFiller(object):
+    """
+    Converts rows of strings to rows of a float array, using nan for entries that cannot be converted, and
+    optionally counting those entries. Columns are dictionary-encoded once an entry that cannot be converted is
+    found in them (e.g. columns of residue names): their entries are then set aside, so that the other entries of
+    each row are converted by numpy at once, and every `block_rows` rows (and on flush) the entries set aside are
+    counted with collections.Counter and each distinct entry is converted only once.
+    As entries are converted when set aside entries are flushed, `flush` must be called with the filled array
+    before its values are used.
+    """
+    def __init__(self, hist_data=None, block_rows=DEF_CHUNK_ROWS):
+        """
+        :param hist_data: if not None, a dict (keyed by column) of dicts of counts of each non-numerical entry, to
+            add the counts to
+        :param block_rows: the maximum number of rows of entries set aside
+        """
+        self.hist_data = hist_data
+        self.block_rows = block_rows
+        # the dictionary-encoded columns, and the (array row number, entry) pairs set aside for each
+        self.cat_cols = []
+        self.cat_rows = {}
+        self.cat_entries = {}
+        self.num_set_aside = 0
+
+    def fill(self, data_array, row_num, row):
+        """
+        :param data_array: 2D numpy float array to fill
+        :param row_num: the row of data_array to fill
+        :param row: list of strings (modified in place)
+        """
+        if self.cat_cols:
+            for col in self.cat_cols:
+                self.cat_rows[col].append(row_num)
+                self.cat_entries[col].append(row[col])
+                row[col] = 'nan'
+            self.num_set_aside += 1
+        try:
+            data_array[row_num] = row
+        except ValueError:
+            for col in range(len(row)):
+                try:
+                    data_array[row_num, col] = float(row[col])
+                except ValueError:
+                    # the entries of this column are set aside from now on
+                    data_array[row_num, col] = np.nan
+                    self.cat_cols.append(col)
+                    self.cat_rows[col] = []
+                    self.cat_entries[col] = []
+                    self._count({row[col]: 1}, col)
+        if self.num_set_aside >= self.block_rows:
+            self.flush(data_array)
+
+    def flush(self, data_array):
+        """
+        Converts and counts the entries set aside, filling their rows of data_array. Columns in which all these
+        entries were converted are no longer set aside.
+        """
+        cat_cols = []
+        for col in self.cat_cols:
+            entry_counts = collections.Counter(self.cat_entries[col])
+            values = {}
+            non_float_counts = {}
+            for entry, count in entry_counts.items():
+                try:
+                    values[entry] = float(entry)
+                except ValueError:
+                    values[entry] = np.nan
+                    non_float_counts[entry] = count
+            if len(non_float_counts) == len(entry_counts):
+                data_array[self.cat_rows[col], col] = np.nan
+            else:
+                data_array[self.cat_rows[col], col] = [values[entry] for entry in self.cat_entries[col]]
+            self._count(non_float_counts, col)
+            self.cat_rows[col] = []
+            self.cat_entries[col] = []
+            if len(non_float_counts) > 0 or len(entry_counts) == 0:
+                cat_cols.append(col)
+        self.cat_cols = cat_cols
+        self.num_set_aside = 0
+
+    def _count(self, entry_counts, col):
+        if self.hist_data is None or len(entry_counts) == 0:
+            return
+        col_counts = self.hist_data.setdefault(col, {})
+        for entry, count in entry_counts.items():
+            col_counts[entry] = col_counts.get(entry, 0) + count
+
+
+def _select_columns(usecols, header_row, data_file):
+    """
+    @param usecols: list of column indices (0-based) and/or names (found in the header_row), or None for all columns
+    @param header_row: list of column names, or None if the file has no header
+    @param data_file: name of the file being read, for error messages
+    @return: the list of column indices (or None for all columns), and the header row of the selected columns
+    """
+    if usecols is None:
+        return None, header_row
+    cols = []
+    for col in usecols:
+        if isinstance(col, six.string_types):
+            if header_row is None or col not in header_row:
+                raise InvalidDataError("Column '{}' not found in the header row of file: {}".format(col, data_file))
+            cols.append(header_row.index(col))
+        else:
+            cols.append(int(col))
+    if header_row is not None:
+        _check_usecols(cols, len(header_row), data_file)
+        header_row = [header_row[col] for col in cols]
+    return cols, header_row
+
+
+def _check_usecols(usecols, line_len, data_file):
+    if usecols is not None and (len(usecols) == 0 or min(usecols) < 0 or max(usecols) >= line_len):
+        raise InvalidDataError("Column indices {} do not select columns (0 to {}) of file: {}"
+                               "".format(usecols, line_len - 1, data_file))
+
+
+def _warn_nan():
+    warning("Encountered entry (or entries) which could not be converted to a float. "
+            "'nan' will be returned for the stats for that column.")
+
+
+def _check_float_data(data_file, delimiter, num_rows, line_len, has_nan):
+    """
+    Final checks of data read by np_float_array_from_file or FloatArrayChunks
+    @param line_len: the number of columns in the file (selected or not)
+    """
+    if has_nan:
+        if num_rows * line_len == 1:
+            raise InvalidDataError("Data in file was not read as an array of floats. Check input, "
+                                   "e.g. if the delimiter is not ('{}')".format(delimiter))
+        else:
+            _warn_nan()
+    if num_rows < 2 or line_len < 2:
+        raise InvalidDataError("File contains a vector, not an array of floats: {}\n".format(data_file))
+
+
+def _file_compression(file_name):
+    """
+    @param file_name: name of the file to check
+    @return: the compression format of the file (a key of COMPRESSION_OPENERS), from its extension or, if that is
+        not a compression extension, its first bytes; None for uncompressed files
+    """
+    ext = os.path.splitext(file_name)[1].lower()
+    if ext in COMPRESSION_EXTS:
+        return COMPRESSION_EXTS[ext]
+    with open(file_name, 'rb') as f:
+        file_start = f.read(COMPRESSION_MAGIC_BYTES)
+    for compression, magic in COMPRESSION_MAGIC.items():
+        if magic.match(file_start):
+            return compression
+    return None
+
+
+class _PrefetchReader(io.RawIOBase):
+    """
+    Reads a file object in blocks of TEXT_BLOCK_BYTES, reading the next block in a background thread, so that
+    decompression (which releases the GIL) overlaps with the parsing of the previous block
+    """
+    def __init__(self, f):
+        io.RawIOBase.__init__(self)
+        self.f = f
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.next_block = self.executor.submit(f.read, TEXT_BLOCK_BYTES)
+        self.block = b''
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.pos == len(self.block):
+            self.block = self.next_block.result()
+            self.pos = 0
+            if len(self.block) == 0:
+                return 0
+            self.next_block = self.executor.submit(self.f.read, TEXT_BLOCK_BYTES)
+        num_bytes = min(len(buffer), len(self.block) - self.pos)
+        buffer[:num_bytes] = memoryview(self.block)[self.pos:self.pos + num_bytes]
+        self.pos += num_bytes
+        return num_bytes
+
+    def close(self):
+        if not self.closed:
+            self.executor.shutdown()
+            self.f.close()
+        io.RawIOBase.close(self)
+
+
+def _open_binary(file_name, compression):
+    """
+    @return: a binary file object for reading the decompressed contents of the file, decompressing ahead of the
+        reader in a background thread
+    """
+    if compression == ZSTD and zstandard is None:
+        raise InvalidDataError("Reading zstd-compressed file {} requires the 'zstandard' package.".format(file_name))
+    return io.BufferedReader(_PrefetchReader(COMPRESSION_OPENERS[compression](file_name, 'rb')))
+
+
+def open_text(file_name):
+    """
+    Opens a file for reading text. Files compressed with gzip, bz2, xz, or zstd (detected by extension or by their
+    first bytes) are decompressed as they are read, without writing the decompressed file.
+    @param file_name: name of the (possibly compressed) file
+    @return: a text file object
+    """
+    compression = _file_compression(file_name)
+    if compression is None:
+        return open(file_name)
+    return io.TextIOWrapper(_open_binary(file_name, compression))
+
+
+def complete_lines_size(file_name):
+    """
+    @param file_name: name of an uncompressed file
+    @return: the number of bytes of the file up to and including its last line ending, so that a line still being
+        written (e.g. by a running simulation) is left out
+    """
+    with open(file_name, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        while end > 0:
+            start = max(end - TEXT_BLOCK_BYTES, 0)
+            f.seek(start)
+            last_newline = f.read(end - start).rfind(b'\n')
+            if last_newline >= 0:
+                return start + last_newline + 1
+            end = start
+    return 0
+
+
+class _ByteRangeReader(io.RawIOBase):
+    """
+    Reads the bytes of a file from `offset` up to (not including) `end_offset`
+    """
+    def __init__(self, file_name, offset, end_offset):
+        io.RawIOBase.__init__(self)
+        self.f = open(file_name, 'rb')
+        self.f.seek(offset)
+        self.remaining = end_offset - offset
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        num_bytes = self.f.readinto(memoryview(buffer)[:max(min(len(buffer), self.remaining), 0)])
+        self.remaining -= num_bytes
+        return num_bytes
+
+    def close(self):
+        self.f.close()
+        io.RawIOBase.close(self)
+
+
+def open_text_range(file_name, offset, end_offset):
+    """
+    Opens part of an uncompressed file for reading text, e.g. the rows appended since it was last read
+    @param file_name: name of the file
+    @param offset: the byte at which to start (the start of a line)
+    @param end_offset: the byte at which to stop (the start of a line, or the end of the file)
+    @return: a text file object
+    """
+    if _file_compression(file_name) is not None:
+        raise InvalidDataError("Part of a compressed file cannot be read on its own: {}".format(file_name))
+    return io.TextIOWrapper(io.BufferedReader(_ByteRangeReader(file_name, offset, end_offset)))
+
+
+def _line_blocks(data_file, compression):
+    """
+    Yields the bytes of the file in blocks of whole lines of about TEXT_BLOCK_BYTES (longer, for longer lines).
+    Uncompressed files are memory-mapped; compressed files are decompressed as they are read.
+    Note: the caller should exhaust or close the generator (as when it goes out of scope).
+    """
+    if compression is None:
+        file_size = os.path.getsize(data_file)
+        if file_size == 0:
+            return
+        with open(data_file, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                start = 0
+                while start < file_size:
+                    end = min(start + TEXT_BLOCK_BYTES, file_size)
+                    if end < file_size:
+                        end = (mapped.rfind(b'\n', start, end) + 1 or mapped.find(b'\n', end) + 1) or file_size
+                    yield mapped[start:end]
+                    start = end
+            finally:
+                mapped.close()
+    else:
+        # the blocks are small enough that numpy's parser, which does not release the GIL, does not hold it for
+        # long, so that the next block is decompressed while this one is parsed
+        with _open_binary(data_file, compression) as f:
+            partial_line = b''
+            while True:
+                block = f.read(TEXT_BLOCK_BYTES)
+                if not block:
+                    break
+                block = partial_line + block
+                end = block.rfind(b'\n') + 1
+                partial_line = block[end:]
+                if end > 0:
+                    yield block[:end]
+            if partial_line:
+                yield partial_line
+
+
+def _line_delimiter_counts(block, delimiter):
+    """
+    @param block: bytes of whole lines of a file
+    @param delimiter: single-character delimiter
+    @return: the number of delimiters in each line of the block
+    """
+    block = np.frombuffer(block, dtype=np.uint8)
+    line_ends = np.flatnonzero(block == ord('\n'))
+    if len(line_ends) == 0 or line_ends[-1] != len(block) - 1:
+        # last line of a file without a final new line
+        line_ends = np.append(line_ends, len(block))
+    delimiter_counts = np.searchsorted(np.flatnonzero(block == ord(delimiter)), line_ends)
+    return np.diff(np.concatenate(([0], delimiter_counts)))
+
+
+def _block_lines(blocks):
+    """
+    Yields the lines of blocks of whole lines of a file (see _line_blocks), decoded as by open_text
+    """
+    for block in blocks:
+        for line in io.TextIOWrapper(io.BytesIO(block)):
+            yield line
+
+
+def _np_float_array_from_blocks(data_file, delimiter=" ", header=False, dtype=np.float64, usecols=None):
+    """
+    Fast path of np_float_array_from_file for files with only numbers (and a header row, if specified): blocks of
+    lines (from a memory map or, for compressed files, from the decompression stream; see _line_blocks) are parsed
+    by numpy's text parser into a float buffer, without creating Python objects for each row or entry. Line
+    lengths are checked with vectorized counts of the delimiters and new lines in each block.
+    Once a block cannot be read this way (e.g. it has comments, quotes, blank lines, non-numerical entries, or rows
+    of different lengths, as a partly written last line), the rows already parsed are kept, and the lines from that
+    block on are returned for np_float_array_from_file to read.
+    :param data_file: file expected to have delimited values, with the same number of entries per row
+    :param delimiter: one of FAST_PARSE_DELIMITERS
+    :param header: default is no header; if True, the first line is read as the header
+    :param dtype: float type of the returned array
+    :param usecols: list of indices and/or names of the columns to return, or None for all columns; the others
+        are parsed (in C) but not stored
+    @return: the numpy array (with room for more rows), the number of rows filled, the header row (None if not
+        specified), the column indices (None for all columns), the number of columns in the file, and an iterator
+        over the lines left to read (None if all were read); or None if no rows can be read this way (e.g. the file
+        is empty or its first block cannot be parsed), so that np_float_array_from_file should read the whole file
+    """
+    if delimiter not in FAST_PARSE_DELIMITERS:
+        return None
+    # entries that np_float_array_from_file treats differently than numpy's parser
+    special_chars = [b'#', b'"']
+    if delimiter == ' ':
+        special_chars += [b'  ', b'\t']
+    file_size = os.path.getsize(data_file)
+    header_row = None
+    read_header = not header
+    data_array = None
+    line_len = 0
+    num_rows = 0
+    blocks = _line_blocks(data_file, _file_compression(data_file))
+    for block in blocks:
+        if not read_header:
+            header_end = block.find(b'\n') + 1 or len(block)
+            header_row = next(_float_row_reader([block[:header_end].decode('utf-8')], delimiter), None)
+            block = block[header_end:]
+            read_header = True
+            if len(block) == 0:
+                continue
+        values = _parse_block(block, delimiter, special_chars, line_len)
+        if values is None:
+            if data_array is None:
+                return None
+            return data_array, num_rows, header_row, usecols, line_len, _block_lines(itertools.chain([block], blocks))
+        if data_array is None:
+            line_len = values.shape[1]
+            if line_len < 2:
+                return None
+            usecols, header_row = _select_columns(usecols, header_row, data_file)
+            _check_usecols(usecols, line_len, data_file)
+            # estimate the number of rows from the first block, to minimize later resizing (compressed files are
+            # underestimated, so the array is then grown as needed)
+            num_est = file_size * len(values) // len(block) + 1
+            data_array = np.empty((num_est, line_len if usecols is None else len(usecols)), dtype=dtype)
+        block_rows = len(values)
+        if num_rows + block_rows > len(data_array):
+            data_array.resize((max(2 * len(data_array), num_rows + block_rows), data_array.shape[1]),
+                              refcheck=False)
+        if usecols is not None:
+            values = values[:, usecols]
+        data_array[num_rows:num_rows + block_rows] = values
+        num_rows += block_rows
+    if data_array is None:
+        return None
+    return data_array, num_rows, header_row, usecols, line_len, None
+
+
+def _parse_block(block, delimiter, special_chars, line_len):
+    """
+    Parses a block of whole lines of numbers with numpy's text parser
+    :param block: bytes of whole lines
+    :param delimiter: one of FAST_PARSE_DELIMITERS
+    :param special_chars: byte strings that, if in the block, mean it must be read by the csv reader
+    :param line_len: the number of entries expected in each line, or 0 to take it from the first line
+    @return: 2D float64 array of the block, or None if it cannot be read this way
+    """
+    if any(special_char in block for special_char in special_chars):
+        return None
+    delimiter_counts = _line_delimiter_counts(block, delimiter)
+    if line_len == 0:
+        line_len = delimiter_counts[0] + 1
+    if np.any(delimiter_counts != line_len - 1):
+        return None
+    block_rows = len(delimiter_counts)
+    # new lines are parsed as delimiters; a final new line is left off
+    if block.endswith(b'\n'):
+        block = block[:-1]
+    if delimiter != ' ':
+        block = block.replace(b'\n', delimiter.encode())
+    with warnings.catch_warnings():
+        # older versions of numpy warn instead of raising an error for entries that cannot be parsed
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            values = np.fromstring(block, dtype=np.float64, sep=delimiter)
+        except (ValueError, DeprecationWarning):
+            return None
+    if len(values) != block_rows * line_len:
+        return None
+    return values.reshape(block_rows, line_len)
+
+
+def _fill_float_rows(csv_reader, data_array, num_rows, line_len, usecols, filler, data_file, delimiter, dtype):
     """
-    Adds to the basic np.loadtxt by performing data checks.
+    Fills (and grows as needed) a float array with the data rows of a csv reader, as np_float_array_from_file
+    :param csv_reader: reader of the rows (see _float_row_reader)
+    :param data_array: the array to fill, or None to make one sized from the file size and first data row
+    :param num_rows: the number of rows of data_array already filled
+    :param line_len: the number of columns in the file, or 0 if not yet known
+    :param usecols: list of column indices to keep, or None for all columns
+    :param filler: the _FloatRowFiller to convert the rows with
+    :param data_file: the name of the file, for estimating its number of rows and for messages
+    :param delimiter: the file delimiter
+    :param dtype: float type of the array
+    @return: the array, the number of rows filled, and the number of columns in the file
+    """
+    for row in csv_reader:
+        if not _is_data_row(row):
+            continue
+        if data_array is None:
+            line_len = len(row)
+            _check_usecols(usecols, line_len, data_file)
+            # estimate the number of rows from the length of the first one, to minimize later resizing
+            row_bytes = len(delimiter.join(row)) + 1
+            data_array = np.empty((os.path.getsize(data_file) // row_bytes + 1,
+                                   line_len if usecols is None else len(usecols)), dtype=dtype)
+        else:
+            _check_row_len(row, line_len, data_file, delimiter)
+        if num_rows == len(data_array):
+            data_array.resize((2 * num_rows, data_array.shape[1]), refcheck=False)
+        if usecols is not None:
+            row = [row[col] for col in usecols]
+        filler.fill(data_array, num_rows, row)
+        num_rows += 1
+    return data_array, num_rows, line_len
+
+
+def np_float_array_from_file(data_file, delimiter=" ", header=False, gather_hist=False, dtype=np.float64,
+                             usecols=None):
+    """
+    Reads a delimited file of floats in a single pass, performing data checks. Compressed files are decompressed as
+    they are read (see open_text). Purely numeric blocks of lines are parsed by numpy (see
+    _np_float_array_from_blocks); the rest of the file, from the first block that cannot be parsed that way, is
+    parsed row by row directly into a preallocated float buffer (sized from the file size and first data row, and
+    grown if needed). Entries that cannot be converted to floats are stored as nan. Empty lines and lines beginning
+    with '#' are skipped.
     :param data_file: file expected to have space-separated values, with the same number of entries per row
     :param delimiter: default is a space-separated file
     :param header: default is no header; alternately, specify number of header lines
     :param gather_hist: default is false; gather data to make histogram of non-numerical data
+    :param dtype: float type of the returned array; e.g. np.float32 to halve the memory used
+    :param usecols: list of indices (0-based) and/or names (from the header row) of the columns to return; entries
+        in other columns are not converted to floats or counted for histograms. Default (None) is all columns.
     @return: a numpy array or InvalidDataError if unsuccessful, followed by the header_row (None if none specified)
     """
-    header_row = None
-    hist_data = {}
-    with open(data_file) as csv_file:
-        csv_list = list(csv.reader(csv_file, delimiter=delimiter))
-    if header:
-        header_row = csv_list[0]
+    data_array, header_row, hist_data, line_len = _read_float_array(data_file, delimiter=delimiter, header=header,
+                                                                    gather_hist=gather_hist, dtype=dtype,
+                                                                    usecols=usecols)
+    _check_float_data(data_file, delimiter, data_array.shape[0], line_len, np.isnan(data_array).any())
+    return data_array, header_row, hist_data
+
+
+def _read_float_array(data_file, delimiter=" ", header=False, gather_hist=False, dtype=np.float64, usecols=None):
+    """
+    Reads a delimited file of floats as np_float_array_from_file, without the final checks (see _check_float_data)
+    @return: the numpy array, the header_row (None if none specified), the hist_data, and the number of columns in
+        the file
+    """
+    hist_data = {} if gather_hist else None
+    filler = _FloatRowFiller(hist_data)
+    fast_result = _np_float_array_from_blocks(data_file, delimiter=delimiter, header=header, dtype=dtype,
+                                              usecols=usecols)
+    if fast_result is None:
+        header_row = None
+        with open_text(data_file) as csv_file:
+            csv_reader = _float_row_reader(csv_file, delimiter)
+            if header:
+                header_row = next(csv_reader, None)
+            usecols, header_row = _select_columns(usecols, header_row, data_file)
+            data_array, num_rows, line_len = _fill_float_rows(csv_reader, None, 0, 0, usecols, filler, data_file,
+                                                              delimiter, dtype)
+    else:
+        data_array, num_rows, header_row, usecols, line_len, rest_lines = fast_result
+        if rest_lines is not None:
+            data_array, num_rows, line_len = _fill_float_rows(_float_row_reader(rest_lines, delimiter), data_array,
+                                                              num_rows, line_len, usecols, filler, data_file,
+                                                              delimiter, dtype)
+
+    if data_array is None:
+        data_array = np.empty((0, 0), dtype=dtype)
+    else:
+        filler.flush(data_array)
+        data_array.resize((num_rows, data_array.shape[1]), refcheck=False)
+    return data_array, header_row, {} if hist_data is None else hist_data, line_len
+
+
+def read_column(data_file, col, delimiter=" ", header=False):
+    """
+    Reads the (string) entries of one column of a delimited file, skipping the same rows as np_float_array_from_file,
+    so that the entries line up with the rows of the array it returns
+    :param data_file: file expected to have delimited values, with the same number of entries per row
+    :param col: index (0-based) or name (from the header row) of the column to read
+    :param delimiter: default is a space-separated file
+    :param header: default is no header; alternately, specify number of header lines
+    @return: a numpy array of the column entries, the index of the column, the number of columns in the file, and
+        the header_row (None if none specified)
+    """
+    entries = []
+    line_len = 0
+    with open_text(data_file) as csv_file:
+        csv_reader = _float_row_reader(csv_file, delimiter)
+        header_row = next(csv_reader, None) if header else None
+        col = _select_columns([col], header_row, data_file)[0][0]
+        for row in csv_reader:
+            if not _is_data_row(row):
+                continue
+            if line_len == 0:
+                line_len = len(row)
+                _check_usecols([col], line_len, data_file)
+            else:
+                _check_row_len(row, line_len, data_file, delimiter)
+            entries.append(row[col])
+    return np.array(entries, dtype=object), col, line_len, header_row
+
+
+def _cache_key(data_file, delimiter, header, dtype=np.float64):
+    """
+    @return: dict identifying the version of data_file (and the options used to read it) stored in a cache
+    """
+    f_stat = os.stat(data_file)
+    return {'version': CACHE_VERSION, 'path': os.path.abspath(data_file), 'mtime': f_stat.st_mtime,
+            'size': f_stat.st_size, 'delimiter': delimiter, 'header': bool(header), 'dtype': np.dtype(dtype).name}
+
+
+def cache_file_base(data_file, cache_dir=None):
+    """
+    @param data_file: name of the data file
+    @param cache_dir: directory for the cache files; default is the directory of the data file
+    @return: the cache file names, without extensions ('.npy' for the data and '.json' for the key and other info)
+    """
+    if cache_dir is None:
+        cache_dir = os.path.dirname(data_file)
+    path_hash = hashlib.md5(os.path.abspath(data_file).encode('utf-8')).hexdigest()[:8]
+    return os.path.join(cache_dir, ".{}.{}.cache".format(os.path.basename(data_file), path_hash))
 
+
+def cached_np_float_array_from_file(data_file, delimiter=" ", header=False, gather_hist=False, cache_dir=None,
+                                    dtype=np.float64, usecols=None):
+    """
+    Returns the same as np_float_array_from_file, using a binary cache of the parsed data when one is available for
+    the same path, modification time, size, delimiter, header option, and dtype; otherwise reads the file and
+    writes the cache. The cached array is memory-mapped (copy-on-write), so repeat runs skip text parsing entirely.
+    :param data_file: file expected to have space-separated values, with the same number of entries per row
+    :param delimiter: default is a space-separated file
+    :param header: default is no header; alternately, specify number of header lines
+    :param gather_hist: default is false; gather data to make histogram of non-numerical data
+    :param cache_dir: directory for the cache files; default is the directory of the data file
+    :param dtype: float type of the returned array
+    :param usecols: list of indices and/or names of the columns to return (default is all). The cache holds all
+        columns, so that it can be used for any selection.
+    @return: a numpy array or InvalidDataError if unsuccessful, followed by the header_row (None if none specified)
+    """
+    cache_base = cache_file_base(data_file, cache_dir)
+    cache_key = _cache_key(data_file, delimiter, header, dtype=dtype)
+    data_array = None
     try:
-        data_array = np.genfromtxt(data_file, dtype=np.float64, delimiter=delimiter, skip_header=header)
-    except ValueError:
+        with open(cache_base + '.json') as f:
+            cache_info = json.load(f)
+        if cache_info['key'] == cache_key and (cache_info['hist_data'] is not None or not gather_hist):
+            data_array = np.load(cache_base + '.npy', mmap_mode='c')
+            nan_cols = np.array(cache_info['nan_cols'], dtype=bool)
+            header_row = cache_info['header_row']
+            if gather_hist:
+                hist_data = {int(col): col_counts for col, col_counts in cache_info['hist_data'].items()}
+            else:
+                hist_data = {}
+    except (IOError, ValueError, KeyError):
+        # no cache, or one that cannot be read: read the data file
         data_array = None
-        line_len = None
-        if header:
-            first_line = 1
+
+    if data_array is None:
+        # the data is checked once the columns are selected, so that nan in other columns is not warned about
+        data_array, header_row, hist_data, _ = _read_float_array(data_file, delimiter=delimiter, header=header,
+                                                                 gather_hist=gather_hist, dtype=dtype)
+        nan_cols = np.isnan(data_array).any(axis=0)
+        cache_info = {'key': cache_key, 'header_row': header_row, 'nan_cols': nan_cols.tolist(),
+                      'hist_data': hist_data if gather_hist else None}
+        try:
+            silent_remove(cache_base + '.json')
+            np.save(cache_base + '.npy', data_array)
+            # the json file is written last, so that it is only present for a complete cache
+            with open(cache_base + '.json', 'w') as f:
+                json.dump(cache_info, f)
+        except IOError as e:
+            warning("Could not write cache for file {}: {}".format(data_file, e))
+
+    num_rows, line_len = data_array.shape
+    if usecols is not None:
+        usecols, header_row = _select_columns(usecols, header_row, data_file)
+        _check_usecols(usecols, line_len, data_file)
+        data_array = data_array[:, usecols]
+        nan_cols = nan_cols[usecols]
+        hist_data = {new_col: hist_data[col] for new_col, col in enumerate(usecols) if col in hist_data}
+    _check_float_data(data_file, delimiter, num_rows, line_len, nan_cols.any())
+    return data_array, header_row, hist_data
+
+
+def cached_read_column(data_file, col, delimiter=" ", header=False, cache_dir=None):
+    """
+    Returns the same as read_column, using a cache of the column entries (next to those of
+    cached_np_float_array_from_file, and kept for the same path, modification time, size, delimiter, and header
+    option), so that repeat runs grouped by a key column also skip reading the text
+    :param data_file: file expected to have delimited values, with the same number of entries per row
+    :param col: index (0-based) or name (from the header row) of the column to read
+    :param delimiter: default is a space-separated file
+    :param header: default is no header; alternately, specify number of header lines
+    :param cache_dir: directory for the cache files; default is the directory of the data file
+    @return: as read_column
+    """
+    # one cache per requested column, named for a hash of the index or name
+    col_hash = hashlib.md5(json.dumps(col).encode('utf-8')).hexdigest()[:8]
+    cache_base = "{}.col_{}".format(cache_file_base(data_file, cache_dir), col_hash)
+    cache_key = _cache_key(data_file, delimiter, header)
+    try:
+        with open(cache_base + '.json') as f:
+            cache_info = json.load(f)
+        if cache_info['key'] == cache_key and cache_info['requested'] == col:
+            entries = np.load(cache_base + '.npy').astype(object)
+            return entries, cache_info['col'], cache_info['line_len'], cache_info['header_row']
+    except (IOError, ValueError, KeyError):
+        # no cache, or one that cannot be read: read the data file
+        pass
+
+    entries, col_index, line_len, header_row = read_column(data_file, col, delimiter=delimiter, header=header)
+    cache_info = {'key': cache_key, 'requested': col, 'col': col_index, 'line_len': line_len,
+                  'header_row': header_row}
+    try:
+        silent_remove(cache_base + '.json')
+        # saved as fixed-width strings, so that no pickling is needed to load them
+        np.save(cache_base + '.npy', entries.astype(str))
+        # the json file is written last, so that it is only present for a complete cache
+        with open(cache_base + '.json', 'w') as f:
+            json.dump(cache_info, f)
+    except IOError as e:
+        warning("Could not write cache for file {}: {}".format(data_file, e))
+    return entries, col_index, line_len, header_row
+
+
+class FloatArrayChunks(object):
+    """
+    Iterates over a delimited file of floats, yielding 2D float arrays (of type `dtype`) of at most `chunk_rows`
+    rows, so that files larger than memory can be processed. Rows are parsed and checked (and columns selected with
+    `usecols`) as in np_float_array_from_file. Once iteration begins, `header_row` is set (if `header` is True);
+    `usecols` is then converted to indices; `hist_data` (which may be given counts to add to) and `line_len` (the
+    number of columns in the file) are complete once iteration ends.
+    With `end_offset`, only the lines of an uncompressed file from byte `offset` up to `end_offset` are read (see
+    open_text_range), e.g. to read only rows appended since an earlier read. When starting past the beginning of the
+    file, the header is not read (so `usecols` must be given by index), and the rows read are not required to form
+    an array (at least two rows and columns).
+    Note: the yielded array is reused for the next chunk; copy it if it must be kept.
+    """
+    def __init__(self, data_file, delimiter=" ", header=False, gather_hist=False, chunk_rows=DEF_CHUNK_ROWS,
+                 dtype=np.float64, usecols=None, offset=0, end_offset=None):
+        self.data_file = data_file
+        self.delimiter = delimiter
+        self.header = header
+        self.chunk_rows = chunk_rows
+        self.dtype = dtype
+        self.usecols = usecols
+        self.header_row = None
+        self.hist_data = {}
+        self.gather_hist = gather_hist
+        self.num_rows = 0
+        self.line_len = 0
+        self.offset = offset
+        self.end_offset = end_offset
+
+    def __iter__(self):
+        line_len = 0
+        has_nan = False
+        filler = _FloatRowFiller(self.hist_data if self.gather_hist else None, block_rows=self.chunk_rows)
+        chunk = None
+        chunk_row = 0
+        if self.end_offset is None:
+            text_file = open_text(self.data_file)
         else:
-            first_line = 0
-        for row in csv_list[first_line:]:
-            if len(row) == 0:
-                continue
-            s_len = len(row)
-            if line_len is None:
-                line_len = s_len
-            elif s_len != line_len:
-                raise InvalidDataError('File could not be read as an array of floats: {}\n  Expected '
-                                       'values separated by "{}" with an equal number of columns per row.\n'
-                                       '  However, found {} values on the first data row'
-                                       '  and {} values on the later row: "{}")'
-                                       ''.format(data_file, delimiter, line_len, s_len, row))
-            data_vector = np.empty([line_len], dtype=np.float64)
-            for col in range(line_len):
-                try:
-                    data_vector[col] = float(row[col])
-                except ValueError:
-                    data_vector[col] = np.nan
-                    if gather_hist:
-                        col_key = str(row[col])
-                        if col in hist_data:
-                            if col_key in hist_data[col]:
-                                hist_data[col][col_key] += 1
-                            else:
-                                hist_data[col][col_key] = 1
-                        else:
-                            hist_data[col] = {col_key: 1}
-            if data_array is None:
-                data_array = np.copy(data_vector)
-            else:
-                data_array = np.vstack((data_array, data_vector))
-    if np.isnan(data_array).any():
-        if data_array.size == 1:
-            raise InvalidDataError("Data in file was not read as an array of floats. Check input, "
-                                   "e.g. if the delimiter is not ('{}')".format(delimiter))
+            text_file = open_text_range(self.data_file, self.offset, self.end_offset)
+        with text_file as csv_file:
+            csv_reader = _float_row_reader(csv_file, self.delimiter)
+            if self.header and self.offset == 0:
+                self.header_row = next(csv_reader, None)
+            usecols, self.header_row = _select_columns(self.usecols, self.header_row, self.data_file)
+            self.usecols = usecols
+            for row in csv_reader:
+                if not _is_data_row(row):
+                    continue
+                if chunk is None:
+                    line_len = len(row)
+                    self.line_len = line_len
+                    _check_usecols(usecols, line_len, self.data_file)
+                    chunk = np.empty((self.chunk_rows, line_len if usecols is None else len(usecols)),
+                                     dtype=self.dtype)
+                else:
+                    _check_row_len(row, line_len, self.data_file, self.delimiter)
+                if usecols is not None:
+                    row = [row[col] for col in usecols]
+                filler.fill(chunk, chunk_row, row)
+                chunk_row += 1
+                self.num_rows += 1
+                if chunk_row == self.chunk_rows:
+                    filler.flush(chunk)
+                    has_nan = has_nan or np.isnan(chunk).any()
+                    yield chunk
+                    chunk_row = 0
+        if chunk_row > 0:
+            filler.flush(chunk)
+            has_nan = has_nan or np.isnan(chunk[:chunk_row]).any()
+            # checks are done before the last chunk is returned, so that vectors (one row) are not processed
+            self._check(line_len, has_nan)
+            yield chunk[:chunk_row]
         else:
-            warning("Encountered entry (or entries) which could not be converted to a float. "
-                    "'nan' will be returned for the stats for that column.")
-    if len(data_array.shape) == 1:
-        raise InvalidDataError("File contains a vector, not an array of floats: {}\n".format(data_file))
-    return data_array, header_row, hist_data
+            self._check(line_len, has_nan)
+
+    def _check(self, line_len, has_nan):
+        if self.offset == 0:
+            _check_float_data(self.data_file, self.delimiter, self.num_rows, line_len, has_nan)
+        elif has_nan:
+            _warn_nan()
 
 
 def convert_dict_line(all_conv, data_conv, line):
@@ -507,7 +1292,7 @@ def read_csv(src_file, data_conv=None, all_conv=None, quote_style=csv.QUOTE_MINI
     @return: A list of dicts containing the file's data.
     """
     result = []
-    with open(src_file) as csv_file:
+    with open_text(src_file) as csv_file:
         csv_reader = csv.DictReader(csv_file, quoting=quote_style)
         for line in csv_reader:
             result.append(convert_dict_line(all_conv, data_conv, line))
@@ -528,7 +1313,7 @@ def read_csv_to_dict(src_file, col_name, data_conv=None, all_conv=None):
     @return: A list of dicts containing the file's data.
     """
     result = {}
-    with open(src_file) as csv_file:
+    with open_text(src_file) as csv_file:
         try:
             csv_reader = csv.DictReader(csv_file, quoting=csv.QUOTE_NONNUMERIC)
             create_dict(all_conv, col_name, csv_reader, data_conv, result, src_file)
@@ -717,6 +1502,124 @@ def process_cfg(raw_cfg, def_cfg_vals=None, req_keys=None, int_list=True):
     return proc_cfg
 
 
+# Profiling #
+
+def rss_mb(peak=True):
+    """
+    On Linux, the values are read from /proc, as the peak from getrusage (used on other systems) is carried over
+    from the parent process when a process is started, and cannot be reset.
+    @param peak: boolean to return the peak resident memory instead of the current one
+    @return: the peak (since the last reset_peak_rss) or current resident memory (MB) of this process, or None if it
+        cannot be found
+    """
+    field = 'VmHWM:' if peak else 'VmRSS:'
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field):
+                    # in kB
+                    return int(line.split()[1]) / 1.e3
+    except IOError:
+        pass
+    if resource is None or not peak:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return max_rss / (1.e6 if sys.platform == 'darwin' else 1.e3)
+
+
+def reset_peak_rss():
+    """
+    Resets the peak resident memory of this process to the current one, where supported (Linux 4.0 and later)
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except IOError:
+        pass
+
+
+# marks the end of the items of StageProfiler.iterate
+_END = object()
+
+
+class StageProfiler(object):
+    """
+    Records the wall time, CPU time (of this process, not of any it starts), and peak resident memory (see rss_mb)
+    of the named stages of a run. A stage may be entered many times (e.g. once per chunk of rows): its times are
+    summed, and its highest peak kept. Stages should not be nested, as entering one resets the peak memory.
+    When not enabled, stages are not timed.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stages = collections.OrderedDict()
+        self.start_wall = time.time()
+        self.start_cpu = time.process_time()
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        reset_peak_rss()
+        start_wall = time.time()
+        start_cpu = time.process_time()
+        try:
+            yield
+        finally:
+            stage_info = self.stages.setdefault(name, collections.OrderedDict([
+                ('stage', name), ('calls', 0), ('wall_s', 0.), ('cpu_s', 0.), ('peak_rss_mb', None)]))
+            stage_info['calls'] += 1
+            stage_info['wall_s'] += time.time() - start_wall
+            stage_info['cpu_s'] += time.process_time() - start_cpu
+            peak_rss = rss_mb()
+            if peak_rss is not None:
+                stage_info['peak_rss_mb'] = max(peak_rss, stage_info['peak_rss_mb'] or 0.)
+
+    def iterate(self, items, name):
+        """
+        Yields the items of an iterable (e.g. the chunks of a FloatArrayChunks), timing the getting of each item as
+        the given stage
+        """
+        item_iter = iter(items)
+        while True:
+            with self.stage(name):
+                item = next(item_iter, _END)
+            if item is _END:
+                return
+            yield item
+
+    def summary(self):
+        """
+        @return: dict of the list of the stage dicts (stage, calls, wall_s, cpu_s, peak_rss_mb), in the order first
+            entered, and of the totals since the profiler was made (wall_s, cpu_s, and the highest peak_rss_mb)
+        """
+        peaks = [stage_info['peak_rss_mb'] for stage_info in self.stages.values()
+                 if stage_info['peak_rss_mb'] is not None]
+        total = collections.OrderedDict([('wall_s', time.time() - self.start_wall),
+                                         ('cpu_s', time.process_time() - self.start_cpu),
+                                         ('peak_rss_mb', max(peaks) if peaks else None)])
+        return collections.OrderedDict([('stages', list(self.stages.values())), ('total', total)])
+
+    def print_table(self, summary=None):
+        """
+        Prints the stages of the summary (default is a new one) as a table
+        """
+        if summary is None:
+            summary = self.summary()
+        labels = ["stage", "calls", "wall (s)", "CPU (s)", "peak RSS (MB)"]
+        print("{:>14s} {:>8s} {:>10s} {:>10s} {:>14s}".format(*labels))
+        for stage_info in summary['stages'] + [dict(summary['total'], stage='total', calls='')]:
+            peak_rss = "n/a" if stage_info['peak_rss_mb'] is None else "{:.1f}".format(stage_info['peak_rss_mb'])
+            print("{:>14s} {:>8} {:10.4f} {:10.4f} {:>14s}".format(stage_info['stage'], stage_info['calls'],
+                                                                   stage_info['wall_s'], stage_info['cpu_s'],
+                                                                   peak_rss))
+
+
+# for functions that take an optional profiler
+NO_PROFILER = StageProfiler(enabled=False)
+
+
 # Conversions #
 
 def to_int_list(raw_val):
@@ -32,6 +32,8 @@ setup(
 
     test_suite='tests',
     install_requires=['numpy', 'six', 'matplotlib', 'pandas', 'seaborn'],
+    # needed only to read zstd-compressed files
+    extras_require={'zstd': ['zstandard']},
     tests_require=['pytest']
     # Additional entries you may want simply uncomment the lines you want and fill in the data
     # author_email='me@place.org',      # Author email
@@ -1,10 +1,22 @@
 #!/usr/bin/env python3
 #  coding=utf-8
 
+import csv
+import gzip
+import json
 import unittest
 import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import numpy as np
 from che696_examples.common import capture_stdout, capture_stderr, diff_lines, silent_remove
-from che696_examples.col_stats import DEF_ARRAY_FILE, main
+from che696_examples.col_stats import (DEF_ARRAY_FILE, main, calc_stats, calc_percentiles, calc_bound_rows,
+                                       calc_group_stats, group_codes, calc_weighted_stats, calc_error_stats,
+                                       calc_rolling_stats, ColumnAccumulator, PairwiseCovAccumulator,
+                                       NumericHistogram, MIN_KEY, MAX_KEY, AVG_KEY, STD_KEY, PCT_KEY, TAU_KEY,
+                                       ESS_KEY, SEM_KEY, BLOCK_SEM_KEY)
 import logging
 
 
@@ -17,6 +29,8 @@ DISABLE_REMOVE = logger.isEnabledFor(logging.DEBUG)
 
 # Directories #
 
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
 DATA_DIR = os.path.join(os.path.dirname(__file__), 'test_data')
 SUB_DATA_DIR = os.path.join(DATA_DIR, 'col_stats')
 
@@ -45,6 +59,7 @@ GOOD_CSV_BUFFER_OUT = os.path.join(SUB_DATA_DIR, "stats_qm_box_sizes_buffer_good
 # noinspection PyUnresolvedReferences
 CSV_HEADER_OUT = os.path.join(SUB_DATA_DIR, "stats_qm_box_sizes_header.csv")
 GOOD_CSV_HEADER_OUT = os.path.join(SUB_DATA_DIR, "stats_qm_box_sizes_header_good.csv")
+GOOD_CSV_HEADER_PCT_OUT = os.path.join(SUB_DATA_DIR, "stats_qm_box_sizes_header_pct_good.csv")
 # noinspection PyUnresolvedReferences
 BAD_INPUT_OUT = os.path.join(SUB_DATA_DIR, "stats_bad_per_col_stats_input.csv")
 GOOD_BAD_INPUT_OUT = os.path.join(SUB_DATA_DIR, "stats_bad_per_col_stats_input_good.csv")
@@ -60,6 +75,16 @@ GOOD_HIST_OUT = os.path.join(SUB_DATA_DIR, "stats_msm_sum_output_more_good.csv")
 # noinspection PyUnresolvedReferences
 HIST_COUNT = os.path.join(SUB_DATA_DIR, "counts_msm_sum_output_more.csv")
 GOOD_HIST_COUNT = os.path.join(SUB_DATA_DIR, "counts_msm_sum_output_more_good.csv")
+GOOD_HIST_COLS_OUT = os.path.join(SUB_DATA_DIR, "stats_msm_sum_output_more_cols_good.csv")
+GOOD_HIST_COLS_COUNT = os.path.join(SUB_DATA_DIR, "counts_msm_sum_output_more_cols_good.csv")
+GOOD_HIST_GROUP_OUT = os.path.join(SUB_DATA_DIR, "stats_msm_sum_output_more_group_good.csv")
+GOOD_HIST_WEIGHTS_OUT = os.path.join(SUB_DATA_DIR, "stats_msm_sum_output_more_weights_good.csv")
+GOOD_HIST_AUTOCORR_OUT = os.path.join(SUB_DATA_DIR, "stats_msm_sum_output_more_autocorr_good.csv")
+# noinspection PyUnresolvedReferences
+HIST_ROLLING_OUT = os.path.join(SUB_DATA_DIR, "rolling_msm_sum_output_more.csv")
+# noinspection PyUnresolvedReferences
+HIST_ROLLING_NPY = os.path.join(SUB_DATA_DIR, "rolling_msm_sum_output_more.npy")
+GOOD_HIST_ROLLING_OUT = os.path.join(SUB_DATA_DIR, "rolling_msm_sum_output_more_good.csv")
 # noinspection PyUnresolvedReferences
 HIST_PNG1 = os.path.join(SUB_DATA_DIR, "msm_sum_output_more(1,0)_max_rls.png")
 # noinspection PyUnresolvedReferences
@@ -67,10 +92,16 @@ HIST_PNG2 = os.path.join(SUB_DATA_DIR, "msm_sum_output_more(1,0)_max_path.png")
 # noinspection PyUnresolvedReferences
 HIST_PNG3 = os.path.join(SUB_DATA_DIR, "msm_sum_output_more(0,-1)_max_rls.png")
 
+LIST_INPUT = os.path.join(SUB_DATA_DIR, "box_sizes_list.txt")
+# noinspection PyUnresolvedReferences
+SUMMARY_OUT = os.path.join(SUB_DATA_DIR, "col_stats_summary.csv")
+GOOD_SUMMARY_OUT = os.path.join(SUB_DATA_DIR, "col_stats_summary_good.csv")
+
 MIN_MAX_INPUT = os.path.join(SUB_DATA_DIR, "msm_sum_output_test_min_max.csv")
 MIN_MAX_FILE = os.path.join(SUB_DATA_DIR, "msm_ini_vals.csv")
 MIN_MAX_OUT = os.path.join(SUB_DATA_DIR, "stats_msm_sum_output_test_min_max.csv")
 GOOD_MIN_MAX_OUT = os.path.join(SUB_DATA_DIR, "stats_msm_sum_output_test_min_max_good.csv")
+PROFILE_OUT = os.path.join(SUB_DATA_DIR, "profile_test.json")
 
 # Test data #
 
@@ -80,6 +111,15 @@ GOOD_OUT = "         Min values:        10.000000        14.995000        10.988
            "            Std dev:         0.798138         0.299536         3.576376"
 
 
+class TestImport(unittest.TestCase):
+    def testNoPlottingImports(self):
+        # plotting libraries should only be imported when histograms are requested
+        check_modules = "import sys; import che696_examples.col_stats; " \
+                        "print([mod for mod in ['seaborn', 'pandas', 'matplotlib.pyplot'] if mod in sys.modules])"
+        output = subprocess.check_output([sys.executable, "-c", check_modules], cwd=ROOT_DIR)
+        self.assertEqual(output.decode().strip(), "[]")
+
+
 class TestPerColFailWell(unittest.TestCase):
     def testNoArgs(self):
         with capture_stderr(main, []) as output:
@@ -116,6 +156,68 @@ class TestPerColFailWell(unittest.TestCase):
             self.assertTrue('WARNING:  Problems reading data: Input for buffer ({}) could not be converted to '
                             'a float.'.format(bad_buffer) in output)
 
+    def testBadChunkRows(self):
+        with capture_stderr(main, ["-f", DEF_INPUT, "-d", ' ', "--stream", "--chunk_rows", "0"]) as output:
+            self.assertTrue("rows per chunk" in output)
+
+    def testBadPercentiles(self):
+        with capture_stderr(main, ["-f", DEF_INPUT, "-d", ' ', "-p", "5,101"]) as output:
+            self.assertTrue("between 0 and 100" in output)
+        with capture_stderr(main, ["-f", DEF_INPUT, "-d", ' ', "-p", "5,ghost"]) as output:
+            self.assertTrue("Could not convert percentiles" in output)
+
+    def testBadWorkers(self):
+        with capture_stderr(main, ["-l", LIST_INPUT, "-d", ' ', "-j", "0"]) as output:
+            self.assertTrue("number of workers" in output)
+
+    def testBadColumns(self):
+        for columns in ["pka_203", "0,8"]:
+            with capture_stderr(main, ["-f", HIST_INPUT, "-n", "-c", columns]) as output:
+                self.assertTrue("olumn" in output)
+
+    def testBadGroupBy(self):
+        with capture_stderr(main, ["-f", HIST_INPUT, "-n", "--group_by", "pka_203"]) as output:
+            self.assertTrue("olumn" in output)
+        with capture_stderr(main, ["-f", HIST_INPUT, "-n", "--group_by", "4", "--stream"]) as output:
+            self.assertTrue("streaming mode" in output)
+
+    def testBadWeights(self):
+        # negative weights
+        with capture_stderr(main, ["-f", MIN_MAX_INPUT, "-n", "--weights", "0"]) as output:
+            self.assertTrue("non-negative" in output)
+        with capture_stderr(main, ["-f", HIST_INPUT, "-n", "--weights", "148d0", "--stream"]) as output:
+            self.assertTrue("streaming mode" in output)
+
+    def testBadAutocorr(self):
+        with capture_stderr(main, ["-f", HIST_INPUT, "-n", "-c", "0,1", "--autocorr", "--num_blocks", "1"]) as output:
+            self.assertTrue("number of blocks" in output)
+        with capture_stderr(main, ["-f", HIST_INPUT, "-n", "--autocorr", "--stream"]) as output:
+            self.assertTrue("streaming mode" in output)
+
+    def testBadCorr(self):
+        with capture_stderr(main, ["-f", HIST_INPUT, "-n", "--corr", "--group_by", "4"]) as output:
+            self.assertTrue("--corr" in output)
+
+    def testBadBins(self):
+        with capture_stderr(main, ["-f", CSV_HEADER_INPUT, "-n", "--bins", "0"]) as output:
+            self.assertTrue("number of bins" in output)
+        with capture_stderr(main, ["-f", CSV_HEADER_INPUT, "-n", "--bins", "1,3,2"]) as output:
+            self.assertTrue("increasing" in output)
+        with capture_stderr(main, ["-f", CSV_HEADER_INPUT, "-n", "--bins", "ten"]) as output:
+            self.assertTrue("Could not convert bins" in output)
+        with capture_stderr(main, ["-f", HIST_INPUT, "-n", "--bins", "5", "--group_by", "4"]) as output:
+            self.assertTrue("--bins" in output)
+
+    def testBadProfile(self):
+        with capture_stderr(main, ["-l", LIST_INPUT, "-d", ' ', "-o", SUB_DATA_DIR, "-j", "2", "--profile"]) as output:
+            self.assertTrue("--profile" in output)
+
+    def testBadRolling(self):
+        with capture_stderr(main, ["-f", HIST_INPUT, "-n", "-c", "0,1", "--rolling", "41"]) as output:
+            self.assertTrue("rolling window" in output)
+        with capture_stderr(main, ["-f", HIST_INPUT, "-n", "--rolling", "5", "--stream"]) as output:
+            self.assertTrue("streaming mode" in output)
+
     def testNoSuchOption(self):
         with capture_stderr(main, ["-@", DEF_INPUT]) as output:
             self.assertTrue("unrecognized argument" in output)
@@ -202,6 +304,138 @@ class TestPerCol(unittest.TestCase):
         finally:
             silent_remove(CSV_HEADER_OUT, disable=DISABLE_REMOVE)
 
+    def testOutFormats(self):
+        good_vals = np.genfromtxt(GOOD_CSV_HEADER_OUT, delimiter=',', skip_header=1)[:, 1:]
+        good_labels = [row.split(',')[0].strip('"') for row in open(GOOD_CSV_HEADER_OUT).read().splitlines()[1:]]
+        out_base = os.path.splitext(CSV_HEADER_OUT)[0]
+        try:
+            with capture_stdout(main, ["-f", CSV_HEADER_INPUT, "-n", "--out_format", "npz", "-q"]) as output:
+                self.assertEqual(output, "")
+            with np.load(out_base + ".npz") as stats_data:
+                self.assertEqual(stats_data['columns'].tolist(), ['x', 'y', 'z'])
+                self.assertEqual(stats_data['labels'].tolist(), good_labels)
+                self.assertTrue(np.allclose(stats_data['stats'], good_vals))
+            main(["-f", CSV_HEADER_INPUT, "-n", "--out_format", "json"])
+            with open(out_base + ".json") as f:
+                stats_data = json.load(f)
+            self.assertEqual(stats_data['labels'], good_labels)
+            self.assertTrue(np.allclose(stats_data['stats'], good_vals))
+            # nor the names of the counts and profile files
+            with capture_stdout(main, ["-f", HIST_INPUT, "-n", "-s", "--no_png", "-q",
+                                       "--profile_file", PROFILE_OUT]) as output:
+                self.assertEqual(output, "")
+            self.assertFalse(diff_lines(HIST_COUNT, GOOD_HIST_COUNT))
+        finally:
+            [silent_remove(out_base + ext, disable=DISABLE_REMOVE) for ext in [".npz", ".json"]]
+            [silent_remove(o_file, disable=DISABLE_REMOVE) for o_file in [HIST_OUT, HIST_COUNT, PROFILE_OUT]]
+
+    def testGroupByNpz(self):
+        with open(GOOD_HIST_GROUP_OUT) as f:
+            good_rows = list(csv.reader(f))[1:]
+        out_file = os.path.splitext(HIST_OUT)[0] + ".npz"
+        try:
+            main(["-f", HIST_INPUT, "-n", "--group_by", "4", "-c", "0,1,2", "--out_format", "npz"])
+            with np.load(out_file) as stats_data:
+                self.assertEqual(stats_data['groups'].tolist(), [row[0] for row in good_rows])
+                self.assertTrue(np.allclose(stats_data['stats'], [[float(val) for val in row[2:]]
+                                                                  for row in good_rows], equal_nan=True))
+        finally:
+            silent_remove(out_file, disable=DISABLE_REMOVE)
+
+    def testCorr(self):
+        data = np.loadtxt(CSV_HEADER_INPUT, delimiter=',', skiprows=1)
+        out_files = [os.path.join(SUB_DATA_DIR, prefix + "qm_box_sizes_header.csv") for prefix in ["cov_", "corr_"]]
+        try:
+            for extra_args in [[], ["--stream", "--chunk_rows", "2"]]:
+                main(["-f", CSV_HEADER_INPUT, "-n", "--corr"] + extra_args)
+                for out_file, good_matrix in zip(out_files, [np.cov(data.T), np.corrcoef(data.T)]):
+                    with open(out_file) as f:
+                        self.assertEqual(next(csv.reader(f)), ["", "x", "y", "z"])
+                    self.assertTrue(np.allclose(np.loadtxt(out_file, delimiter=',', skiprows=1,
+                                                           usecols=(1, 2, 3)), good_matrix))
+        finally:
+            [silent_remove(o_file, disable=DISABLE_REMOVE) for o_file in out_files + [CSV_HEADER_OUT]]
+
+    def testBins(self):
+        data = np.loadtxt(CSV_HEADER_INPUT, delimiter=',', skiprows=1)
+        out_file = os.path.join(SUB_DATA_DIR, "numhist_qm_box_sizes_header.csv")
+        try:
+            for bin_args in [["--bins", "4"], ["--bins", "4", "--stream", "--chunk_rows", "2"],
+                             ["--bins", "10,11.5,12,20", "--stream", "--chunk_rows", "2"]]:
+                main(["-f", CSV_HEADER_INPUT, "-n", "-q"] + bin_args)
+                with open(out_file) as f:
+                    rows = list(csv.reader(f, quoting=csv.QUOTE_NONNUMERIC))
+                self.assertEqual(rows[0], ["column", "lower_edge", "upper_edge", "count"])
+                bins = [float(edge) for edge in bin_args[1].split(",")] if "," in bin_args[1] else int(bin_args[1])
+                for col, col_name in enumerate(["x", "y", "z"]):
+                    counts, edges = np.histogram(data[:, col], bins)
+                    col_rows = [row for row in rows[1:] if row[0] == col_name]
+                    self.assertTrue(np.allclose([row[1] for row in col_rows], edges[:-1]))
+                    self.assertTrue(np.allclose([row[2] for row in col_rows], edges[1:]))
+                    self.assertEqual([row[3] for row in col_rows], counts.tolist())
+        finally:
+            [silent_remove(o_file, disable=DISABLE_REMOVE) for o_file in [out_file, CSV_HEADER_OUT]]
+
+    def testBinsNpz(self):
+        out_file = os.path.join(SUB_DATA_DIR, "numhist_msm_sum_output_more.npz")
+        stats_file = os.path.join(SUB_DATA_DIR, "stats_msm_sum_output_more.npz")
+        try:
+            main(["-f", HIST_INPUT, "-n", "-q", "--bins", "3", "--out_format", "npz"])
+            with np.load(out_file) as hist_data:
+                self.assertEqual(hist_data['edges'].shape, (len(hist_data['columns']), 4))
+                self.assertEqual(hist_data['counts'].shape, (len(hist_data['columns']), 3))
+                # columns without numbers have nan edges and no counts
+                no_floats = np.isnan(hist_data['edges'][:, 0])
+                self.assertTrue(no_floats.any())
+                self.assertFalse(hist_data['counts'][no_floats].any())
+        finally:
+            [silent_remove(o_file, disable=DISABLE_REMOVE) for o_file in [out_file, stats_file]]
+
+    def testNumericHistogram(self):
+        # as np.histogram: the last bin includes its upper edge; nan and values outside the edges are not counted
+        data = np.array([[0., 1.], [0.5, np.nan], [1., 2.], [-1., 3.], [0.25, np.inf]])
+        num_hist = NumericHistogram([[0., 0.5, 1.], [1., 2., 3.]])
+        for start in range(0, len(data), 2):
+            num_hist.update(data[start:start + 2])
+        self.assertEqual(num_hist.counts.tolist(), [[2, 2], [1, 2]])
+
+    def testPairwiseCov(self):
+        # each pair uses the rows without nan in either column
+        rng = np.random.RandomState(0)
+        data = rng.normal(size=(300, 4))
+        data[:, 1] += 2. * data[:, 0] + 1.e4
+        data[[5, 50, 51], 2] = np.nan
+        data[100:120, 3] = np.nan
+        accumulator = PairwiseCovAccumulator()
+        for start in range(0, len(data), 70):
+            accumulator.update(data[start:start + 70])
+        cov_matrix, corr_matrix = accumulator.matrices()
+        for col_1 in range(4):
+            for col_2 in range(4):
+                rows = ~np.isnan(data[:, col_1]) & ~np.isnan(data[:, col_2])
+                self.assertAlmostEqual(cov_matrix[col_1, col_2], np.cov(data[rows, col_1], data[rows, col_2])[0, 1])
+                self.assertAlmostEqual(corr_matrix[col_1, col_2],
+                                       np.corrcoef(data[rows, col_1], data[rows, col_2])[0, 1])
+
+    def testPercentiles(self):
+        test_input = ["-f", CSV_HEADER_INPUT, "-n", "-p", "10,90"]
+        try:
+            with capture_stdout(main, test_input) as output:
+                self.assertTrue("10% percentile:" in output)
+                self.assertFalse("50% percentile:" in output)
+                self.assertFalse(diff_lines(CSV_HEADER_OUT, GOOD_CSV_HEADER_PCT_OUT))
+        finally:
+            silent_remove(CSV_HEADER_OUT, disable=DISABLE_REMOVE)
+
+    def testCalcPercentiles(self):
+        rng = np.random.RandomState(0)
+        percentiles = [0, 4.55, 31.73, 50, 68.27, 95.45, 100]
+        for num_rows in [2, 3, 101]:
+            data = rng.normal(size=(num_rows, 4))
+            data[0, 1] = np.nan
+            good_pcts = np.percentile(data, percentiles, axis=0)
+            self.assertTrue(np.array_equal(calc_percentiles(data, percentiles), good_pcts, equal_nan=True))
+
     def testMixedInput(self):
         """
         This input file has tuples and lists that cannot be handled by np.loadtxt
@@ -237,9 +471,395 @@ class TestPerCol(unittest.TestCase):
                            disable=DISABLE_REMOVE) for o_file in [HIST_PNG1, HIST_PNG2, HIST_PNG3,
                                                                   HIST_OUT, HIST_COUNT, ]]
 
+    def testColumns(self):
+        # by name and by index; only the selected non-numerical column is counted
+        cache_dir = tempfile.mkdtemp()
+        try:
+            for extra_args in [[], ["--stream"], ["--cache", "--cache_dir", cache_dir]]:
+                main(["-f", HIST_INPUT, "-n", "-s", "--no_png", "-c", "pka_148,5,203d0"] + extra_args)
+                self.assertFalse(diff_lines(HIST_OUT, GOOD_HIST_COLS_OUT))
+                self.assertFalse(diff_lines(HIST_COUNT, GOOD_HIST_COLS_COUNT))
+            # numeric columns of a file with non-numerical ones: no nan warning, as when the cache is written (the
+            # first time) or read
+            for extra_args in [[], ["--cache", "--cache_dir", cache_dir], ["--cache", "--cache_dir", cache_dir]]:
+                with capture_stderr(main, ["-f", HIST_INPUT, "-n", "-c", "1,2"] + extra_args) as output:
+                    self.assertFalse(output)
+        finally:
+            shutil.rmtree(cache_dir)
+            [silent_remove(o_file, disable=DISABLE_REMOVE) for o_file in [HIST_OUT, HIST_COUNT]]
+
+    def testGroupBy(self):
+        # the key column is given by name or index, and is not analyzed; with --cache, it is cached (the first time)
+        # and then read from the cache
+        cache_dir = tempfile.mkdtemp()
+        cache_args = ["--group_by", "4", "-c", "0,1,2", "--cache", "--cache_dir", cache_dir]
+        try:
+            for extra_args in [["--group_by", "(1, 0)_max_rls", "-c", "pka_148,148d0,203d0"],
+                               ["--group_by", "4", "-c", "0,1,2"], cache_args, cache_args]:
+                main(["-f", HIST_INPUT, "-n"] + extra_args)
+                self.assertFalse(diff_lines(HIST_OUT, GOOD_HIST_GROUP_OUT))
+            self.assertEqual(len([f_name for f_name in os.listdir(cache_dir) if ".col_" in f_name]), 2)
+        finally:
+            shutil.rmtree(cache_dir)
+            silent_remove(HIST_OUT, disable=DISABLE_REMOVE)
+
+    def testCalcGroupStats(self):
+        # same as calc_stats on the rows of each group
+        rng = np.random.RandomState(0)
+        data = rng.normal(size=(200, 3))
+        data[7, 1] = np.nan
+        keys, codes = group_codes(np.array(['b', 'a', 'c'])[rng.randint(3, size=len(data))])
+        # groups are numbered in order of first appearance
+        self.assertEqual(codes[0], 0)
+        stats = calc_group_stats(data, codes, len(keys), [0, 20, 50, 99])
+        for group in range(len(keys)):
+            good_stats = calc_stats(data[codes == group], [0, 20, 50, 99])
+            for stat_key in [MIN_KEY, MAX_KEY, AVG_KEY, STD_KEY]:
+                self.assertTrue(np.allclose(stats[stat_key][group], good_stats[stat_key], equal_nan=True))
+            for pct_vector, good_vector in zip(stats[PCT_KEY], good_stats[PCT_KEY]):
+                self.assertTrue(np.allclose(pct_vector[group], good_vector, equal_nan=True))
+
+    def testWeights(self):
+        # the weight column is given by name or index, and is not reported
+        try:
+            for extra_args in [["--weights", "148d0"], ["--weights", "1"]]:
+                main(["-f", HIST_INPUT, "-n", "-c", "pka_148,203d0,3"] + extra_args)
+                self.assertFalse(diff_lines(HIST_OUT, GOOD_HIST_WEIGHTS_OUT))
+        finally:
+            silent_remove(HIST_OUT, disable=DISABLE_REMOVE)
+
+    def testCalcWeightedStats(self):
+        rng = np.random.RandomState(0)
+        data = rng.normal(size=(101, 3))
+        pcts = [0, 20, 50, 99, 100]
+        # equal weights (of any scale) give the unweighted statistics
+        stats = calc_weighted_stats(data, np.full(len(data), 0.3), pcts)
+        good_stats = calc_stats(data, pcts)
+        for stat_key in [MIN_KEY, MAX_KEY, AVG_KEY, STD_KEY]:
+            self.assertTrue(np.allclose(stats[stat_key], good_stats[stat_key]))
+        self.assertTrue(np.allclose(stats[PCT_KEY], good_stats[PCT_KEY]))
+        # integer weights give the mean of the repeated rows
+        weights = rng.randint(1, 4, size=len(data))
+        stats = calc_weighted_stats(data.astype(np.float32), weights, pcts)
+        self.assertTrue(np.allclose(stats[AVG_KEY], np.repeat(data, weights, axis=0).mean(axis=0)))
+        # unequal, fractional weights give (nearly, as the repeated rows interpolate between copies) the percentiles
+        # of the repeated rows, and the 0th and 100th are the min and max
+        data = rng.normal(size=(2001, 2))
+        counts = rng.randint(1, 4, size=len(data))
+        rep_pcts = [0, 5, 25, 50, 75, 95, 100]
+        stats = calc_weighted_stats(data, counts * 0.37, rep_pcts)
+        good_pcts = np.percentile(np.repeat(data, counts, axis=0), rep_pcts, axis=0)
+        self.assertTrue(np.allclose(stats[PCT_KEY], good_pcts, atol=0.01))
+        self.assertTrue(np.allclose(stats[PCT_KEY][0], data.min(axis=0)))
+        self.assertTrue(np.allclose(stats[PCT_KEY][-1], data.max(axis=0)))
+        # light ends do not push the percentiles past the min and max
+        stats = calc_weighted_stats(np.arange(10.).reshape(-1, 1), [0.2] + [1.] * 8 + [0.2], [0, 100])
+        self.assertTrue(np.allclose(stats[PCT_KEY], [[0.], [9.]]))
+        # rows of zero weight are left out of the percentiles
+        stats = calc_weighted_stats(np.array([[0.], [1.], [100.], [2.]]), [1, 1, 0, 1], pcts)
+        self.assertTrue(np.allclose(stats[PCT_KEY], np.percentile([[0.], [1.], [2.]], pcts, axis=0)))
+
+    def testAutocorr(self):
+        try:
+            main(["-f", HIST_INPUT, "-n", "-c", "pka_148,148d0,203d0", "--autocorr", "--num_blocks", "4"])
+            self.assertFalse(diff_lines(HIST_OUT, GOOD_HIST_AUTOCORR_OUT))
+        finally:
+            silent_remove(HIST_OUT, disable=DISABLE_REMOVE)
+
+    def testCalcErrorStats(self):
+        # an AR(1) series, with an integrated autocorrelation time of (1 + phi) / (1 - phi), and uncorrelated noise
+        rng = np.random.RandomState(0)
+        phi = 0.8
+        noise = rng.normal(size=(50000, 2))
+        data = noise.copy()
+        for row in range(1, len(data)):
+            data[row, 0] += phi * data[row - 1, 0]
+        stats = calc_error_stats(data.astype(np.float32), num_blocks=20)
+        self.assertTrue(np.allclose(stats[TAU_KEY], [(1 + phi) / (1 - phi), 1.], rtol=0.15))
+        self.assertTrue(np.allclose(stats[ESS_KEY], len(data) / stats[TAU_KEY]))
+        self.assertTrue(np.allclose(stats[SEM_KEY], data.std(axis=0) * np.sqrt(stats[TAU_KEY] / len(data)),
+                                    rtol=1.e-3))
+        # the block estimate agrees within its own (large) uncertainty
+        self.assertTrue(np.allclose(stats[BLOCK_SEM_KEY], stats[SEM_KEY], rtol=0.5))
+
+    def testRolling(self):
+        test_input = ["-f", HIST_INPUT, "-n", "-c", "pka_148,148d0,203d0", "--rolling", "5", "--rolling_step", "3"]
+        try:
+            main(test_input)
+            self.assertFalse(diff_lines(HIST_ROLLING_OUT, GOOD_HIST_ROLLING_OUT))
+            main(test_input + ["--rolling_format", "npy"])
+            self.assertTrue(np.allclose(np.load(HIST_ROLLING_NPY),
+                                        np.loadtxt(GOOD_HIST_ROLLING_OUT, delimiter=',', skiprows=1)))
+            with capture_stdout(main, test_input + ["-q"]) as output:
+                self.assertFalse("Wrote file" in output)
+            self.assertFalse(diff_lines(HIST_ROLLING_OUT, GOOD_HIST_ROLLING_OUT))
+        finally:
+            [silent_remove(o_file, disable=DISABLE_REMOVE) for o_file in [HIST_OUT, HIST_ROLLING_OUT,
+                                                                          HIST_ROLLING_NPY]]
+
+    def testCalcRollingStats(self):
+        # same as the statistics of each window, including those with nan
+        data = np.random.RandomState(0).normal(loc=100., size=(60, 2))
+        data[30, 1] = np.nan
+        window = 7
+        stats = calc_rolling_stats(data.astype(np.float32), window)
+        for stat_key, stat_func in [(AVG_KEY, np.mean), (MIN_KEY, np.min), (MAX_KEY, np.max),
+                                    (STD_KEY, lambda win_data, axis: np.std(win_data, axis=axis, ddof=1))]:
+            good_vals = np.array([stat_func(data[end - window:end].astype(np.float32), axis=0)
+                                  for end in range(window, len(data) + 1)])
+            self.assertTrue(np.allclose(stats[stat_key], good_vals, rtol=1.e-5, equal_nan=True))
+
+    def testGzipInput(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            gz_input = os.path.join(tmp_dir, os.path.basename(CSV_HEADER_INPUT) + ".gz")
+            with open(CSV_HEADER_INPUT, 'rb') as f_in:
+                with gzip.open(gz_input, 'wb') as f_out:
+                    shutil.copyfileobj(f_in, f_out)
+            main(["-f", gz_input, "-n", "-o", tmp_dir])
+            self.assertFalse(diff_lines(os.path.join(tmp_dir, os.path.basename(CSV_HEADER_OUT)),
+                                        GOOD_CSV_HEADER_OUT))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def testHistWorkers(self):
+        try:
+            with capture_stdout(main, ["-f", HIST_INPUT, "-n", "-d", ",", "-s", "-j", "2"]) as output:
+                self.assertTrue(HIST_PNG1 in output)
+            for p_file in [HIST_PNG1, HIST_PNG2, HIST_PNG3]:
+                self.assertGreater(os.path.getsize(p_file), 10000)
+            self.assertFalse(diff_lines(HIST_COUNT, GOOD_HIST_COUNT))
+        finally:
+            [silent_remove(o_file,
+                           disable=DISABLE_REMOVE) for o_file in [HIST_PNG1, HIST_PNG2, HIST_PNG3,
+                                                                  HIST_OUT, HIST_COUNT, ]]
+
+    def testHistNoPng(self):
+        try:
+            main(["-f", HIST_INPUT, "-n", "-d", ",", "-s", "--no_png"])
+            for p_file in [HIST_PNG1, HIST_PNG2, HIST_PNG3]:
+                self.assertFalse(os.path.exists(p_file))
+            self.assertFalse(diff_lines(HIST_OUT, GOOD_HIST_OUT))
+            self.assertFalse(diff_lines(HIST_COUNT, GOOD_HIST_COUNT))
+        finally:
+            [silent_remove(o_file,
+                           disable=DISABLE_REMOVE) for o_file in [HIST_PNG1, HIST_PNG2, HIST_PNG3,
+                                                                  HIST_OUT, HIST_COUNT, ]]
+
+    def testBoundRows(self):
+        min_max_dict = [{'a': 1., 'c': 2.}, {'a': 0.5, 'c': 1.}, {'a': 1.5, 'c': 4.}]
+        with capture_stderr(calc_bound_rows, ['a', 'b', 'c'], np.array([0.4, 0., 1.]), np.array([1.5, 1., 5.]),
+                            np.array([1.1, 0.5, 3.]), np.array([1.5, 0.5, 3.]), min_max_dict) as output:
+            self.assertTrue("header 'a' (0.4) is less than lower bound (0.5)" in output)
+            self.assertTrue("header 'c' (5.0) is greater than upper bound (4.0)" in output)
+            self.assertFalse("header 'b'" in output)
+        bound_rows = calc_bound_rows(['a', 'b', 'c'], np.array([0.4, 0., 1.]), np.array([1.5, 1., 5.]),
+                                     np.array([1.1, 0.5, 3.]), np.array([1.5, 0.5, 3.]), min_max_dict)
+        self.assertEqual([row[0] for row in bound_rows], ['Avg % Diff:', 'Med % Diff:', 'Median is Min:',
+                                                          'Median is Max:'])
+        self.assertTrue(np.allclose(bound_rows[0][1:], [10., np.nan, 50.], equal_nan=True))
+        self.assertTrue(np.allclose(bound_rows[1][1:], [50., np.nan, 50.], equal_nan=True))
+        self.assertEqual([bound_rows[2][1], bound_rows[2][3]], [0, 0])
+        self.assertEqual([bound_rows[3][1], bound_rows[3][3]], [1, 0])
+        self.assertTrue(np.isnan(bound_rows[3][2]))
+
+    def testHistCache(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            for _ in range(2):
+                main(["-f", HIST_INPUT, "-n", "-d", ",", "-s", "--no_png", "--cache", "--cache_dir", cache_dir])
+                self.assertFalse(diff_lines(HIST_OUT, GOOD_HIST_OUT))
+                self.assertFalse(diff_lines(HIST_COUNT, GOOD_HIST_COUNT))
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+        finally:
+            shutil.rmtree(cache_dir)
+            [silent_remove(o_file, disable=DISABLE_REMOVE) for o_file in [HIST_OUT, HIST_COUNT]]
+
+    def testFloat32(self):
+        good_vals = np.genfromtxt(GOOD_CSV_HEADER_OUT, delimiter=',', skip_header=1)[:, 1:]
+        for extra_args in [[], ["--stream", "--chunk_rows", "3"]]:
+            try:
+                main(["-f", CSV_HEADER_INPUT, "-n", "--dtype", "float32"] + extra_args)
+                test_vals = np.genfromtxt(CSV_HEADER_OUT, delimiter=',', skip_header=1)[:, 1:]
+                self.assertTrue(np.allclose(test_vals, good_vals, rtol=1.e-6))
+            finally:
+                silent_remove(CSV_HEADER_OUT, disable=DISABLE_REMOVE)
+
+    def testCalcStatsFloat32(self):
+        data = np.random.RandomState(0).normal(loc=1.e4, size=(30001, 3))
+        stats = calc_stats(data.astype(np.float32))
+        self.assertEqual(stats[AVG_KEY].dtype, np.float64)
+        self.assertTrue(np.allclose(stats[AVG_KEY], data.mean(axis=0), rtol=1.e-7))
+        self.assertTrue(np.allclose(stats[STD_KEY], data.std(axis=0, ddof=1), rtol=1.e-3))
+
     def testMinMax(self):
         try:
             main(["-f", MIN_MAX_INPUT, "-n", "-d", ",", "-m", MIN_MAX_FILE])
             self.assertFalse(diff_lines(MIN_MAX_OUT, GOOD_MIN_MAX_OUT))
         finally:
             silent_remove(MIN_MAX_OUT,  disable=DISABLE_REMOVE)
+
+    def testProfile(self):
+        try:
+            with capture_stdout(main, ["-f", MIN_MAX_INPUT, "-n", "-d", ",", "-m", MIN_MAX_FILE, "--profile",
+                                       "--profile_file", PROFILE_OUT]) as output:
+                self.assertTrue("Profile:" in output)
+                for stage in ["read", "reduce", "percentile", "bound check", "write"]:
+                    self.assertTrue(stage in output)
+            self.assertFalse(diff_lines(MIN_MAX_OUT, GOOD_MIN_MAX_OUT))
+            with open(PROFILE_OUT) as f:
+                profile = json.load(f)
+            self.assertEqual([stage['stage'] for stage in profile['stages']],
+                             ["read", "reduce", "percentile", "write", "bound check"])
+            self.assertEqual(profile['files'], [MIN_MAX_INPUT])
+            self.assertTrue(profile['total']['wall_s'] >= sum(stage['wall_s'] for stage in profile['stages']))
+        finally:
+            silent_remove(MIN_MAX_OUT, disable=DISABLE_REMOVE)
+            silent_remove(PROFILE_OUT, disable=DISABLE_REMOVE)
+
+    def testProfilePaths(self):
+        # the percentiles of grouped and weighted stats are timed on their own; rolling stats are written as 'write'
+        rolling_args = ["-c", "pka_148,148d0,203d0", "--rolling", "5"]
+        write_calls = []
+        try:
+            for extra_args in [["--group_by", "4", "-c", "0,1,2"], ["--weights", "1"], rolling_args[:2],
+                               rolling_args]:
+                main(["-f", HIST_INPUT, "-n", "-q", "--profile_file", PROFILE_OUT] + extra_args)
+                with open(PROFILE_OUT) as f:
+                    stages = {stage['stage']: stage for stage in json.load(f)['stages']}
+                self.assertEqual(sorted(stages), ["percentile", "read", "reduce", "write"])
+                write_calls.append(stages['write']['calls'])
+            self.assertEqual(write_calls[3], write_calls[2] + 1)
+        finally:
+            [silent_remove(o_file, disable=DISABLE_REMOVE) for o_file in [HIST_OUT, HIST_ROLLING_OUT, PROFILE_OUT]]
+
+
+class TestPerColStream(unittest.TestCase):
+    def testDefInpStream(self):
+        test_input = ["-f", DEF_INPUT, "-d", ' ', "--stream", "--chunk_rows", "3"]
+        try:
+            with capture_stdout(main, test_input) as output:
+                self.assertTrue(GOOD_OUT in output)
+                self.assertFalse(diff_lines(CSV_OUT, GOOD_CSV_OUT))
+        finally:
+            silent_remove(CSV_OUT, disable=DISABLE_REMOVE)
+
+    def testHistStream(self):
+        try:
+            main(["-f", HIST_INPUT, "-n", "-d", ",", "-s", "--stream", "--chunk_rows", "7"])
+            self.assertFalse(diff_lines(HIST_OUT, GOOD_HIST_OUT))
+            self.assertFalse(diff_lines(HIST_COUNT, GOOD_HIST_COUNT))
+        finally:
+            [silent_remove(o_file,
+                           disable=DISABLE_REMOVE) for o_file in [HIST_PNG1, HIST_PNG2, HIST_PNG3,
+                                                                  HIST_OUT, HIST_COUNT, ]]
+
+    def testMinMaxStream(self):
+        try:
+            main(["-f", MIN_MAX_INPUT, "-n", "-d", ",", "-m", MIN_MAX_FILE, "--stream", "--chunk_rows", "4"])
+            self.assertFalse(diff_lines(MIN_MAX_OUT, GOOD_MIN_MAX_OUT))
+        finally:
+            silent_remove(MIN_MAX_OUT, disable=DISABLE_REMOVE)
+
+    def testProfileStream(self):
+        try:
+            with capture_stdout(main, ["-f", DEF_INPUT, "-d", ' ', "--stream", "--chunk_rows", "3",
+                                       "--profile_file", PROFILE_OUT]) as output:
+                self.assertFalse("Profile:" in output)
+            self.assertFalse(diff_lines(CSV_OUT, GOOD_CSV_OUT))
+            with open(PROFILE_OUT) as f:
+                stages = {stage['stage']: stage for stage in json.load(f)['stages']}
+            self.assertTrue(stages['read']['calls'] > 1)
+            self.assertTrue(stages['reduce']['calls'] > 1)
+            self.assertTrue("percentile" in stages)
+        finally:
+            silent_remove(CSV_OUT, disable=DISABLE_REMOVE)
+            silent_remove(PROFILE_OUT, disable=DISABLE_REMOVE)
+
+    def testMergedAccumulators(self):
+        # small sketches, so that the percentiles are approximated
+        rng = np.random.RandomState(0)
+        data = np.column_stack((rng.normal(size=20000), rng.exponential(size=20000)))
+        accumulators = [ColumnAccumulator(2, sketch_size=500) for _ in range(2)]
+        for start in range(0, len(data), 1500):
+            accumulators[(start // 1500) % 2].update(data[start:start + 1500])
+        accumulators[0].merge(accumulators[1])
+        stream_stats = accumulators[0].stats()
+        good_stats = calc_stats(data)
+        for key in [MIN_KEY, MAX_KEY, AVG_KEY, STD_KEY]:
+            self.assertTrue(np.allclose(stream_stats[key], good_stats[key]))
+        for stream_pct, good_pct in zip(stream_stats[PCT_KEY], good_stats[PCT_KEY]):
+            self.assertTrue(np.allclose(stream_pct, good_pct, atol=0.02))
+
+
+class TestPerColIncremental(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data_file = os.path.join(self.tmp_dir, os.path.basename(HIST_INPUT))
+        with open(HIST_INPUT) as f:
+            self.lines = f.readlines()
+        self.test_input = ["-f", self.data_file, "-n", "-s", "--no_png", "--incremental", "--chunk_rows", "4"]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def testAppendedRows(self):
+        # the rows are added in parts, the last without a line ending until the next part
+        with open(self.data_file, 'w') as f:
+            f.write("".join(self.lines[:15]))
+        main(self.test_input)
+        with open(self.data_file, 'a') as f:
+            f.write("".join(self.lines[15:30]) + self.lines[30][:10])
+        main(self.test_input)
+        with open(self.data_file, 'a') as f:
+            f.write(self.lines[30][10:] + "".join(self.lines[31:]))
+        with capture_stderr(main, self.test_input) as output:
+            self.assertFalse("changed" in output)
+        self.assertFalse(diff_lines(os.path.join(self.tmp_dir, os.path.basename(HIST_OUT)), GOOD_HIST_OUT))
+        self.assertFalse(diff_lines(os.path.join(self.tmp_dir, os.path.basename(HIST_COUNT)), GOOD_HIST_COUNT))
+
+    def testChangedFile(self):
+        with open(self.data_file, 'w') as f:
+            f.write("".join(self.lines[:15]))
+        main(self.test_input)
+        with open(self.data_file, 'w') as f:
+            f.write("".join(self.lines[:14] + self.lines[16:]))
+        with capture_stderr(main, self.test_input) as output:
+            self.assertTrue("changed" in output)
+        # the same as reading the changed file at once
+        stats_file = os.path.join(self.tmp_dir, os.path.basename(HIST_OUT))
+        shutil.copy(stats_file, stats_file + ".incremental")
+        main(self.test_input[:-3] + ["--stream"])
+        self.assertFalse(diff_lines(stats_file + ".incremental", stats_file))
+
+
+class TestPerColBatch(unittest.TestCase):
+    def testListFile(self):
+        try:
+            main(["-l", LIST_INPUT, "-d", ' ', "-o", SUB_DATA_DIR])
+            self.assertFalse(diff_lines(CSV_OUT, GOOD_CSV_OUT))
+            self.assertFalse(diff_lines(CSV_HEADER_OUT, GOOD_CSV_OUT))
+            self.assertFalse(diff_lines(SUMMARY_OUT, GOOD_SUMMARY_OUT))
+            with capture_stdout(main, ["-l", LIST_INPUT, "-d", ' ', "-o", SUB_DATA_DIR, "-q"]) as output:
+                self.assertEqual(output, "")
+            self.assertFalse(diff_lines(SUMMARY_OUT, GOOD_SUMMARY_OUT))
+        finally:
+            [silent_remove(o_file, disable=DISABLE_REMOVE) for o_file in [CSV_OUT, CSV_HEADER_OUT, SUMMARY_OUT]]
+
+    def testGlobWorkers(self):
+        try:
+            main(["-g", "qm_box_sizes*.txt", "-r", SUB_DATA_DIR, "-d", ' ', "-o", SUB_DATA_DIR, "-j", "2"])
+            self.assertFalse(diff_lines(CSV_OUT, GOOD_CSV_OUT))
+            self.assertFalse(diff_lines(CSV_HEADER_OUT, GOOD_CSV_OUT))
+            self.assertFalse(diff_lines(SUMMARY_OUT, GOOD_SUMMARY_OUT))
+        finally:
+            [silent_remove(o_file, disable=DISABLE_REMOVE) for o_file in [CSV_OUT, CSV_HEADER_OUT, SUMMARY_OUT]]
+
+    def testBatchBadFile(self):
+        # files that cannot be read are reported, and the others still summarized
+        try:
+            with capture_stderr(main, ["-f", VEC_INPUT, "-l", LIST_INPUT, "-d", ' ', "-o", SUB_DATA_DIR]) as output:
+                self.assertTrue("File contains a vector" in output)
+            self.assertFalse(diff_lines(SUMMARY_OUT, GOOD_SUMMARY_OUT))
+        finally:
+            [silent_remove(o_file, disable=DISABLE_REMOVE) for o_file in [CSV_OUT, CSV_HEADER_OUT, SUMMARY_OUT]]
@@ -4,7 +4,10 @@
 """
 Tests for the common lib.
 """
+import bz2
+import gzip
 import logging
+import lzma
 import shutil
 import tempfile
 import unittest
@@ -15,7 +18,11 @@ from che696_examples.common import (find_files_by_dir, read_csv, write_csv, str_
                                     InvalidDataError,
                                     pbc_calc_vector, pbc_vector_avg, unit_vector, vec_angle, vec_dihedral, calc_k,
                                     read_csv_header, get_fname_root, fmt_row_data, quote, dequote,
-                                    list_to_file, silent_remove, read_csv_to_dict)
+                                    list_to_file, silent_remove, read_csv_to_dict, np_float_array_from_file,
+                                    cached_np_float_array_from_file, cache_file_base, _np_float_array_from_blocks,
+                                    _FloatRowFiller, FloatArrayChunks, complete_lines_size, read_column,
+                                    cached_read_column)
+import che696_examples.common as common
 
 __author__ = 'hbmayes'
 
@@ -29,6 +36,7 @@ DATA_DIR = os.path.join(os.path.dirname(__file__), 'test_data')
 SUB_DATA_DIR = os.path.join(DATA_DIR, 'common')
 PDB_DIR = os.path.join(DATA_DIR, 'pdb_edit')
 FES_DIR = os.path.join(SUB_DATA_DIR, 'fes_out')
+COL_STATS_DIR = os.path.join(DATA_DIR, 'col_stats')
 DEF_FILE_PAT = 'fes*.out'
 CORR_KEY = 'corr'
 COORD_KEY = 'coord'
@@ -49,6 +57,8 @@ ORIG_WHAM_FNAME = ORIG_WHAM_ROOT + ".txt"
 ORIG_WHAM_PATH = os.path.join(DATA_DIR, ORIG_WHAM_FNAME)
 SHORT_WHAM_PATH = os.path.join(DATA_DIR, ORIG_WHAM_FNAME)
 EMPTY_CSV = os.path.join(SUB_DATA_DIR, 'empty.csv')
+BOX_SIZES_FILE = os.path.join(COL_STATS_DIR, 'qm_box_sizes.txt')
+MIXED_DATA_FILE = os.path.join(COL_STATS_DIR, 'msm_sum_output.csv')
 
 OUT_PFX = 'rad_'
 
@@ -174,6 +184,242 @@ class TestReadFirstRow(unittest.TestCase):
         self.assertIsNone(read_csv_header(EMPTY_CSV))
 
 
+class TestNpFloatArrayFromFile(unittest.TestCase):
+    def testNumeric(self):
+        data_array, header_row, hist_data = np_float_array_from_file(BOX_SIZES_FILE)
+        self.assertTrue(np.allclose(data_array, np.genfromtxt(BOX_SIZES_FILE)))
+        self.assertIsNone(header_row)
+        self.assertEqual(hist_data, {})
+
+    def testMixedWithHeader(self):
+        data_array, header_row, hist_data = np_float_array_from_file(MIXED_DATA_FILE, delimiter=',', header=True,
+                                                                     gather_hist=True)
+        self.assertEqual(data_array.shape, (5, 6))
+        self.assertEqual(data_array.dtype, np.float64)
+        self.assertEqual(header_row[:2], ['pka_203', '(0, 1)'])
+        self.assertTrue(np.isnan(data_array[:, [2, 4]]).all())
+        self.assertEqual(data_array[4, 3], 0.)
+        self.assertAlmostEqual(data_array[0, 0], 6.109181055)
+        self.assertEqual(sorted(hist_data), [2, 3, 4])
+        self.assertEqual(hist_data[2]['(26, 10)'], 3)
+
+    def testEmptyFile(self):
+        with self.assertRaises(InvalidDataError):
+            np_float_array_from_file(EMPTY_CSV)
+
+    def testFloat32(self):
+        for data_file, delimiter in [(BOX_SIZES_FILE, ' '), (MIXED_DATA_FILE, ',')]:
+            good_array = np_float_array_from_file(data_file, delimiter=delimiter, header=True)[0]
+            data_array = np_float_array_from_file(data_file, delimiter=delimiter, header=True, dtype=np.float32)[0]
+            self.assertEqual(data_array.dtype, np.float32)
+            self.assertTrue(np.allclose(data_array, good_array, equal_nan=True))
+
+    def testMmapSmallBlocks(self):
+        # blocks smaller than a line, so that each is extended to the end of a line
+        orig_block_bytes = common.TEXT_BLOCK_BYTES
+        try:
+            common.TEXT_BLOCK_BYTES = 10
+            data_array, num_rows, header_row, _, _, rest_lines = _np_float_array_from_blocks(BOX_SIZES_FILE)
+        finally:
+            common.TEXT_BLOCK_BYTES = orig_block_bytes
+        self.assertTrue(np.array_equal(data_array[:num_rows], np.genfromtxt(BOX_SIZES_FILE)))
+        self.assertIsNone(header_row)
+        self.assertIsNone(rest_lines)
+
+    def testLateBlockFallback(self):
+        # numeric rows, then a non-numeric entry, a comment, and a last line without a new line: the rows of the
+        # blocks before the first of these are kept, and only the lines from that block on are read row by row
+        rows = ["{} {}".format(row, row * 0.5) for row in range(40)]
+        tmp_dir = tempfile.mkdtemp()
+        data_file = os.path.join(tmp_dir, 'late.txt')
+        with open(data_file, 'w') as f:
+            f.write("\n".join(rows + ["40 ALA", "# comment", "41 20.5"]))
+        orig_block_bytes = common.TEXT_BLOCK_BYTES
+        try:
+            common.TEXT_BLOCK_BYTES = 100
+            _, num_rows, _, _, line_len, rest_lines = _np_float_array_from_blocks(data_file)
+            self.assertEqual(line_len, 2)
+            self.assertTrue(0 < num_rows <= 40)
+            self.assertEqual(next(rest_lines).strip(), (rows + ["40 ALA"])[num_rows])
+            data_array, _, hist_data = np_float_array_from_file(data_file, gather_hist=True)
+        finally:
+            common.TEXT_BLOCK_BYTES = orig_block_bytes
+            shutil.rmtree(tmp_dir)
+        good_array = np.array([[row, row * 0.5] for row in range(40)] + [[40, np.nan], [41, 20.5]])
+        self.assertTrue(np.allclose(data_array, good_array, equal_nan=True))
+        self.assertEqual(hist_data, {1: {'ALA': 1}})
+
+    def testUsecols(self):
+        good_array = np.genfromtxt(BOX_SIZES_FILE)[:, [2, 0]]
+        data_array = np_float_array_from_file(BOX_SIZES_FILE, usecols=[2, 0])[0]
+        self.assertTrue(np.array_equal(data_array, good_array))
+        data_array, header_row, hist_data = np_float_array_from_file(MIXED_DATA_FILE, delimiter=',', header=True,
+                                                                     gather_hist=True, usecols=['(0, 1)', 2])
+        self.assertEqual(header_row, ['(0, 1)', '(0, 1)_max_rls'])
+        self.assertEqual(data_array.shape, (5, 2))
+        self.assertEqual(sorted(hist_data), [1])
+
+    def testCategoricalColumns(self):
+        # column 1 is set aside after its first row (with numbers and 'nan' among its labels); column 0 after its
+        # third row, and no longer after the next flush, as it then has only numbers
+        rows = [["1.5", "ALA", "2"], ["2.5", "GLY", "nan"], ["N/A", "3", "4"], ["4.5", "ALA", "5"],
+                ["5.5", "nan", "6"], ["6.5", "GLY", "7"], ["7.5", "ALA", "8"]]
+        good_array = np.array([[1.5, np.nan, 2.], [2.5, np.nan, np.nan], [np.nan, 3., 4.], [4.5, np.nan, 5.],
+                               [5.5, np.nan, 6.], [6.5, np.nan, 7.], [7.5, np.nan, 8.]])
+        data_array = np.empty((len(rows), 3))
+        hist_data = {}
+        filler = _FloatRowFiller(hist_data, block_rows=2)
+        for row_num, row in enumerate(rows):
+            filler.fill(data_array, row_num, list(row))
+            if row_num == 4:
+                self.assertEqual(filler.cat_cols, [1])
+        filler.flush(data_array)
+        self.assertTrue(np.allclose(data_array, good_array, equal_nan=True))
+        self.assertEqual(hist_data, {0: {'N/A': 1}, 1: {'ALA': 3, 'GLY': 2}})
+
+    def testMmapFallback(self):
+        # non-numerical entries are left to the csv reader
+        self.assertIsNone(_np_float_array_from_blocks(MIXED_DATA_FILE, delimiter=',', header=True))
+        self.assertIsNone(_np_float_array_from_blocks(EMPTY_CSV, delimiter=','))
+
+
+class TestCachedNpFloatArray(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data_file = os.path.join(self.tmp_dir, os.path.basename(MIXED_DATA_FILE))
+        shutil.copy(MIXED_DATA_FILE, self.data_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def testCacheReuse(self):
+        good_data = np_float_array_from_file(self.data_file, delimiter=',', header=True, gather_hist=True)
+        first_data = cached_np_float_array_from_file(self.data_file, delimiter=',', header=True, gather_hist=True)
+        self.assertTrue(os.path.isfile(cache_file_base(self.data_file) + '.npy'))
+        cached_data = cached_np_float_array_from_file(self.data_file, delimiter=',', header=True, gather_hist=True)
+        self.assertIsInstance(cached_data[0], np.memmap)
+        for data in [first_data, cached_data]:
+            self.assertTrue(np.array_equal(data[0], good_data[0], equal_nan=True))
+            self.assertEqual(data[1], good_data[1])
+            self.assertEqual(data[2], good_data[2])
+
+    def testCacheInvalidated(self):
+        cache_dir = os.path.join(self.tmp_dir, 'cache')
+        os.mkdir(cache_dir)
+        cached_np_float_array_from_file(self.data_file, delimiter=',', header=True, cache_dir=cache_dir)
+        # without a header row, the header is read as a row of nan
+        self.assertEqual(cached_np_float_array_from_file(self.data_file, delimiter=',', cache_dir=cache_dir)[0].shape,
+                         (6, 6))
+        with open(self.data_file, 'a') as f:
+            f.write("1.0,2.0,3.0,4.0,5.0,6.0\n")
+        data_array = cached_np_float_array_from_file(self.data_file, delimiter=',', header=True,
+                                                     cache_dir=cache_dir)[0]
+        self.assertEqual(data_array.shape, (6, 6))
+        self.assertEqual(data_array[-1, -1], 6.)
+        data_array = cached_np_float_array_from_file(self.data_file, delimiter=',', header=True,
+                                                     cache_dir=cache_dir, dtype=np.float32)[0]
+        self.assertEqual(data_array.dtype, np.float32)
+
+    def testCachedColumn(self):
+        good_column = read_column(self.data_file, 2, delimiter=',', header=True)
+        for col in ['(0, 1)_max_rls', 2, '(0, 1)_max_rls']:
+            column = cached_read_column(self.data_file, col, delimiter=',', header=True)
+            self.assertTrue(np.array_equal(column[0], good_column[0]))
+            self.assertEqual(column[0].dtype, object)
+            self.assertEqual(column[1:], good_column[1:])
+        self.assertEqual(len([f_name for f_name in os.listdir(self.tmp_dir) if f_name.endswith('.npy')]), 2)
+        with open(self.data_file, 'a') as f:
+            f.write('1.0,2.0,"(1, 2)",4.0,5.0,6.0\n')
+        column = cached_read_column(self.data_file, 2, delimiter=',', header=True)
+        self.assertEqual(column[0][-1], "(1, 2)")
+
+
+class TestFloatArrayChunksRange(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data_file = os.path.join(self.tmp_dir, os.path.basename(MIXED_DATA_FILE))
+        shutil.copy(MIXED_DATA_FILE, self.data_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def testCompleteLinesSize(self):
+        file_size = os.path.getsize(self.data_file)
+        self.assertEqual(complete_lines_size(self.data_file), file_size)
+        with open(self.data_file, 'a') as f:
+            f.write("1.0,2.0,3.0")
+        self.assertEqual(complete_lines_size(self.data_file), file_size)
+
+    def testOffset(self):
+        # the rows read in two parts are the rows read at once
+        good_array = np_float_array_from_file(self.data_file, delimiter=',', header=True)[0]
+        with open(self.data_file, 'rb') as f:
+            lines = f.readlines()
+        middle = len(b''.join(lines[:3]))
+        first_chunks = FloatArrayChunks(self.data_file, delimiter=',', header=True, chunk_rows=2, usecols=[0, 5],
+                                        end_offset=middle)
+        first_rows = np.concatenate([chunk.copy() for chunk in first_chunks])
+        self.assertEqual(first_chunks.usecols, [0, 5])
+        self.assertEqual(first_chunks.line_len, 6)
+        # from an offset, a single row is read without error
+        last_rows = np.concatenate([chunk.copy() for chunk in
+                                    FloatArrayChunks(self.data_file, delimiter=',', chunk_rows=2, usecols=[0, 5],
+                                                     offset=middle, end_offset=middle + len(lines[3]))])
+        # the header and two rows, then one row
+        self.assertTrue(np.array_equal(np.concatenate((first_rows, last_rows)), good_array[:3, [0, 5]]))
+
+
+class TestCompressedInput(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def compressed_copy(self, src_file, opener, f_name):
+        comp_file = os.path.join(self.tmp_dir, f_name)
+        with open(src_file, 'rb') as f_in:
+            with opener(comp_file, 'wb') as f_out:
+                shutil.copyfileobj(f_in, f_out)
+        return comp_file
+
+    def testReaders(self):
+        openers = [(gzip.open, '.gz'), (bz2.open, '.bz2'), (lzma.open, '.xz')]
+        if common.zstandard is not None:
+            openers.append((common.zstandard.open, '.zst'))
+        good_array = np_float_array_from_file(MIXED_DATA_FILE, delimiter=',', header=True, gather_hist=True)
+        good_numeric = np_float_array_from_file(BOX_SIZES_FILE)[0]
+        for opener, ext in openers:
+            # found by extension, and by the first bytes of the file
+            for f_name in ['data.csv' + ext, 'data_' + ext[1:] + '.csv']:
+                comp_file = self.compressed_copy(MIXED_DATA_FILE, opener, f_name)
+                data_array, header_row, hist_data = np_float_array_from_file(comp_file, delimiter=',', header=True,
+                                                                             gather_hist=True)
+                self.assertTrue(np.array_equal(data_array, good_array[0], equal_nan=True))
+                self.assertEqual(header_row, good_array[1])
+                self.assertEqual(hist_data, good_array[2])
+                self.assertEqual(read_csv_header(comp_file), read_csv_header(MIXED_DATA_FILE))
+                self.assertEqual(read_csv(comp_file), read_csv(MIXED_DATA_FILE))
+            comp_file = self.compressed_copy(BOX_SIZES_FILE, opener, 'box.txt' + ext)
+            self.assertTrue(np.array_equal(np_float_array_from_file(comp_file)[0], good_numeric))
+
+    def testBzhText(self):
+        # plain text starting with the letters of the bz2 magic is not taken for bz2
+        text_file = os.path.join(self.tmp_dir, 'bzh.csv')
+        with open(text_file, 'w') as f:
+            f.write("BZh_a,b\n1,2\n3,4\n")
+        self.assertEqual(read_csv_header(text_file), ['BZh_a', 'b'])
+        data_array, header_row, _ = np_float_array_from_file(text_file, delimiter=',', header=True)
+        self.assertEqual(header_row, ['BZh_a', 'b'])
+        self.assertTrue(np.array_equal(data_array, [[1., 2.], [3., 4.]]))
+        empty_bz2 = self.compressed_copy(os.devnull, bz2.open, 'empty')
+        self.assertEqual(common._file_compression(empty_bz2), common.BZ2)
+
+    def testOutFname(self):
+        self.assertEqual(os.path.basename(create_out_fname('data.csv.gz', prefix='stats_', ext='.csv')),
+                         'stats_data.csv')
+
+
 class TestFnameManipulation(unittest.TestCase):
     def testOutFname(self):
         """